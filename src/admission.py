@@ -0,0 +1,221 @@
+# Admission control for the multi-agent pipeline, shared by every request of the process.
+# Each stage (request, manager, scheduler, worker, subprocess) has a concurrency limit and a bounded queue.
+# Waiters are queued per session and served round-robin, so one session fanning out to many workers can not
+# starve the others. A full queue rejects at once with a retry-after estimate, and a new request is rejected
+# at the door while any stage behind it is saturated, instead of piling more work onto it.
+# The session of the running request is kept in a context variable, like the deadline, so inner stages need
+# no extra arguments.
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from .deadline import DeadlineExceeded, clamp_timeout, remaining
+
+ADMISSION_REQUEST = "request"
+ADMISSION_MANAGER = "manager"
+ADMISSION_SCHEDULER = "scheduler"
+ADMISSION_WORKER = "worker"
+ADMISSION_SUBPROCESS = "subprocess"
+DEFAULT_QUEUE_TIMEOUT = 30
+MAX_RETRY_AFTER = 60
+# (concurrency, queue size) of each stage
+DEFAULT_LIMITS = {
+    ADMISSION_REQUEST: (16, 64),
+    ADMISSION_MANAGER: (16, 128),
+    ADMISSION_SCHEDULER: (16, 128),
+    ADMISSION_WORKER: (16, 256),
+    ADMISSION_SUBPROCESS: ((os.cpu_count() or 2) * 2, 512),
+}
+
+_session = contextvars.ContextVar("admission_session", default="")
+
+class ServiceUnavailable(Exception):
+    """The service is overloaded or draining for shutdown, the client should retry after retry_after seconds."""
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+@contextmanager
+def session_scope(session_id: str):
+    """Queue the enclosed work of every stage under session_id."""
+    token = _session.set(session_id or "")
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+class AdmissionStage:
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = max(limit, 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # slots and waiters are bound to the running loop
+        self.loop = None
+        self.active = 0
+        self.queued = 0
+        self.waiters = OrderedDict()
+        # moving average of the time a slot is held, for the retry-after estimate
+        self.hold_time = 0.0
+        self.stats = {"admitted": 0, "waits": 0, "wait_time": 0.0, "max_wait": 0.0, "rejected": 0, "timeouts": 0,
+                      "peak_active": 0, "peak_queued": 0}
+
+    def bind(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # a new loop (the CLI runs one per question), the slots of the old one went with it
+            self.loop = loop
+            self.active = 0
+            self.queued = 0
+            self.waiters.clear()
+
+    def is_full(self) -> bool:
+        return self.active >= self.limit and self.queued >= self.max_queue
+
+    def retry_after(self) -> int:
+        # time to serve the queue ahead at the current pace
+        hold_time = self.hold_time or 1
+        return min(max(math.ceil(hold_time * (self.queued + 1) / self.limit), 1), MAX_RETRY_AFTER)
+
+    def reject(self, message: str):
+        self.stats["rejected"] += 1
+        raise ServiceUnavailable(f"{message}, retry later", self.retry_after())
+
+    async def acquire(self, session: str):
+        self.bind()
+        if self.active < self.limit and not self.queued:
+            self.grant()
+            return
+        if self.is_full():
+            self.reject(f"Too many {self.name} requests waiting ({self.queued})")
+        future = self.loop.create_future()
+        self.waiters.setdefault(session, deque()).append(future)
+        self.queued += 1
+        self.stats["peak_queued"] = max(self.stats["peak_queued"], self.queued)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout=clamp_timeout(self.queue_timeout))
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # the slot was handed over just as the wait ended, pass it on
+                self.release(0)
+            else:
+                self.remove(session, future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
+                if remaining() == 0:
+                    raise DeadlineExceeded(f"Deadline exceeded waiting for a {self.name} slot") from e
+                self.reject(f"Waited {time.monotonic() - start:.1f}s for a {self.name} slot")
+            raise
+        wait = time.monotonic() - start
+        self.stats["waits"] += 1
+        self.stats["wait_time"] += wait
+        self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+        self.stats["admitted"] += 1
+
+    def grant(self):
+        self.active += 1
+        self.stats["admitted"] += 1
+        self.stats["peak_active"] = max(self.stats["peak_active"], self.active)
+
+    def remove(self, session: str, future: asyncio.Future):
+        queue = self.waiters.get(session)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self.queued -= 1
+        if not queue:
+            del self.waiters[session]
+
+    def release(self, held: float):
+        if self.loop is not asyncio.get_running_loop():
+            return
+        self.hold_time = held if not self.hold_time else self.hold_time * 0.8 + held * 0.2
+        while self.waiters:
+            # the session at the front gets the slot and goes to the back, round-robin across sessions
+            session, queue = next(iter(self.waiters.items()))
+            future = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.waiters.move_to_end(session)
+            else:
+                del self.waiters[session]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["limit"] = self.limit
+        stats["max_queue"] = self.max_queue
+        stats["active"] = self.active
+        stats["queued"] = self.queued
+        stats["queued_sessions"] = len(self.waiters)
+        stats["avg_wait"] = stats["wait_time"] / stats["waits"] if stats["waits"] else 0.0
+        stats["avg_hold"] = self.hold_time
+        return stats
+
+
+class AdmissionController:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.enabled = config.get("ADMISSION_ENABLED", True)
+        queue_timeout = config.get("ADMISSION_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)
+        limits = dict(DEFAULT_LIMITS)
+        # at most as many workers as the pool holds
+        limits[ADMISSION_WORKER] = (config.get("WORKER_POOL_MAX_SIZE", limits[ADMISSION_WORKER][0]), limits[ADMISSION_WORKER][1])
+        self.stages = {}
+        for name, (limit, max_queue) in limits.items():
+            prefix = f"ADMISSION_{name.upper()}"
+            self.stages[name] = AdmissionStage(
+                name,
+                config.get(f"{prefix}_CONCURRENCY", limit),
+                config.get(f"{prefix}_QUEUE", max_queue),
+                config.get(f"{prefix}_QUEUE_TIMEOUT", queue_timeout),
+            )
+
+    def check(self):
+        """Reject a new request at once while the queue of any stage is full."""
+        if not self.enabled:
+            return
+        for stage in self.stages.values():
+            if stage.is_full():
+                stage.reject(f"The {stage.name} queue is full ({stage.queued} waiting)")
+
+    @asynccontextmanager
+    async def slot(self, name: str):
+        """Hold a slot of stage name for the enclosed work, queueing fairly for it."""
+        if not self.enabled:
+            yield
+            return
+        stage = self.stages[name]
+        if name == ADMISSION_REQUEST:
+            self.check()
+        await stage.acquire(_session.get())
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            stage.release(time.monotonic() - start)
+
+    def get_stats(self) -> dict:
+        return {name: stage.get_stats() for name, stage in self.stages.items()}
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+def get_admission_controller(config: dict, log: logging.Logger) -> AdmissionController:
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(config, log)
+        return _controller
@@ -0,0 +1,256 @@
+# Async service behind the HTTP server: one assistant per session, built by AssistantCreator.
+# Requests of different sessions run concurrently on the event loop, requests of one session are serialized,
+# since an assistant keeps per-conversation state. Idle sessions are dropped (their history stays in the session
+# store). Identical questions asked at once share one run (coalescing): within a session, or with the global scope
+# also the opening questions of different sessions.
+# Requests pass the admission controller, which rejects them fast with a retry-after when overloaded.
+# close() stops accepting requests and drains the in-flight multi-agent runs before the process exits.
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import aclosing
+from .assist_creator import AssistantCreator, EXECUTOR_PC, MODEL_OPENAI
+from .const import STAGE_ANSWER
+from .deadline import deadline_scope, DEFAULT_REQUEST_TIMEOUT
+from .admission import ServiceUnavailable, ADMISSION_REQUEST, get_admission_controller, session_scope
+from .coalescer import get_request_coalescer, normalize_question
+from .model.rate_limiter import get_rate_limiter
+from session_store import get_session_store
+
+SERVICE_MODE_MULTI = "multi"
+SERVICE_MODE_SINGLE = "single"
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_SESSION_IDLE_TIMEOUT = 1800
+DEFAULT_DRAIN_TIMEOUT = 60
+COALESCE_SCOPE_GLOBAL = "global"
+COALESCE_SCOPE_SESSION = "session"
+
+class Session:
+    def __init__(self, session_id: str, assistant):
+        self.session_id = session_id
+        self.assistant = assistant
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class AiService:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.creator = AssistantCreator(config, log)
+        self.mode = config.get("SERVICE_MODE", SERVICE_MODE_MULTI)
+        self.executor_choice = config.get("SERVICE_EXECUTOR", EXECUTOR_PC)
+        self.model_choice = config.get("SERVICE_MODEL", MODEL_OPENAI)
+        self.request_timeout = config.get("REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT)
+        self.max_sessions = config.get("SERVICE_MAX_SESSIONS", DEFAULT_MAX_SESSIONS)
+        self.session_idle_timeout = config.get("SERVICE_SESSION_IDLE_TIMEOUT", DEFAULT_SESSION_IDLE_TIMEOUT)
+        self.drain_timeout = config.get("SERVICE_DRAIN_TIMEOUT", DEFAULT_DRAIN_TIMEOUT)
+        # with several worker processes a session may move between them, its history is reread from the store
+        self.shared_sessions = config.get("SERVICE_WORKERS", 1) > 1 and bool(config.get("SQL_CONN_STR"))
+        self.admission = get_admission_controller(config, log)
+        # identical questions in flight are answered once, SERVICE_COALESCE_* staleness rules
+        self.coalescer = get_request_coalescer(config, log, "SERVICE")
+        self.coalesce_scope = config.get("SERVICE_COALESCE_SCOPE", COALESCE_SCOPE_SESSION)
+        self.sessions = OrderedDict()
+        self.accepting = True
+        self.inflight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.stats = {"requests": 0, "streams": 0, "errors": 0, "rejected": 0, "coalesced": 0, "sessions_created": 0,
+                      "sessions_expired": 0}
+
+    def create_assistant(self, session_id: str):
+        if self.mode == SERVICE_MODE_SINGLE:
+            return self.creator.create_assistant(self.executor_choice, self.model_choice, session_id)
+        return self.creator.create_muti_assistant(session_id)
+
+    def get_session(self, session_id: str) -> Session:
+        self.expire_sessions()
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = Session(session_id, self.create_assistant(session_id))
+            self.sessions[session_id] = session
+            self.stats["sessions_created"] += 1
+            while len(self.sessions) > self.max_sessions and self.evict_oldest():
+                pass
+        self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def evict_oldest(self) -> bool:
+        # a session in use is never dropped
+        for session_id, session in self.sessions.items():
+            if not session.lock.locked():
+                del self.sessions[session_id]
+                return True
+        return False
+
+    def expire_sessions(self):
+        now = time.monotonic()
+        expired = [session_id for session_id, session in self.sessions.items()
+                   if now - session.last_used > self.session_idle_timeout and not session.lock.locked()]
+        for session_id in expired:
+            del self.sessions[session_id]
+        self.stats["sessions_expired"] += len(expired)
+
+    def remove_session(self, session_id: str) -> bool:
+        """Forget a session and its stored history."""
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.assistant.chat_history.clear_history()
+        else:
+            get_session_store(self.config, self.log).delete_session(session_id)
+        return True
+
+    def check(self):
+        """Reject a request up front when the service is draining or overloaded."""
+        if not self.accepting:
+            self.stats["rejected"] += 1
+            raise ServiceUnavailable("Service is shutting down", retry_after=self.drain_timeout)
+        try:
+            self.admission.check()
+        except ServiceUnavailable:
+            self.stats["rejected"] += 1
+            raise
+
+    def begin(self):
+        self.check()
+        self.inflight += 1
+        self.idle.clear()
+
+    def end(self):
+        self.inflight -= 1
+        if self.inflight == 0:
+            self.idle.set()
+
+    async def load_history(self, session: Session):
+        if self.shared_sessions:
+            store = get_session_store(self.config, self.log)
+            session.assistant.set_chat_history(await asyncio.to_thread(store.reload, session.session_id))
+
+    async def save_history(self):
+        if self.shared_sessions:
+            await asyncio.to_thread(get_session_store(self.config, self.log).flush)
+
+    def coalesce_key(self, question: str, session: Session):
+        # a follow-up is answered from the history of its session, with the global scope only a question that
+        # opens a conversation shares its run with other sessions
+        scope = session.session_id
+        if self.coalesce_scope == COALESCE_SCOPE_GLOBAL and not self.has_history(session):
+            scope = ""
+        return (self.mode, self.executor_choice, self.model_choice, scope, normalize_question(question))
+
+    def has_history(self, session: Session) -> bool:
+        # a shared session may have turns in the store this worker has not loaded yet,
+        # a locked session is answering a question that will be in the history
+        if self.shared_sessions or session.lock.locked():
+            return True
+        return session.assistant.chat_history.get_token_count() > 0
+
+    async def ask(self, question: str, session_id: str = None) -> dict:
+        """Answer a question in a session, a new session is opened when none is given.
+        Identical questions in flight share one run, every session gets the answer in its history."""
+        self.begin()
+        try:
+            session_id = session_id or uuid.uuid4().hex
+            session = self.get_session(session_id)
+            self.stats["requests"] += 1
+            flight, _ = self.coalescer.join(self.coalesce_key(question, session),
+                                            lambda: self.answer(session, question), owner=session_id)
+            answer = await flight.result()
+            if flight.owner != session_id:
+                await self.share_answer(session, question, answer)
+            return {"session_id": session_id, "answer": answer}
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.end()
+
+    async def answer(self, session: Session, question: str) -> str:
+        with session_scope(session.session_id):
+            # queue on the session first, a request slot is only held while the request can run
+            async with session.lock, self.admission.slot(ADMISSION_REQUEST):
+                await self.load_history(session)
+                with deadline_scope(self.request_timeout):
+                    if self.mode == SERVICE_MODE_SINGLE:
+                        answer = await session.assistant.aask(question)
+                    else:
+                        answer = await session.assistant.aask_with_scheduler(question)
+                await self.save_history()
+        return answer
+
+    async def share_answer(self, session: Session, question: str, answer: str):
+        """Record an answer computed for another session in this one."""
+        self.stats["coalesced"] += 1
+        if not answer:
+            return
+        async with session.lock:
+            await self.load_history(session)
+            session.assistant.update_chat_history(question, answer)
+            await self.save_history()
+
+    async def astream(self, question: str, session_id: str = None):
+        """Yield (stage, delta) of the answer. The run is a task of its own, so its deadline scope stays in its
+        context; identical questions in flight share it and replay its deltas from the start."""
+        self.begin()
+        try:
+            session_id = session_id or uuid.uuid4().hex
+            session = self.get_session(session_id)
+            self.stats["streams"] += 1
+            flight, _ = self.coalescer.join(self.coalesce_key(question, session),
+                                            lambda: self.stream_answer(session, question), stream=True, owner=session_id)
+            answer = ""
+            # closing the items when the client goes away lets the run stop once nobody follows it
+            async with aclosing(flight.iterate()) as items:
+                async for stage, delta in items:
+                    if stage == STAGE_ANSWER:
+                        answer += delta
+                    yield stage, delta
+            if flight.owner != session_id:
+                await self.share_answer(session, question, answer.strip())
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.log.error(f"Error streaming answer for session {session_id}: {e}")
+            raise
+        finally:
+            self.end()
+
+    async def stream_answer(self, session: Session, question: str):
+        with session_scope(session.session_id):
+            # queue on the session first, a request slot is only held while the request can run
+            async with session.lock, self.admission.slot(ADMISSION_REQUEST):
+                await self.load_history(session)
+                with deadline_scope(self.request_timeout):
+                    if self.mode == SERVICE_MODE_SINGLE:
+                        async for delta in session.assistant.astream(question):
+                            yield STAGE_ANSWER, delta
+                    else:
+                        async for stage, delta in session.assistant.astream_with_scheduler(question):
+                            yield stage, delta
+                await self.save_history()
+
+    async def close(self):
+        """Stop accepting requests, wait for the in-flight ones up to the drain timeout, then flush the stores."""
+        self.accepting = False
+        if self.inflight:
+            self.log.info(f"Draining {self.inflight} in-flight requests")
+            try:
+                await asyncio.wait_for(self.idle.wait(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                self.log.warning(f"{self.inflight} requests still running after {self.drain_timeout}s drain")
+        await asyncio.to_thread(get_session_store(self.config, self.log).close)
+        self.log.info("AI service stopped")
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["sessions"] = len(self.sessions)
+        stats["inflight"] = self.inflight
+        stats["accepting"] = self.accepting
+        stats["session_store"] = get_session_store(self.config, self.log).get_stats()
+        stats["admission"] = self.admission.get_stats()
+        stats["coalescer"] = self.coalescer.get_stats()
+        stats["rate_limits"] = get_rate_limiter(self.config, self.log).get_stats()
+        return stats
@@ -8,6 +8,8 @@ from .executor.schd_exec import SchedulerExecutor
 from .model.openai import OpenAI
 from .model.deepseek_azure import DeepSeek
 from chat_history import ChatHistory
+from session_store import get_session_store
+from token_counter import preload_encoder
 
 # Constants for executor and model names
 EXECUTOR_PC = "pc"
@@ -32,6 +34,8 @@ class AssistantCreator:
             "openai": OpenAI,
             "deepseek": DeepSeek
         }
+        # load the tokenizer before the first request counts tokens
+        preload_encoder()
 
     def create_executor(self, executor_type):
         executor_class = self.executors.get(executor_type.lower())
@@ -98,17 +102,23 @@ class AssistantCreator:
         self.setup_model(assistant, MODEL_OPENAI)
         return assistant
     
-    def create_assistant(self, executor_choice, model_choice):
+    def create_chat_history(self, session_id=None):
+        # a session keeps its history in the shared session store, otherwise the history lives with the assistant
+        if session_id:
+            return get_session_store(self.config, self.log).get_history(session_id)
+        return ChatHistory(self.config)
+
+    def create_assistant(self, executor_choice, model_choice, session_id=None):
         # Initialize the assistant
-        chat_history = ChatHistory(self.config)
+        chat_history = self.create_chat_history(session_id)
         assistant = MyAssistant(chat_history, self.config, self.log)
         self.setup_executor(assistant, executor_choice)
         self.setup_model(assistant, model_choice)
         return assistant
     
-    def create_muti_assistant(self):
+    def create_muti_assistant(self, session_id=None):
         # Initialize the assistant
-        chat_history = ChatHistory(self.config)
+        chat_history = self.create_chat_history(session_id)
         assistant = MultiAssistant(chat_history, self.config, self.log)
         manager = self.create_manager()
         scheduler = self.create_scheduler()
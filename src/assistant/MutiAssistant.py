@@ -4,12 +4,20 @@ import inspect
 import logging
 import asyncio
 import re
-from typing import List, Dict, Optional
+import time
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional, Tuple
 from const import *
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from chat_history import ChatHistory
 from .MyAssistant import MyAssistant
 from .base_assistant import BaseAssistant
+from ..executor.schd_exec import SchedulerExecutor
+from .router import QuestionRouter, get_question_router, ROUTE_SIMPLE, ROUTE_COMPLEX
+from ..embedding.semantic_cache import PLAN_CACHE, SemanticCache, get_semantic_cache
+from ..admission import ADMISSION_MANAGER, ADMISSION_SCHEDULER, get_admission_controller
+from ..deadline import (DeadlineExceeded, deadline_scope, gather_with_deadline, wait_for_deadline,
+                        DEFAULT_REQUEST_TIMEOUT, DEFAULT_SUMMARY_RESERVE)
 
 class MultiAssistant(BaseAssistant):
     def __init__(self, chat_history: ChatHistory, config: dict, log: logging.Logger):
@@ -24,9 +32,30 @@ class MultiAssistant(BaseAssistant):
         self.messages = []
         self.context = ""
         self.creator = None
+        self.request_timeout = config.get("REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT)
+        self.summary_reserve = config.get("SUMMARY_RESERVE", DEFAULT_SUMMARY_RESERVE)
+        self.router: QuestionRouter = None
+        if config.get("ROUTER_ENABLED", True):
+            self.router = get_question_router(config, log)
+        self.semantic_cache: SemanticCache = None
+        if config.get("SEMANTIC_CACHE_ENABLED", False):
+            self.semantic_cache = get_semantic_cache(config, log)
+        # 答案缓存命中率低于计划缓存：同一个问题的答案随实时数据变化，计划不变
+        self.plan_cache: SemanticCache = None
+        if config.get("PLAN_CACHE_ENABLED", False):
+            self.plan_cache = get_semantic_cache(config, log, PLAN_CACHE)
+        self.admission = get_admission_controller(config, log)
 
     def set_manager(self, manager: MyAssistant):
         self.manager = manager
+        # manager 读取会话历史（问题和最终答案），阶段提示不写入会话历史
+        manager.record_history = False
+        manager.set_chat_history(self.chat_history)
+
+    def set_chat_history(self, chat_history: ChatHistory):
+        super().set_chat_history(chat_history)
+        if self.manager:
+            self.manager.set_chat_history(chat_history)
     
     def set_scheduler(self, schduler: BaseAssistant):
         self.scheduler = schduler
@@ -48,10 +77,20 @@ class MultiAssistant(BaseAssistant):
             self.log.error("Manager is not set")
             raise ValueError("Manager is not set")
 
-        # 设置消息
-        result = await self.manager.aask(task)
+        # 设置消息, manager 调用按会话公平排队
+        async with self.admission.slot(ADMISSION_MANAGER):
+            result = await self.manager.aask(task)
         return result
 
+    async def _stream_manager_task(self, task: str):
+        """使用manager任务, 流式返回"""
+        if not self.manager:
+            self.log.error("Manager is not set")
+            raise ValueError("Manager is not set")
+        async with self.admission.slot(ADMISSION_MANAGER):
+            async for delta in self.manager.astream(task):
+                yield delta
+
     def ask(self, question):
         return ""
     
@@ -92,12 +131,16 @@ class MultiAssistant(BaseAssistant):
             context = f"原始问题：{message}\n当前任务：{task}\n任务序号：{i+1}/{len(tasks)}"
             task_coroutines.append(self._process_task(task, context, workers[f"worker_{i+1}"]))
 
-        # 并行执行所有任务
-        results = await asyncio.gather(*task_coroutines, return_exceptions=True)
+        # 并行执行所有任务, 超过截止时间的任务被取消
+        with deadline_scope(self.request_timeout):
+            results = await gather_with_deadline(task_coroutines, self.summary_reserve)
 
         # 处理结果
         for i, (task, result) in enumerate(zip(tasks, results)):
-            if isinstance(result, Exception):
+            if isinstance(result, DeadlineExceeded):
+                self.log.warning(f"Task {i+1} timed out")
+                task_results[f"任务{i+1}"] = f"{TASK_TIMEOUT}: {str(result)}"
+            elif isinstance(result, BaseException):
                 self.log.error(f"Task {i+1} failed: {str(result)}")
                 task_results[f"任务{i+1}"] = f"执行失败: {str(result)}"
             else:
@@ -132,15 +175,100 @@ class MultiAssistant(BaseAssistant):
 
         return final_answer
 
+    async def lookup_semantic_cache(self, question: str) -> Optional[str]:
+        """语义缓存命中时直接返回答案，跳过 manager→scheduler→worker 流程"""
+        return await self._lookup_cache(self.semantic_cache, question)
+
+    async def lookup_plan_cache(self, question: str) -> Optional[str]:
+        """计划缓存命中时跳过 manager 的意图分析，直接执行缓存的任务列表"""
+        # 计划依赖会话历史（追问的意图要结合上文），只缓存和查询会话的第一个问题
+        if self.chat_history.get_token_count():
+            return None
+        return await self._lookup_cache(self.plan_cache, question)
+
+    async def _lookup_cache(self, cache: SemanticCache, question: str) -> Optional[str]:
+        if not cache:
+            return None
+        try:
+            return await wait_for_deadline(cache.alookup(question))
+        except Exception as e:
+            self.log.warning(f"{cache.name.capitalize()} lookup failed: {e}")
+            return None
+
+    async def store_semantic_cache(self, question: str, answer: str, tasks_result: str = "", tasks_description: str = ""):
+        # 部分任务超时的答案不完整，不缓存；计划只在执行成功后缓存
+        if not answer or TASK_TIMEOUT in tasks_result:
+            return
+        await self._store_cache(self.semantic_cache, question, answer)
+        if tasks_description and not self.chat_history.get_token_count():
+            await self._store_cache(self.plan_cache, question, tasks_description)
+
+    async def _store_cache(self, cache: SemanticCache, question: str, value: str):
+        if not cache:
+            return
+        try:
+            await cache.astore(question, value)
+        except Exception as e:
+            self.log.warning(f"{cache.name.capitalize()} store failed: {e}")
+
     async def aask_with_scheduler(self, question: str) -> str:
+        # 整个请求共享一个截止时间，调用方已设置时取较早者
+        with deadline_scope(self.request_timeout):
+            cached_answer = await self.lookup_semantic_cache(question)
+            if cached_answer:
+                self.update_chat_history(question, cached_answer)
+                return cached_answer
+            route = await self.route_question(question)
+            start = time.monotonic()
+            if route == ROUTE_SIMPLE:
+                answer = await self.aask_fast_path(question)
+            else:
+                answer = await self._aask_with_scheduler(question)
+        if self.router:
+            self.router.record(route, time.monotonic() - start)
+        return answer
+
+    async def route_question(self, question: str) -> str:
+        """简单问题走快速路径，无法使用快速路径时走完整流程"""
+        if not self.router or not isinstance(getattr(self.scheduler, "executor", None), SchedulerExecutor):
+            return ROUTE_COMPLEX
+        # 向量计算不阻塞事件循环
+        return await self.router.aroute(question)
+
+    @asynccontextmanager
+    async def fast_path_worker(self):
+        """从池中取一个 worker，带上会话历史，追问也能被理解"""
+        async with self.scheduler.executor.pool.worker() as worker:
+            # 复制消息，worker 归还时清空的是自己的历史
+            for message in self.chat_history.get_full_history():
+                worker.chat_history.append(type(message)(content=message.content))
+            # 会话历史由本助手记录
+            worker.record_history = False
+            try:
+                yield worker
+            finally:
+                worker.record_history = True
+
+    async def aask_fast_path(self, question: str) -> str:
+        """快速路径：跳过 manager 和 scheduler，直接由一个 worker 回答"""
+        self.log.info("Fast path: answering with a single worker...")
+        async with self.fast_path_worker() as worker:
+            answer = await worker.aask(question)
+        await self.store_semantic_cache(question, answer)
+        self.update_chat_history(question, answer)
+        return answer
+
+    async def _aask_with_scheduler(self, question: str) -> str:
         # 第一步：确认意图并生成任务列表
         self.log.info("Step 1: Identifying intent and generating task list...")
-        tasks_description = await self.anlyze_requirements(question)
+        tasks_description = await self.lookup_plan_cache(question)
+        if not tasks_description:
+            tasks_description = await self.anlyze_requirements(question)
         if not tasks_description:
             return ""
         # 第二步：解析任务并执行
         self.log.info("Step 1.5: Creating workers for each task...")
-        tasks_result = await self.execute_tasks(tasks_description)
+        tasks_result = await self.execute_tasks_with_deadline(tasks_description)
         if not tasks_result:
             return tasks_description
         # 第三步：审查和修正结果
@@ -148,17 +276,104 @@ class MultiAssistant(BaseAssistant):
         # reviewed_response = await self.review_and_refine_results(tasks_description, tasks_result)
         # 第四步：总结最终答案 
         self.log.info("Step 3: Generating final answer...")
-        final_answer = await self.deliver_results(question, tasks_result, tasks_description)
+        try:
+            final_answer = await wait_for_deadline(self.deliver_results(question, tasks_result, tasks_description))
+        except DeadlineExceeded:
+            # 没有时间总结，直接返回部分结果
+            self.log.warning("Deadline exceeded while delivering results, returning task results")
+            return tasks_result
+        await self.store_semantic_cache(question, final_answer, tasks_result, tasks_description)
         # 更新聊天历史
         self.update_chat_history(question, final_answer)
         return final_answer
 
+    async def execute_tasks_with_deadline(self, tasks_description: str) -> str:
+        """执行任务，为总结阶段保留时间，超时返回超时标记"""
+        try:
+            return await wait_for_deadline(self.execute_tasks(tasks_description), self.summary_reserve / 2)
+        except DeadlineExceeded as e:
+            self.log.warning(f"Deadline exceeded while executing tasks: {e}")
+            return f"{TASK_TIMEOUT}: {e}"
+
+    async def astream_with_scheduler(self, question: str):
+        """流式处理用户问题，逐段返回 (阶段, 文本)，阶段为 STAGE_ANALYZE / STAGE_EXECUTE / STAGE_ANSWER"""
+        # 与 aask_with_scheduler 相同，整个请求共享一个截止时间
+        with deadline_scope(self.request_timeout):
+            cached_answer = await self.lookup_semantic_cache(question)
+            if cached_answer:
+                self.update_chat_history(question, cached_answer)
+                yield STAGE_ANSWER, cached_answer
+                return
+            route = await self.route_question(question)
+            start = time.monotonic()
+            if route == ROUTE_SIMPLE:
+                self.log.info("Fast path: answering with a single worker...")
+                answer = ""
+                async with self.fast_path_worker() as worker:
+                    async for delta in worker.astream(question):
+                        answer += delta
+                        yield STAGE_ANSWER, delta
+                await self.store_semantic_cache(question, answer)
+                self.update_chat_history(question, answer)
+            else:
+                async for item in self._astream_with_scheduler(question):
+                    yield item
+        if self.router:
+            self.router.record(route, time.monotonic() - start)
+
+    async def _astream_with_scheduler(self, question: str):
+        # 第一步：确认意图并生成任务列表
+        self.log.info("Step 1: Identifying intent and generating task list...")
+        tasks_description = await self.lookup_plan_cache(question)
+        if tasks_description:
+            yield STAGE_ANALYZE, tasks_description
+        else:
+            tasks_description = ""
+            async for delta in self._stream_manager_task(self._build_intent_question(question)):
+                tasks_description += delta
+                yield STAGE_ANALYZE, delta
+            self.log.debug(f"Intent response: {tasks_description}")
+            if self.check_req_confirmation(tasks_description):
+                self.record_confirmation(question, tasks_description)
+                return
+        # 第二步：解析任务并执行
+        self.log.info("Step 1.5: Creating workers for each task...")
+        tasks_result = await self.execute_tasks_with_deadline(tasks_description)
+        if not tasks_result:
+            return
+        yield STAGE_EXECUTE, tasks_result
+        # 第三步：总结最终答案
+        self.log.info("Step 3: Generating final answer...")
+        final_answer = ""
+        summary_question = self._build_summary_question(question, tasks_result, tasks_description)
+        async for delta in self._stream_manager_task(summary_question):
+            final_answer += delta
+            yield STAGE_ANSWER, delta
+        self.log.info(f"Final answer: {final_answer}")
+        await self.store_semantic_cache(question, final_answer, tasks_result, tasks_description)
+        # 更新聊天历史
+        self.update_chat_history(question, final_answer)
+
     async def anlyze_requirements(self, question: str) -> str:
         """分析需求"""
         if not self.manager:
             raise ValueError("manager is not set")
         # 第一步：确认意图并生成任务列表
-        intent_question = f"""当前阶段一, 首先理解问题并与用户确认，得到准确的意图。
+        intent_question = self._build_intent_question(question)
+        intent_response = await self._process_manager_task(intent_question)
+        self.log.debug(f"Intent response: {intent_response}")
+        if self.check_req_confirmation(intent_response):
+            self.record_confirmation(question, intent_response)
+            return ''
+        return intent_response
+
+    def record_confirmation(self, question: str, intent_response: str):
+        # 确认问题要进入会话历史，用户的回答才有上下文
+        if intent_response:
+            self.update_chat_history(question, intent_response)
+
+    def _build_intent_question(self, question: str) -> str:
+        return f"""当前阶段一, 首先理解问题并与用户确认，得到准确的意图。
             用户问题：{question}
             如果需要确认或用户输入，按照如下格式：
             确认问题：
@@ -170,11 +385,6 @@ class MultiAssistant(BaseAssistant):
             任务1: 执行
             任务2: 测试
             """
-        intent_response = await self._process_manager_task(intent_question)
-        self.log.debug(f"Intent response: {intent_response}")
-        if self.check_req_confirmation(intent_response):
-            return ''
-        return intent_response
     
     async def execute_tasks(self, tasks_description: str) -> str:
         """执行任务"""
@@ -185,11 +395,30 @@ class MultiAssistant(BaseAssistant):
         # 解析任务列表
         hasTasks = self.check_task_confirmation(tasks_description)
         if hasTasks:
-            tasks_result = await self.scheduler.aask(tasks_description)
+            async with self.admission.slot(ADMISSION_SCHEDULER):
+                tasks_result = await self.execute_task_graph(tasks_description)
+                if not tasks_result:
+                    tasks_result = await self.scheduler.aask(tasks_description)
         else:
             self.log.info("No tasks found, using default response.")
         return tasks_result
     
+    async def execute_task_graph(self, tasks_description: str) -> str:
+        """按解析出的依赖关系直接执行任务图，省去 scheduler 的模型调用；无法解析时返回空字符串"""
+        executor = getattr(self.scheduler, "executor", None)
+        if not self.config.get("TASK_GRAPH_ENABLED", True) or not isinstance(executor, SchedulerExecutor):
+            return ""
+        tasks, dependencies = self._parse_task_list2(tasks_description)
+        if not tasks:
+            return ""
+        context = re.sub(r"<think>.*?</think>", "", tasks_description, flags=re.DOTALL).strip()
+        try:
+            return await executor.execute_task_graph(tasks, dependencies, context)
+        except ValueError as e:
+            # 循环依赖或未知依赖，交给 scheduler 处理
+            self.log.error(f"Invalid task graph, falling back to scheduler: {e}")
+            return ""
+
     async def review_and_refine_results(self, tasks_description, tasks_result: str) -> str:
         """审查和修正结果"""
         if not self.manager:
@@ -211,17 +440,19 @@ class MultiAssistant(BaseAssistant):
         if not self.manager:
             raise ValueError("manager is not set")
         # 总结最终答案
-        summary_question = f"""当前阶段二，请根据以下信息总结出最终答案回答用户问题：
+        summary_question = self._build_summary_question(question, task_result, reviewed_response)
+        final_answer = await self._process_manager_task(summary_question)
+        self.log.info(f"Final answer: {final_answer}")
+        return final_answer
+
+    def _build_summary_question(self, question: str, task_result: str, reviewed_response: str) -> str:
+        return f"""当前阶段二，请根据以下信息总结出最终答案回答用户问题：
             用户原始问题：
             {question}
             任务执行结果：
             {task_result}
             审查反馈：
             {reviewed_response}"""
-
-        final_answer = await self._process_manager_task(summary_question)
-        self.log.info(f"Final answer: {final_answer}")
-        return final_answer
     
     def _parse_task_list(self, intent_response: str) -> List[str]:
         """从意图响应中解析任务列表"""
@@ -243,32 +474,47 @@ class MultiAssistant(BaseAssistant):
 
         return tasks
     
-    def _parse_task_list2(self, task_description: str) -> List[str]:
+    def _parse_task_list2(self, task_description: str) -> Tuple[List[str], List[List[str]]]:
+        """解析任务及其依赖关系，返回 (任务列表, 每个任务的前置任务编号列表)"""
         # Remove <think> sections from intent_response
         task_description = re.sub(r"<think>.*?</think>", "", task_description, flags=re.DOTALL)
         # 匹配任务模式的正则表达式（支持多任务连续匹配）
         task_pattern = re.compile(
-            r'^任务\d+:.*?$[\n\r]+^└─ 依赖关系：.*?$',
-            re.MULTILINE | re.DOTALL
+            r'^任务\d+[:：][^\n]*$[\n\r]+^\s*└─ 依赖关系[:：][^\n]*$',
+            re.MULTILINE
         )
         tasks = []
+        task_ids = []
         dependencies = []
+        successors = []
         # 分割所有任务块
         for task_block in task_pattern.finditer(task_description):
             block = task_block.group(0)
             
             # 提取任务描述行
-            task_line = re.search(r'^(任务\d+:.*?)(?=\n|$)', block, re.MULTILINE).group(0)
+            task_line = re.search(r'^(任务\d+[:：].*?)(?=\n|$)', block, re.MULTILINE).group(0)
             tasks.append(task_line.strip())
+            task_id = re.match(r'任务\d+', task_line).group(0)
+            task_ids.append(task_id)
             
             # 提取依赖描述并解析依赖项
-            dep_match = re.search(r'└─ 依赖关系：(.*?)$', block, re.MULTILINE)
+            dep_match = re.search(r'└─ 依赖关系[:：](.*?)$', block, re.MULTILINE)
             dep_desc = dep_match.group(1).strip() if dep_match else ''
             
-            # 从依赖描述中提取任务编号（支持中文数字）
-            dep_tasks = re.findall(r'任务\d+', dep_desc)
-            dependencies.append(dep_tasks)
-        return tasks
+            # 从依赖描述中提取任务编号，"后置"之后的编号是依赖当前任务的后续任务
+            before, _, after = dep_desc.partition("后置")
+            dependencies.append([dep for dep in re.findall(r'任务\d+', before) if dep != task_id])
+            successors.append([dep for dep in re.findall(r'任务\d+', after) if dep != task_id])
+        for task_id, succ in zip(task_ids, successors):
+            for dep_task in succ:
+                if dep_task in task_ids:
+                    deps = dependencies[task_ids.index(dep_task)]
+                    if task_id not in deps:
+                        deps.append(task_id)
+                else:
+                    # 不存在的后续任务不约束当前任务，忽略
+                    self.log.warning(f"{task_id} names unknown successor {dep_task}, ignored")
+        return tasks, dependencies
 
     def _convert_messages_for_openai(self, messages) -> List[Dict]:
         """转换消息格式为OpenAI API需要的格式"""
@@ -2,20 +2,28 @@
 # Property as below:
 # executor: it will be set with a specific executor instance.
 # Method as below:
-# ask(): it can invoke chat completions by input message. the prompt message, tool definitions are got from executor instance. if repose is tool_call, it will call execute() of executor instance with name and parameters. Note, openai may need call execute() multiple times to complete the chat.
+# ask(): it can invoke chat completions by input message. the prompt message, tool definitions are got from executor instance. if repose is tool_call, it will call execute() of executor instance with name and parameters for every tool call in the turn, async ones run concurrently. Note, openai may need call execute() multiple times to complete the chat.
+# astream(): streaming version of aask(), yields text deltas of the answer while tool calls are still handled in the loop.
 # set_executor(): a executor instance will be set.
+# reset(): clear chat history and messages, used when a pooled worker is returned.
+# record_history: False when the chat history is the conversation of another assistant, which records the turns itself.
 
 import os
 import json
+import asyncio
 
 import inspect
 import logging
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from chat_history import ChatHistory
+from token_counter import count_message_tokens
+from history_summarizer import get_history_summarizer
 from ..executor.executor import Executor
-from model.base_model import BaseModel
+from ..model.base_model import BaseModel, STREAM_DELTA, STREAM_DONE
 from .base_assistant import BaseAssistant
 
+DEFAULT_TOOL_CONCURRENCY = 4
+
 class MyAssistant(BaseAssistant):
     def __init__(self, chat_history: ChatHistory, config: dict, log: logging.Logger):
         super().__init__(chat_history, config, log)
@@ -23,12 +31,29 @@ class MyAssistant(BaseAssistant):
         self.model = None
         self.messages = []
         self.context = ""
+        self.record_history = True
 
     def set_executor(self, executor: Executor):
         self.executor = executor
 
     def set_model(self, model: BaseModel):
         self.model = model
+        self.setup_summarizer()
+
+    def set_chat_history(self, chat_history: ChatHistory):
+        super().set_chat_history(chat_history)
+        self.setup_summarizer()
+
+    def setup_summarizer(self):
+        if self.model is not None and self.config.get("HISTORY_SUMMARIZE_ENABLED", False):
+            # long histories fold their oldest turns into a summary written by the same model
+            self.chat_history.set_background_summarizer(get_history_summarizer(self.config, self.log), self.model)
+
+    def reset(self):
+        # clear per task state, so a pooled worker can take the next task
+        self.chat_history.clear_history()
+        self.messages = []
+        self.context = ""
 
     def setup_messages(self, message: str):
         try:
@@ -36,12 +61,14 @@ class MyAssistant(BaseAssistant):
             context = self.executor.get_context()
             message_template = f"""context：{context}
                 question：{message}"""
+            system_message = SystemMessage(content=prompt)
+            question_message = HumanMessage(content=message_template)
+            # the system prompt and the question are pinned, history gets the rest of the token budget
+            reserved_tokens = count_message_tokens(system_message) + count_message_tokens(question_message)
             messages = [
-                SystemMessage(content=prompt),
-                *self.get_chat_history(),
-                HumanMessage(
-                    content=message_template
-                ),
+                system_message,
+                *self.get_chat_history(reserved_tokens),
+                question_message,
             ]
             return messages
         except Exception as e:
@@ -54,12 +81,14 @@ class MyAssistant(BaseAssistant):
             context = self.executor.get_context()
             message_template = f"""context：{context}
                 task: {message}"""
+            system_message = SystemMessage(content=prompt)
+            question_message = HumanMessage(content=message_template)
+            # the system prompt and the question are pinned, history gets the rest of the token budget
+            reserved_tokens = count_message_tokens(system_message) + count_message_tokens(question_message)
             messages = [
-                SystemMessage(content=prompt),
-                *self.get_chat_history(),
-                HumanMessage(
-                    content=message_template
-                ),
+                system_message,
+                *self.get_chat_history(reserved_tokens),
+                question_message,
             ]
             return messages
         except Exception as e:
@@ -78,51 +107,20 @@ class MyAssistant(BaseAssistant):
         # check if GPT wanted to call a function
         while response.choices[0].finish_reason == "tool_calls":
             response_message = response.choices[0].message
+            tool_calls = response_message.tool_calls
 
-            # call the function
-            function_name = response_message.tool_calls[0].function.name
-            function_to_call = self.executor.get_function(function_name)
-            if function_to_call is None:
-                return "Function not found: " + function_name
-
-            # verify function has correct number of arguments
-            function_args = json.loads(response_message.tool_calls[0].function.arguments)
-            if self.check_args(function_to_call, function_args) is False:
-                return "Invalid number of arguments for function: " + function_name
-            function_response = self.executor.execute(function_name, **function_args)
-            print(f"Function call: {function_name} with arguments: {function_args}")
-            # print(f"Return: {function_response}")
-
-            # send the info on the function call and function response to GPT
-            # adding assistant response to messages
-            self.messages.append(
-                {
-                    "role": response_message.role,
-                    "function_call": {
-                        "name": response_message.tool_calls[0].function.name,
-                        "arguments": response_message.tool_calls[0].function.arguments,
-                    },
-                    "content": None,
-                }
-            )
+            # adding assistant response with all tool calls to messages
+            self.messages.append(self.build_tool_calls_message(response_message))
+            # call every function requested in this turn, one tool message per call in the same order
+            for tool_call in tool_calls:
+                function_response = self.call_tool(tool_call)
+                self.messages.append(self.build_tool_message(tool_call, function_response))
 
-            # adding function response to messages
-            self.messages.append(
-                {
-                    "role": "function",
-                    "name": function_name,
-                    "content": function_response,
-                }
-            )  # extend conversation with function response
-
-            # print("Messages in next request:")
-            # for message in self.messages:
-            #     print(message)
-            # print()
             response = self.model.ask(self.messages, tool_definitions)
 
         anwser = response.choices[0].message.content.strip()
-        self.update_chat_history(message, anwser)
+        if self.record_history:
+            self.update_chat_history(message, anwser)
         return anwser
     
     async def aask(self, message):
@@ -137,57 +135,127 @@ class MyAssistant(BaseAssistant):
         # check if GPT wanted to call a function
         while response.choices[0].finish_reason == "tool_calls":
             response_message = response.choices[0].message
+            tool_calls = response_message.tool_calls
 
-            # call the function
-            function_name = response_message.tool_calls[0].function.name
-            function_to_call = self.executor.get_function(function_name)
-            if function_to_call is None:
-                self.log.error(f"Function not found: {function_name}")
-                return "Function not found: " + function_name
-
-            # verify function has correct number of arguments
-            function_args = json.loads(response_message.tool_calls[0].function.arguments)
-            if self.check_args(function_to_call, function_args) is False:
-                return "Invalid number of arguments for function: " + function_name
-            if self.executor.is_async():
-                function_response = await self.executor.aexecute(function_name, **function_args)
-            else:
-                function_response = self.executor.execute(function_name, **function_args)
-            print(f"Function call: {function_name} with arguments: {function_args}")
-            # print(f"Return: {function_response}")
-
-            # send the info on the function call and function response to GPT
-            # adding assistant response to messages
-            self.messages.append(
-                {
-                    "role": response_message.role,
-                    "function_call": {
-                        "name": response_message.tool_calls[0].function.name,
-                        "arguments": response_message.tool_calls[0].function.arguments,
-                    },
-                    "content": None,
-                }
-            )
-
-            # adding function response to messages
-            self.messages.append(
-                {
-                    "role": "function",
-                    "name": function_name,
-                    "content": function_response,
-                }
-            )  # extend conversation with function response
+            # adding assistant response with all tool calls to messages
+            self.messages.append(self.build_tool_calls_message(response_message))
+            # tool calls in one turn are independent, run them concurrently with a cap
+            function_responses = await self.acall_tools(tool_calls)
+            for tool_call, function_response in zip(tool_calls, function_responses):
+                self.messages.append(self.build_tool_message(tool_call, function_response))
 
-            # print("Messages in next request:")
-            # for message in self.messages:
-            #     print(message)
-            # print()
             response = await self.model.aask(self.messages, tool_definitions)
 
         anwser = response.choices[0].message.content.strip()
-        self.update_chat_history(message, anwser)
+        if self.record_history:
+            self.update_chat_history(message, anwser)
         return anwser
 
+    async def astream(self, message):
+        """Streaming version of aask(), yields answer text deltas as they arrive."""
+        if not self.executor:
+            raise ValueError("Executor is not set")
+
+        tool_definitions = self.executor.get_tool_definition()
+        self.messages = self.convert_messages_for_openai(self.setup_messages(message))
+        anwser = ""
+        while True:
+            done = None
+            async for event in self.model.astream(self.messages, tool_definitions):
+                if event["type"] == STREAM_DELTA:
+                    anwser += event["content"]
+                    yield event["content"]
+                elif event["type"] == STREAM_DONE:
+                    done = event
+            if done is None:
+                self.log.error("Model stream ended without a result")
+                return
+            if done["finish_reason"] != "tool_calls":
+                break
+            # content streamed before tool calls is not part of the final answer
+            anwser = ""
+            response_message = done["message"]
+            tool_calls = response_message.tool_calls
+            self.messages.append(self.build_tool_calls_message(response_message))
+            function_responses = await self.acall_tools(tool_calls)
+            for tool_call, function_response in zip(tool_calls, function_responses):
+                self.messages.append(self.build_tool_message(tool_call, function_response))
+
+        if self.record_history:
+            self.update_chat_history(message, anwser.strip())
+
+    def prepare_tool_call(self, tool_call):
+        # return function name, arguments and an error string if the call can not be executed
+        function_name = tool_call.function.name
+        function_to_call = self.executor.get_function(function_name)
+        if function_to_call is None:
+            self.log.error(f"Function not found: {function_name}")
+            return function_name, None, "Function not found: " + function_name
+        try:
+            function_args = json.loads(tool_call.function.arguments or "{}")
+        except json.JSONDecodeError as e:
+            self.log.error(f"Invalid arguments for function {function_name}: {e}")
+            return function_name, None, "Invalid arguments for function: " + function_name
+        # verify function has correct number of arguments
+        if self.check_args(function_to_call, function_args) is False:
+            return function_name, None, "Invalid number of arguments for function: " + function_name
+        return function_name, function_args, None
+
+    def call_tool(self, tool_call) -> str:
+        function_name, function_args, error = self.prepare_tool_call(tool_call)
+        if error:
+            return error
+        print(f"Function call: {function_name} with arguments: {function_args}")
+        try:
+            return str(self.executor.execute(function_name, **function_args))
+        except Exception as e:
+            self.log.error(f"Error calling function {function_name}: {e}")
+            return f"Error calling function {function_name}: {e}"
+
+    async def acall_tool(self, tool_call, semaphore: asyncio.Semaphore) -> str:
+        function_name, function_args, error = self.prepare_tool_call(tool_call)
+        if error:
+            return error
+        print(f"Function call: {function_name} with arguments: {function_args}")
+        try:
+            async with semaphore:
+                return str(await self.executor.aexecute(function_name, **function_args))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log.error(f"Error calling function {function_name}: {e}")
+            return f"Error calling function {function_name}: {e}"
+
+    async def acall_tools(self, tool_calls) -> list:
+        if not self.executor.is_async():
+            return [self.call_tool(tool_call) for tool_call in tool_calls]
+        semaphore = asyncio.Semaphore(self.config.get("MAX_TOOL_CONCURRENCY", DEFAULT_TOOL_CONCURRENCY))
+        return await asyncio.gather(*(self.acall_tool(tool_call, semaphore) for tool_call in tool_calls))
+
+    def build_tool_calls_message(self, response_message) -> dict:
+        return {
+            "role": "assistant",
+            "content": response_message.content,
+            "tool_calls": [
+                {
+                    "id": tool_call.id,
+                    "type": "function",
+                    "function": {
+                        "name": tool_call.function.name,
+                        "arguments": tool_call.function.arguments,
+                    },
+                }
+                for tool_call in response_message.tool_calls
+            ],
+        }
+
+    def build_tool_message(self, tool_call, function_response: str) -> dict:
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "content": function_response,
+        }
+
     def convert_messages_for_openai(self, messages):
         openai_messages = []
         for msg in messages:
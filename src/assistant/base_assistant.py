@@ -21,9 +21,12 @@ class BaseAssistant(ABC):
     async def aask(self, question:str) -> str:
         pass  
 
+    def set_chat_history(self, chat_history: ChatHistory):
+        self.chat_history = chat_history
+
     def update_chat_history(self, question: str, answer: str):
         self.chat_history.add_user_message(question)
         self.chat_history.add_ai_message(answer) 
 
-    def get_chat_history(self) -> Iterable[ChatCompletionMessageParam]:
-        return self.chat_history.get_full_history()
\ No newline at end of file
+    def get_chat_history(self, reserved_tokens: int = 0) -> Iterable[ChatCompletionMessageParam]:
+        return self.chat_history.get_full_history(reserved_tokens)
\ No newline at end of file
@@ -0,0 +1,167 @@
+# Cheap pre-classifier in front of the multi-agent pipeline.
+# Single-step questions (one diagnostic a worker can answer) go straight to one worker, the rest
+# take the full manager -> scheduler -> worker pipeline.
+# Rules decide first; when they are not sure, an optional nearest-neighbour search over labeled examples
+# with the local (or configured) embedder decides; anything still unsure takes the full pipeline.
+import re
+import json
+import logging
+import threading
+import numpy as np
+from ..embedding.embedder import BaseEmbedder, create_embedder, EMBEDDER_LOCAL
+
+ROUTE_SIMPLE = "simple"
+ROUTE_COMPLEX = "complex"
+DEFAULT_ROUTER_THRESHOLD = 0.75
+DEFAULT_SIMPLE_MAX_LEN = 60
+
+# words that ask for decomposition, comparison or reasoning over several results
+COMPLEX_PATTERN = re.compile(
+    r"(并且|然后|之后|同时|以及|分别|对比|比较|分析|原因|为什么|优化|排查|诊断|建议|报告|总结|"
+    r"\band then\b|\bthen\b|\bcompare\b|\bwhy\b|\banaly[sz]e\b|\btroubleshoot\b|\bdiagnos|\boptimi[sz]e\b|\breport\b|\bsummar)",
+    re.IGNORECASE)
+# single metrics a worker can read with one command
+SIMPLE_PATTERN = re.compile(
+    r"(磁盘|硬盘|内存|CPU|cpu|进程|负载|网络|IP|ip地址|端口|系统版本|主机名|运行时间|pod|节点|"
+    r"\bdisk\b|\bmemory\b|\bram\b|\bprocess(es)?\b|\bload\b|\buptime\b|\bhostname\b|\bports?\b|\bip\b|\bpods?\b|\bnodes?\b|\bversion\b)",
+    re.IGNORECASE)
+
+DEFAULT_EXAMPLES = [
+    ("磁盘还剩多少空间", ROUTE_SIMPLE),
+    ("查看内存使用情况", ROUTE_SIMPLE),
+    ("当前CPU使用率是多少", ROUTE_SIMPLE),
+    ("列出占用内存最多的进程", ROUTE_SIMPLE),
+    ("how much disk is left", ROUTE_SIMPLE),
+    ("show memory usage", ROUTE_SIMPLE),
+    ("list running pods", ROUTE_SIMPLE),
+    ("what is the system uptime", ROUTE_SIMPLE),
+    ("分析系统为什么变慢并给出优化建议", ROUTE_COMPLEX),
+    ("检查磁盘和内存，然后生成健康报告", ROUTE_COMPLEX),
+    ("排查节点NotReady的原因", ROUTE_COMPLEX),
+    ("why is the node NotReady", ROUTE_COMPLEX),
+    ("compare cpu and memory usage over the last hour and suggest fixes", ROUTE_COMPLEX),
+    ("diagnose the slow network and summarize the findings", ROUTE_COMPLEX),
+]
+
+class QuestionRouter:
+    def __init__(self, config: dict, log: logging.Logger, embedder: BaseEmbedder = None):
+        self.config = config
+        self.log = log
+        self.threshold = config.get("ROUTER_THRESHOLD", DEFAULT_ROUTER_THRESHOLD)
+        self.simple_max_len = config.get("ROUTER_SIMPLE_MAX_LEN", DEFAULT_SIMPLE_MAX_LEN)
+        self.lock = threading.Lock()
+        self.embedder = embedder
+        if self.embedder is None and config.get("ROUTER_EMBEDDINGS", True):
+            self.embedder = create_embedder(config, log, config.get("ROUTER_EMBEDDINGS_BACKEND", EMBEDDER_LOCAL))
+        self.examples = self.load_examples()
+        self.labels = np.array([label for _, label in self.examples])
+        self.vectors = self.embedder.embed([text for text, _ in self.examples]) if self.embedder else None
+        self.stats = {"total": 0, "simple": 0, "complex": 0, "by_rule": 0, "by_embedding": 0,
+                      "simple_time": 0.0, "simple_count": 0, "complex_time": 0.0, "complex_count": 0}
+
+    def load_examples(self) -> list:
+        examples_file = self.config.get("ROUTER_EXAMPLES_FILE", "")
+        if not examples_file:
+            return list(DEFAULT_EXAMPLES)
+        try:
+            with open(examples_file, "r", encoding="utf-8") as f:
+                return [(item["text"], item["label"]) for item in json.load(f)]
+        except Exception as e:
+            self.log.error(f"Error loading router examples {examples_file}: {e}")
+            return list(DEFAULT_EXAMPLES)
+
+    def classify_by_rules(self, question: str):
+        """Return a route, or None when the rules are not sure."""
+        if COMPLEX_PATTERN.search(question):
+            return ROUTE_COMPLEX
+        # several questions in one message need decomposition
+        if len(re.findall(r"[?？]", question)) > 1:
+            return ROUTE_COMPLEX
+        if len(question) <= self.simple_max_len and SIMPLE_PATTERN.search(question):
+            return ROUTE_SIMPLE
+        return None
+
+    def has_examples(self) -> bool:
+        return self.vectors is not None and len(self.vectors) > 0
+
+    def nearest_label(self, vector: np.ndarray):
+        scores = self.vectors @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return str(self.labels[best])
+
+    def classify_by_embedding(self, question: str):
+        if not self.has_examples():
+            return None
+        return self.nearest_label(self.embedder.embed([question])[0])
+
+    async def aclassify_by_embedding(self, question: str):
+        if not self.has_examples():
+            return None
+        return self.nearest_label((await self.embedder.aembed([question]))[0])
+
+    def route(self, question: str) -> str:
+        question = question.strip()
+        route = self.classify_by_rules(question)
+        source = "by_rule"
+        if route is None:
+            try:
+                route = self.classify_by_embedding(question)
+                source = "by_embedding"
+            except Exception as e:
+                self.log.warning(f"Router embedding failed: {e}")
+        return self.count(route, source)
+
+    async def aroute(self, question: str) -> str:
+        """Like route(), the embedding runs off the event loop."""
+        question = question.strip()
+        route = self.classify_by_rules(question)
+        source = "by_rule"
+        if route is None:
+            try:
+                route = await self.aclassify_by_embedding(question)
+                source = "by_embedding"
+            except Exception as e:
+                self.log.warning(f"Router embedding failed: {e}")
+        return self.count(route, source)
+
+    def count(self, route, source) -> str:
+        if route is None:
+            route = ROUTE_COMPLEX
+            source = None
+        with self.lock:
+            self.stats["total"] += 1
+            self.stats[route] += 1
+            if source:
+                self.stats[source] += 1
+        self.log.info(f"Routed question to {route} path")
+        return route
+
+    def record(self, route: str, seconds: float):
+        """Record the latency of a routed request, used to estimate the time saved by the fast path."""
+        with self.lock:
+            self.stats[f"{route}_time"] += seconds
+            self.stats[f"{route}_count"] += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        stats["fast_path_rate"] = stats["simple"] / stats["total"] if stats["total"] else 0.0
+        avg_simple = stats["simple_time"] / stats["simple_count"] if stats["simple_count"] else 0.0
+        avg_complex = stats["complex_time"] / stats["complex_count"] if stats["complex_count"] else 0.0
+        stats["avg_simple_latency"] = avg_simple
+        stats["avg_complex_latency"] = avg_complex
+        stats["estimated_time_saved"] = max(avg_complex - avg_simple, 0.0) * stats["simple_count"] if avg_complex else 0.0
+        return stats
+
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_question_router(config: dict, log: logging.Logger) -> QuestionRouter:
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = QuestionRouter(config, log)
+        return _router
@@ -0,0 +1,140 @@
+# Bounded pool of pre-initialized worker assistants shared by all schedulers of the process.
+# A worker is checked out for one task and reset (chat history and messages cleared) when it comes back,
+# so executor prompt files, model clients and histories are built once instead of per task.
+# At most WORKER_POOL_MAX_SIZE workers exist, extra tasks wait for a free one; idle workers above
+# WORKER_POOL_MIN_SIZE are evicted after WORKER_POOL_IDLE_TIMEOUT seconds.
+# worker() first takes a slot of the admission worker stage, so tasks of different sessions are served fairly.
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable
+from .MyAssistant import MyAssistant
+from ..admission import ADMISSION_WORKER, get_admission_controller
+
+DEFAULT_POOL_MIN_SIZE = 2
+DEFAULT_POOL_MAX_SIZE = 16
+DEFAULT_POOL_IDLE_TIMEOUT = 300
+
+class WorkerPool:
+    def __init__(self, config: dict, log: logging.Logger, factory: Callable[[], MyAssistant]):
+        self.config = config
+        self.log = log
+        self.factory = factory
+        self.min_size = config.get("WORKER_POOL_MIN_SIZE", DEFAULT_POOL_MIN_SIZE)
+        self.max_size = max(config.get("WORKER_POOL_MAX_SIZE", DEFAULT_POOL_MAX_SIZE), 1)
+        self.idle_timeout = config.get("WORKER_POOL_IDLE_TIMEOUT", DEFAULT_POOL_IDLE_TIMEOUT)
+        self.admission = get_admission_controller(config, log)
+        self.lock = threading.Lock()
+        self.idle = deque()
+        self.in_use = 0
+        # the semaphore bounds checked out workers, it is bound to the running loop
+        self.loop = None
+        self.semaphore = None
+        # semaphore each checked out worker was acquired from, a worker of a previous loop frees a slot of that loop
+        self.semaphores = {}
+        self.stats = {"created": 0, "reused": 0, "evicted": 0, "waits": 0, "wait_time": 0.0, "peak_in_use": 0}
+
+    def prewarm(self):
+        with self.lock:
+            missing = self.min_size - len(self.idle) - self.in_use
+        for _ in range(max(missing, 0)):
+            worker = self.create_worker()
+            with self.lock:
+                self.idle.append((worker, time.monotonic()))
+
+    def create_worker(self) -> MyAssistant:
+        worker = self.factory()
+        with self.lock:
+            self.stats["created"] += 1
+        return worker
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.max_size)
+        return self.semaphore
+
+    async def acquire(self) -> MyAssistant:
+        semaphore = self.get_semaphore()
+        if semaphore.locked():
+            start = time.monotonic()
+            await semaphore.acquire()
+            with self.lock:
+                self.stats["waits"] += 1
+                self.stats["wait_time"] += time.monotonic() - start
+        else:
+            await semaphore.acquire()
+        try:
+            with self.lock:
+                worker = self.idle.pop()[0] if self.idle else None
+                self.in_use += 1
+                self.stats["peak_in_use"] = max(self.stats["peak_in_use"], self.in_use)
+                if worker is not None:
+                    self.stats["reused"] += 1
+            if worker is None:
+                worker = self.create_worker()
+            with self.lock:
+                self.semaphores[id(worker)] = semaphore
+            return worker
+        except BaseException:
+            with self.lock:
+                self.in_use -= 1
+            semaphore.release()
+            raise
+
+    def release(self, worker: MyAssistant):
+        try:
+            worker.reset()
+            with self.lock:
+                self.idle.append((worker, time.monotonic()))
+        except Exception as e:
+            # a worker that can not be reset is dropped, a new one is created on demand
+            self.log.warning(f"Dropping worker that failed to reset: {e}")
+        finally:
+            with self.lock:
+                self.in_use -= 1
+                semaphore = self.semaphores.pop(id(worker), None)
+            self.evict_idle()
+            if semaphore is not None:
+                semaphore.release()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            # oldest idle workers are at the left
+            while (self.idle and len(self.idle) + self.in_use > self.min_size
+                   and now - self.idle[0][1] > self.idle_timeout):
+                self.idle.popleft()
+                self.stats["evicted"] += 1
+
+    @asynccontextmanager
+    async def worker(self):
+        async with self.admission.slot(ADMISSION_WORKER):
+            worker = await self.acquire()
+            try:
+                yield worker
+            finally:
+                self.release(worker)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["idle"] = len(self.idle)
+            stats["in_use"] = self.in_use
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_worker_pool(config: dict, log: logging.Logger, factory: Callable[[], MyAssistant]) -> WorkerPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(config, log, factory)
+            _pool.prewarm()
+        return _pool
@@ -1,21 +1,170 @@
+# Chat history trimmed to a token budget instead of a message count.
+# Tokens are counted once per message when it is appended, so trimming is a sum over cached counts.
+# The oldest turns (a question and its answer) are dropped first; the system prompt and the current question are
+# pinned by the caller reserving their tokens. With HISTORY_COMPACT_ENABLED dropped turns are folded into a
+# summary that is kept until more turns are dropped, by default a short extract of each turn, or by the
+# summarizer set with set_summarizer().
+# With a background summarizer (set_background_summarizer()), the oldest turns are folded into the summary by the
+# model before the budget is reached, the request path only swaps in a finished summary.
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from const import MAX_TOKENS
+from token_counter import count_message_tokens, count_tokens, truncate_to_tokens
+
+DEFAULT_SUMMARY_MAX_TOKENS = 512
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+EXTRACT_CHARS = 120
 
 class ChatHistory:
     def __init__(self, config: dict):
         self.config = config
-        self.max_history_len = config["MAX_HISTORY_LEN"]
-        self.history = [] 
-        
+        self.max_history_len = config.get("MAX_HISTORY_LEN", 0)
+        self.max_tokens = config.get("HISTORY_MAX_TOKENS", MAX_TOKENS)
+        # one message never takes more than half of the budget
+        self.max_message_tokens = config.get("HISTORY_MESSAGE_MAX_TOKENS", self.max_tokens // 2)
+        self.compact_enabled = config.get("HISTORY_COMPACT_ENABLED", False)
+        self.summary_max_tokens = config.get("HISTORY_SUMMARY_MAX_TOKENS", DEFAULT_SUMMARY_MAX_TOKENS)
+        self.history = []
+        self.tokens = []
+        self.total_tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summarizer = None
+        self.background_summarizer = None
+        self.summary_model = None
+        self.summary_job = None
+        # tokens of the messages the current summary stands for
+        self.folded_tokens = 0
+
+    def set_summarizer(self, summarizer):
+        """summarizer(previous_summary, dropped_messages) -> summary text, used instead of the extract."""
+        self.summarizer = summarizer
+
+    def set_background_summarizer(self, summarizer, model):
+        """Fold old turns with model on summarizer (a HistorySummarizer), off the request path."""
+        self.background_summarizer = summarizer
+        self.summary_model = model
+
     def add_user_message(self, message: str):
-        self.history.append(HumanMessage(content=message))
-        
+        self.append(HumanMessage(content=message))
+
     def add_ai_message(self, message: str):
-        self.history.append(AIMessage(content=message))
-    
-    def get_full_history(self) -> list:
-        if len(self.history) > self.max_history_len:
-            self.history.pop(0)
-        return self.history.copy()
-    
+        self.append(AIMessage(content=message))
+        # trim after a whole turn, so a question is never kept without its answer
+        self.apply_summary_job()
+        self.trim()
+        self.schedule_summary()
+
+    def append(self, message):
+        tokens = count_message_tokens(message)
+        if tokens > self.max_message_tokens:
+            message.content = truncate_to_tokens(message.content, self.max_message_tokens)
+            tokens = count_message_tokens(message)
+        self.history.append(message)
+        self.tokens.append(tokens)
+        self.total_tokens += tokens
+
+    def trim(self):
+        """Drop the oldest turns while the history is over its token budget or message limit."""
+        dropped = []
+        while self.history and (self.total_tokens + self.summary_tokens > self.max_tokens
+                                or (self.max_history_len and len(self.history) > self.max_history_len)):
+            dropped.extend(self.pop_turn())
+        if dropped and self.compact_enabled:
+            self.compact(dropped)
+
+    def pop_turn(self) -> list:
+        count = 2 if len(self.history) > 1 and isinstance(self.history[1], AIMessage) else 1
+        turn = self.history[:count]
+        self.total_tokens -= sum(self.tokens[:count])
+        del self.history[:count]
+        del self.tokens[:count]
+        return turn
+
+    def compact(self, dropped: list):
+        if self.summarizer:
+            summary = self.summarizer(self.summary, dropped)
+        else:
+            lines = [self.summary] if self.summary else []
+            for message in dropped:
+                role = "Q" if isinstance(message, HumanMessage) else "A"
+                text = " ".join(message.content.split())
+                lines.append(f"{role}: {text[:EXTRACT_CHARS]}{'...' if len(text) > EXTRACT_CHARS else ''}")
+            summary = "\n".join(lines)
+            # the extract keeps its latest lines
+            while count_tokens(summary) > self.summary_max_tokens and "\n" in summary:
+                summary = summary.split("\n", 1)[1]
+        self.set_summary(summary)
+
+    def set_summary(self, summary: str):
+        self.summary = truncate_to_tokens(summary, self.summary_max_tokens) if summary else ""
+        self.summary_tokens = count_tokens(SUMMARY_PREFIX + self.summary) if self.summary else 0
+
+    def schedule_summary(self):
+        """Start folding the oldest turns when the history passes the summarize threshold."""
+        summarizer = self.background_summarizer
+        if summarizer is None or self.summary_job is not None:
+            return
+        if self.total_tokens + self.summary_tokens <= self.max_tokens * summarizer.threshold:
+            return
+        count = len(self.history) - summarizer.keep_turns * 2
+        # fold whole turns only
+        while count > 0 and isinstance(self.history[count], AIMessage):
+            count -= 1
+        if count <= 0:
+            return
+        messages = self.history[:count]
+        self.summary_job = (summarizer.submit(self.summary_model, self.summary, messages, self.summary_max_tokens), messages)
+
+    def apply_summary_job(self):
+        """Swap in a finished background summary, if the turns it folds are still the oldest ones."""
+        if self.summary_job is None or not self.summary_job[0].done():
+            return
+        future, messages = self.summary_job
+        self.summary_job = None
+        if future.cancelled() or future.exception() is not None:
+            return
+        if len(messages) > len(self.history) or any(a is not b for a, b in zip(messages, self.history)):
+            # trimmed or cleared meanwhile
+            return
+        self.fold(len(messages), future.result())
+
+    def fold(self, count: int, summary: str):
+        tokens = sum(self.tokens[:count])
+        del self.history[:count]
+        del self.tokens[:count]
+        self.total_tokens -= tokens
+        self.folded_tokens += tokens
+        self.set_summary(summary)
+        if self.background_summarizer:
+            self.background_summarizer.record_fold(tokens, self.summary_tokens)
+
+    def get_full_history(self, reserved_tokens: int = 0) -> list:
+        """The newest messages that fit the budget left after reserved_tokens, after the summary if any."""
+        self.apply_summary_job()
+        if self.summary and self.background_summarizer:
+            self.background_summarizer.record_prompt(self.folded_tokens - self.summary_tokens)
+        budget = self.max_tokens - reserved_tokens - self.summary_tokens
+        start = len(self.history)
+        used = 0
+        while start > 0 and used + self.tokens[start - 1] <= budget:
+            start -= 1
+            used += self.tokens[start]
+        # never start with an answer whose question was cut
+        if start < len(self.history) and isinstance(self.history[start], AIMessage):
+            start += 1
+        messages = self.history[start:]
+        if self.summary:
+            messages = [SystemMessage(content=SUMMARY_PREFIX + self.summary)] + messages
+        return messages
+
+    def get_token_count(self) -> int:
+        return self.total_tokens + self.summary_tokens
+
     def clear_history(self):
-        self.history.clear()
\ No newline at end of file
+        self.history.clear()
+        self.tokens.clear()
+        self.total_tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summary_job = None
+        self.folded_tokens = 0
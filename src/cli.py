@@ -5,11 +5,42 @@ import json
 # from .client.math_client import MathClient
 import logging
 from .assist_creator import AssistantCreator
+from .const import STAGE_ANALYZE, STAGE_EXECUTE, STAGE_ANSWER
+from .deadline import deadline_scope, DEFAULT_REQUEST_TIMEOUT
 
 
-def run_async(multi_assistant, question):
+def run_async(multi_assistant, question, timeout=None):
     # return asyncio.run(multi_assistant.aask(question))
-    return asyncio.run(multi_assistant.aask_with_scheduler(question))
+    with deadline_scope(timeout):
+        return asyncio.run(multi_assistant.aask_with_scheduler(question))
+
+async def print_stream(assistant, question, multi: bool):
+    # print deltas as soon as they arrive, the multi assistant yields (stage, text)
+    print("Assistant >> ", end="", flush=True)
+    if not multi:
+        async for delta in assistant.astream(question):
+            print(delta, end="", flush=True)
+        print()
+        return
+    stage = None
+    async for current, delta in assistant.astream_with_scheduler(question):
+        if current != stage:
+            stage = current
+            if stage == STAGE_EXECUTE:
+                print("\n[Task results]")
+            elif stage == STAGE_ANSWER:
+                print("\n[Answer]")
+        print(delta, end="", flush=True)
+    print()
+
+def run_stream(assistant, question, multi: bool, timeout=None):
+    # the deadline is copied into the loop's context and bounds every stage of the request
+    with deadline_scope(timeout):
+        try:
+            asyncio.run(print_stream(assistant, question, multi))
+        except Exception as e:
+            # a failed answer ends this question, not the session
+            print(f"\nError: {e}")
 
 def main():
     try:
@@ -29,16 +60,21 @@ def main():
             assistant = creator.create_assistant_with_input()
         else:
             assistant = creator.create_muti_assistant()
+        stream = config.get("STREAM", True)
         # Start the assistant
         while True:
             user_input = input("You << ")
             if user_input.lower() == 'q':
                 print("Goodbye!")
                 break
+            if stream:
+                run_stream(assistant, user_input, question_type != "1",
+                           config.get("REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT))
+                continue
             if question_type == "1":
                 response = assistant.ask(user_input)
             else:
-                response = run_async(assistant, user_input)
+                response = run_async(assistant, user_input, config.get("REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT))
             if response:
                 print(f"Assistant >> {response}")
     except Exception as e:
@@ -0,0 +1,173 @@
+# Coalescing of identical concurrent requests (single-flight).
+# The first request for a key starts the work as a task of its own, identical requests that arrive while it runs
+# join it and get the same result, or the same stream of items replayed from the start. The work is cancelled
+# only when every request waiting on it has gone away.
+# Staleness rules, read with a config prefix (SERVICE_, MODEL_):
+#   <PREFIX>_COALESCE_MAX_AGE: a request never joins work started longer ago than this, 0 for no limit.
+#   <PREFIX>_COALESCE_RESULT_TTL: finished results are still shared this long after they complete, 0 for in-flight only.
+import re
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+from .deadline import DeadlineExceeded, remaining
+
+DEFAULT_MAX_AGE = 0
+DEFAULT_RESULT_TTL = 0
+MAX_FINISHED = 256
+TRAILING_PUNCTUATION = "?？!！.。,，;；:： "
+
+def normalize_question(question: str) -> str:
+    """Case, spacing and trailing punctuation do not make a question different."""
+    return re.sub(r"\s+", " ", question or "").strip().casefold().rstrip(TRAILING_PUNCTUATION)
+
+
+class Flight:
+    """One run of the work, shared by every request that joined it."""
+    def __init__(self, key, factory: Callable, stream: bool, owner=None):
+        self.key = key
+        # who started it, e.g. a session id
+        self.owner = owner
+        self.started = time.monotonic()
+        self.finished = None
+        self.items = []
+        self.users = 0
+        self.abandoned = False
+        self.changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self.pump(factory) if stream else factory())
+        self.task.add_done_callback(lambda _: self.changed.set())
+
+    async def pump(self, factory: Callable):
+        async for item in factory():
+            self.items.append(item)
+            self.changed.set()
+
+    def is_usable(self, max_age: float) -> bool:
+        if self.task.get_loop() is not asyncio.get_running_loop() or self.abandoned or self.task.cancelled():
+            return False
+        return not max_age or time.monotonic() - self.started <= max_age
+
+    def leave(self):
+        self.users -= 1
+        if self.users <= 0 and not self.task.done():
+            # nobody waits for the result any more
+            self.abandoned = True
+            self.task.cancel()
+
+    async def result(self):
+        self.users += 1
+        try:
+            return await asyncio.shield(self.task)
+        finally:
+            self.leave()
+
+    async def iterate(self) -> AsyncIterator:
+        self.users += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.items):
+                    yield self.items[index]
+                    index += 1
+                if self.task.done():
+                    if index < len(self.items):
+                        continue
+                    # raises the failure of the work, if any
+                    self.task.result()
+                    return
+                self.changed.clear()
+                await self.changed.wait()
+        finally:
+            self.leave()
+
+
+class RequestCoalescer:
+    def __init__(self, config: dict, log: logging.Logger, prefix: str):
+        self.config = config
+        self.log = log
+        self.prefix = prefix
+        self.enabled = config.get(f"{prefix}_COALESCE_ENABLED", True)
+        self.max_age = config.get(f"{prefix}_COALESCE_MAX_AGE", DEFAULT_MAX_AGE)
+        self.result_ttl = config.get(f"{prefix}_COALESCE_RESULT_TTL", DEFAULT_RESULT_TTL)
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.finished = OrderedDict()
+        self.stats = {"leaders": 0, "coalesced": 0, "result_hits": 0, "stale": 0, "failures": 0}
+
+    def join(self, key, factory: Callable, stream: bool = False, owner=None) -> Tuple[Flight, bool]:
+        """The flight of key, joined or started; True when this request started it."""
+        if key is None or not self.enabled:
+            return Flight(None, factory, stream, owner), True
+        # the summarizer loop thread shares the model coalescer with the request loop
+        with self.lock:
+            flight = self.get_finished(key)
+            if flight is not None:
+                self.stats["result_hits"] += 1
+                return flight, False
+            flight = self.inflight.get(key)
+            if flight is not None:
+                if flight.is_usable(self.max_age):
+                    self.stats["coalesced"] += 1
+                    return flight, False
+                self.stats["stale"] += 1
+            flight = Flight(key, factory, stream, owner)
+            self.inflight[key] = flight
+            self.stats["leaders"] += 1
+        flight.task.add_done_callback(lambda task: self.done(flight, task))
+        return flight, True
+
+    def get_finished(self, key) -> Optional[Flight]:
+        if not self.result_ttl:
+            return None
+        flight = self.finished.get(key)
+        if flight is None:
+            return None
+        if time.monotonic() - flight.finished > self.result_ttl or flight.task.get_loop() is not asyncio.get_running_loop():
+            del self.finished[key]
+            return None
+        return flight
+
+    def done(self, flight: Flight, task: asyncio.Task):
+        failed = task.cancelled() or task.exception() is not None
+        with self.lock:
+            if self.inflight.get(flight.key) is flight:
+                del self.inflight[flight.key]
+            if failed:
+                # failures are never shared with later requests
+                self.stats["failures"] += 1
+            elif self.result_ttl:
+                flight.finished = time.monotonic()
+                self.finished[flight.key] = flight
+                while len(self.finished) > MAX_FINISHED:
+                    self.finished.popitem(last=False)
+
+    async def run(self, key, factory: Callable[[], Awaitable]):
+        """Await factory() once for all identical concurrent calls."""
+        flight, leader = self.join(key, factory)
+        try:
+            return await flight.result()
+        except DeadlineExceeded:
+            # the work ran out of the time of the request that started it, run on our own time if any is left
+            if leader or remaining() == 0:
+                raise
+            return await factory()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["inflight"] = len(self.inflight)
+            stats["finished"] = len(self.finished)
+        return stats
+
+
+_coalescers = {}
+_coalescers_lock = threading.Lock()
+
+def get_request_coalescer(config: dict, log: logging.Logger, prefix: str) -> RequestCoalescer:
+    with _coalescers_lock:
+        coalescer = _coalescers.get(prefix)
+        if coalescer is None:
+            coalescer = _coalescers[prefix] = RequestCoalescer(config, log, prefix)
+        return coalescer
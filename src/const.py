@@ -3,10 +3,16 @@
 TASK = "任务"
 RESULT = "结果"
 TASK_FAILED= "任务失败"
+TASK_TIMEOUT = "任务超时"
+TASK_SKIPPED = "任务跳过"
 TASK_LIST = "工作列表"
 QUSTION_CONFIRM = "确认问题"
 USER = "User"
 ASSISTANT = "Assistant"
 SYSTEM = "System"
 DEFAULT_LANGUAGE = "en"
-MAX_TOKENS = 4096
\ No newline at end of file
+MAX_TOKENS = 4096
+# Stages yielded by MultiAssistant.astream_with_scheduler()
+STAGE_ANALYZE = "analyze"
+STAGE_EXECUTE = "execute"
+STAGE_ANSWER = "answer"
@@ -0,0 +1,89 @@
+# Request-level deadline shared by the whole multi-agent pipeline.
+# The deadline is kept in a context variable, so it follows asyncio tasks created by gather() from the
+# CLI/HTTP entry through the scheduler down to every worker, model call and script, without changing tool signatures.
+import time
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from typing import Awaitable, Iterable, List, Optional
+
+DEFAULT_REQUEST_TIMEOUT = 180
+DEFAULT_SUMMARY_RESERVE = 30
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Set a deadline for the enclosed work, an outer deadline that is sooner always wins."""
+    current = _deadline.get()
+    deadline = current
+    if seconds:
+        deadline = time.monotonic() + seconds
+        if current is not None:
+            deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+def get_deadline() -> Optional[float]:
+    return _deadline.get()
+
+def remaining(reserve: float = 0) -> Optional[float]:
+    """Seconds left before the deadline minus reserve, None if there is no deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic() - reserve, 0)
+
+def clamp_timeout(timeout: Optional[float], reserve: float = 0) -> Optional[float]:
+    left = remaining(reserve)
+    if left is None:
+        return timeout
+    if timeout is None:
+        return left
+    return min(timeout, left)
+
+async def wait_for_deadline(awaitable: Awaitable, reserve: float = 0):
+    """Await with the time left, raise DeadlineExceeded when the budget is spent."""
+    left = remaining(reserve)
+    if left is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=left)
+    except DeadlineExceeded:
+        raise
+    except asyncio.TimeoutError as e:
+        raise DeadlineExceeded(f"Deadline exceeded after {left:.1f} seconds") from e
+
+async def gather_with_deadline(awaitables: Iterable[Awaitable], reserve: float = 0) -> List:
+    """Like gather(return_exceptions=True), work still running at the deadline is cancelled
+    and its slot holds a DeadlineExceeded instead of a result."""
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    if not tasks:
+        return []
+    try:
+        _, pending = await asyncio.wait(tasks, timeout=remaining(reserve))
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+    results = []
+    for task in tasks:
+        if task in pending:
+            results.append(DeadlineExceeded("Task cancelled at the request deadline"))
+        elif task.cancelled():
+            results.append(asyncio.CancelledError())
+        elif task.exception() is not None:
+            results.append(task.exception())
+        else:
+            results.append(task.result())
+    return results
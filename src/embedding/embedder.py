@@ -0,0 +1,84 @@
+# Embedding backends used by the semantic cache and the router.
+# AzureEmbedder calls the configured EMBEDDINGS_MODEL on EMBEDDINGS_ENDPOINT,
+# LocalEmbedder hashes character n-grams into a fixed size vector, it needs no network and is deterministic for offline tests.
+import zlib
+import asyncio
+import logging
+import numpy as np
+from typing import List
+
+EMBEDDER_AZURE = "azure"
+EMBEDDER_LOCAL = "local"
+DEFAULT_LOCAL_DIM = 512
+
+class BaseEmbedder:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError("Subclasses should implement this method.")
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        # embed() may block, keep it off the event loop
+        return await asyncio.to_thread(self.embed, texts)
+
+    def normalize(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class LocalEmbedder(BaseEmbedder):
+    def __init__(self, config: dict, log: logging.Logger):
+        super().__init__(config, log)
+        self.dim = config.get("LOCAL_EMBEDDINGS_DIM", DEFAULT_LOCAL_DIM)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            text = " ".join(text.lower().split())
+            # unigrams, bigrams and trigrams of characters, works for both Chinese and English
+            for n in (1, 2, 3):
+                for j in range(len(text) - n + 1):
+                    gram = text[j:j + n]
+                    if gram.isspace():
+                        continue
+                    vectors[i, zlib.crc32(gram.encode("utf-8")) % self.dim] += n
+        return self.normalize(vectors)
+
+
+class AzureEmbedder(BaseEmbedder):
+    def __init__(self, config: dict, log: logging.Logger):
+        super().__init__(config, log)
+        from ..model.client_registry import get_client_registry
+        self.model_name = config["EMBEDDINGS_MODEL"]
+        # clients come from the shared registry, the async one is bound to the running loop
+        self.registry = get_client_registry(config, log)
+        self.client_args = (
+            config["EMBEDDINGS_ENDPOINT"],
+            self.model_name,
+            config["EMBEDDINGS_API_KEY"],
+            config.get("EMBEDDINGS_API_VERSION", config.get("OPENAI_API_VERSION")),
+        )
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = self.registry.get_openai_client(*self.client_args).embeddings.create(model=self.model_name, input=texts)
+        return self.normalize([item.embedding for item in response.data])
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        client = self.registry.get_openai_async_client(*self.client_args)
+        response = await client.embeddings.create(model=self.model_name, input=texts)
+        return self.normalize([item.embedding for item in response.data])
+
+
+def create_embedder(config: dict, log: logging.Logger, backend: str = None) -> BaseEmbedder:
+    backend = backend or config.get("EMBEDDINGS_BACKEND", "")
+    if not backend:
+        backend = EMBEDDER_AZURE if config.get("EMBEDDINGS_ENDPOINT") else EMBEDDER_LOCAL
+    if backend == EMBEDDER_AZURE:
+        return AzureEmbedder(config, log)
+    if backend == EMBEDDER_LOCAL:
+        return LocalEmbedder(config, log)
+    raise ValueError(f"Unknown embeddings backend: {backend}")
@@ -0,0 +1,121 @@
+# Semantic cache of answers and of manager plans, looked up by cosine similarity of question embeddings.
+# Vectors live in a preallocated numpy matrix, a lookup is one matrix-vector product.
+# Memory is bounded by <PREFIX>_SIZE, the least recently used entry is evicted when full, expired entries are skipped.
+# The answer cache reads SEMANTIC_CACHE_*, the plan cache PLAN_CACHE_*; a plan stays valid longer than the answer
+# about live data it led to, so by default it is kept longer and needs a closer match.
+import time
+import logging
+import threading
+import numpy as np
+from .embedder import BaseEmbedder, create_embedder
+
+SEMANTIC_CACHE = "SEMANTIC_CACHE"
+PLAN_CACHE = "PLAN_CACHE"
+DEFAULT_SEMANTIC_CACHE_SIZE = 512
+DEFAULT_SEMANTIC_CACHE_TTL = 600
+DEFAULT_SEMANTIC_THRESHOLD = 0.92
+DEFAULT_PLAN_CACHE_TTL = 3600
+DEFAULT_PLAN_THRESHOLD = 0.95
+# (size, ttl, threshold) of each cache
+DEFAULTS = {
+    SEMANTIC_CACHE: (DEFAULT_SEMANTIC_CACHE_SIZE, DEFAULT_SEMANTIC_CACHE_TTL, DEFAULT_SEMANTIC_THRESHOLD),
+    PLAN_CACHE: (DEFAULT_SEMANTIC_CACHE_SIZE, DEFAULT_PLAN_CACHE_TTL, DEFAULT_PLAN_THRESHOLD),
+}
+
+class SemanticCache:
+    def __init__(self, config: dict, log: logging.Logger, embedder: BaseEmbedder = None, prefix: str = SEMANTIC_CACHE):
+        self.config = config
+        self.log = log
+        self.name = prefix.lower().replace("_", " ")
+        self.embedder = embedder or create_embedder(config, log)
+        size, ttl, threshold = DEFAULTS.get(prefix, DEFAULTS[SEMANTIC_CACHE])
+        self.max_size = config.get(f"{prefix}_SIZE", size)
+        self.ttl = config.get(f"{prefix}_TTL", ttl)
+        self.threshold = config.get(f"{prefix}_THRESHOLD", threshold)
+        self.lock = threading.Lock()
+        self.vectors = None
+        self.valid = np.zeros(self.max_size, dtype=bool)
+        self.expires = np.zeros(self.max_size, dtype=np.float64)
+        self.last_used = np.zeros(self.max_size, dtype=np.float64)
+        self.questions = [None] * self.max_size
+        self.answers = [None] * self.max_size
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def search(self, vector: np.ndarray, now: float):
+        """Return (slot, score) of the best live entry, slot is -1 when empty. The caller holds the lock."""
+        if self.vectors is None:
+            return -1, 0.0
+        live = self.valid & (self.expires >= now)
+        if not live.any():
+            return -1, 0.0
+        scores = self.vectors @ vector
+        scores[~live] = -1.0
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot])
+
+    def match(self, question: str, vector: np.ndarray):
+        # the slot is read under the same lock as the search, so a concurrent insert can not replace it in between
+        with self.lock:
+            slot, score = self.search(vector, time.time())
+            if slot >= 0 and score >= self.threshold:
+                self.last_used[slot] = time.time()
+                self.stats["hits"] += 1
+                self.log.info(f"{self.name.capitalize()} hit ({score:.3f}): '{question}' ~ '{self.questions[slot]}'")
+                return self.answers[slot]
+            self.stats["misses"] += 1
+            return None
+
+    def lookup(self, question: str):
+        return self.match(question, self.embedder.embed([question])[0])
+
+    async def alookup(self, question: str):
+        vectors = await self.embedder.aembed([question])
+        return self.match(question, vectors[0])
+
+    def insert(self, question: str, answer: str, vector: np.ndarray):
+        now = time.time()
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            # reuse an empty or expired slot, else evict the least recently used one
+            free = np.flatnonzero(~self.valid | (self.expires < now))
+            if free.size:
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self.last_used))
+                self.stats["evictions"] += 1
+            self.vectors[slot] = vector
+            self.valid[slot] = True
+            self.expires[slot] = now + self.ttl
+            self.last_used[slot] = now
+            self.questions[slot] = question
+            self.answers[slot] = answer
+            self.stats["stores"] += 1
+
+    def store(self, question: str, answer: str):
+        if answer:
+            self.insert(question, answer, self.embedder.embed([question])[0])
+
+    async def astore(self, question: str, answer: str):
+        if answer:
+            vectors = await self.embedder.aembed([question])
+            self.insert(question, answer, vectors[0])
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["size"] = int(self.valid.sum())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_semantic_cache(config: dict, log: logging.Logger, prefix: str = SEMANTIC_CACHE) -> SemanticCache:
+    with _caches_lock:
+        cache = _caches.get(prefix)
+        if cache is None:
+            cache = _caches[prefix] = SemanticCache(config, log, prefix=prefix)
+        return cache
@@ -1,11 +1,12 @@
 # In k8s executor, it will inherit from Executor, in which, update base class method list to include its functions, and below methods are overrides except execute(),
 # get_prompt(): provide a prompt string to tell openai who are you and what you can do. for base class, just a common user enough.
 # get_tool_definition(): provide the function definitions of all methods of current class for openai to call.
-# execute_script(): kubectl script string will be as argument, check windows or linux, if windows, use cmd to execute, but for linue, adapt bash and return the result.
+# execute_script()/aexecute_script(): kubectl script string will be as argument, check windows or linux, if windows, use cmd to execute, but for linue, adapt bash and return the result. the async one runs by asyncio subprocess with timeout.
+# query_resources()/summarize_resources(): structured queries answered from the shared snapshot cache, one bulk kubectl get per kind and refresh interval.
 
 import os
-import subprocess
 from .executor import Executor
+from .k8s_snapshot import get_k8s_snapshot, DEFAULT_QUERY_LIMIT
 import logging
 import json
 
@@ -15,10 +16,28 @@ class K8sExecutor(Executor):
         self.log = log
         super().__init__()
         self.update_method_list()
+        self.setup_shell_pool()
+        self.setup_command_cache()
+        self.setup_admission()
+        self.setup_output_limits("K8S")
+        self.setup_snapshot()
 
     def update_method_list(self):
         self.methods[ "execute_script"] = self.execute_script
         self.methods[ "get_system"] = self.get_system
+        self.async_methods[ "execute_script"] = self.aexecute_script
+
+    def setup_snapshot(self):
+        self.snapshot = None
+        if self.config.get("K8S_SNAPSHOT_ENABLED", True):
+            self.snapshot = get_k8s_snapshot(self.config, self.log)
+            self.methods[ "query_resources"] = self.query_resources
+            self.methods[ "summarize_resources"] = self.summarize_resources
+            self.async_methods[ "query_resources"] = self.aquery_resources
+            self.async_methods[ "summarize_resources"] = self.asummarize_resources
+
+    def is_async(self):
+        return True
 
     def get_prompt(self):
         if(self.prompt != ""):
@@ -33,11 +52,11 @@ class K8sExecutor(Executor):
         return self.context
 
     def get_tool_definition(self):
-        return [{
+        tools = [{
             "type": "function",
             "function": {
                 "name": "execute_script",
-                "description": "Execute a aws and k8s management script string. If on Windows, use cmd to execute. If on Linux, use bash and return the result.",
+                "description": "Execute a aws and k8s management script string. If on Windows, use cmd to execute. If on Linux, use bash and return the result. " + self.get_output_limits_description(),
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -57,14 +76,97 @@ class K8sExecutor(Executor):
                 "description": "Return a string to indicate if it is Windows or Linux system.",
             },
         }]
+        if self.snapshot:
+            tools.extend(self.get_snapshot_tool_definition())
+        return tools
 
-    def execute_script(self, script):
+    def get_snapshot_tool_definition(self):
+        kind = {
+            "type": "string",
+            "description": "Resource kind as for kubectl get, e.g. pods, nodes, deployments, services, events."
+        }
+        namespace = {
+            "type": "string",
+            "description": "Only objects in this namespace, default all namespaces."
+        }
+        return [{
+            "type": "function",
+            "function": {
+                "name": "query_resources",
+                "description": f"Query Kubernetes objects from a snapshot of the cluster refreshed every {self.snapshot.ttl} seconds and return a compact json summary of each (e.g. phase, ready, restarts, node and reasons of pods). Prefer it to kubectl get scripts, several queries cost one kubectl call per kind.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "kind": kind,
+                        "namespace": namespace,
+                        "label_selector": {
+                            "type": "string",
+                            "description": "Label selector with =, != and existence terms, e.g. app=web,tier!=db."
+                        },
+                        "owner": {
+                            "type": "string",
+                            "description": "Only objects owned by Kind/name, e.g. Deployment/web finds the pods of a deployment through its replicasets."
+                        },
+                        "name": {
+                            "type": "string",
+                            "description": "Only objects with this exact name."
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": f"Maximum number of objects returned, default {DEFAULT_QUERY_LIMIT}, the total count is always returned."
+                        }
+                    },
+                    "required": ["kind"]
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "summarize_resources",
+                "description": "Count Kubernetes objects of a kind per namespace and per status (phase, Ready/NotReady, event type) from the cluster snapshot, as json. Use it for overviews before querying details.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "kind": kind,
+                        "namespace": namespace
+                    },
+                    "required": ["kind"]
+                },
+            },
+        }]
+
+    def get_command(self, script):
         if os.name == 'nt':  # Windows
-            result = subprocess.run(['cmd', '/c', script], capture_output=True, text=True)
+            return ['cmd', '/c', script]
         else:  # Linux
-            result = subprocess.run(['bash', '-c', script], capture_output=True, text=True)
-        return result.stdout
+            return ['bash', '-c', script]
+
+    def execute_script(self, script):
+        self.log.debug(f"Executing script: {script}")
+        return self.run_script(self.get_command(script))
+
+    async def aexecute_script(self, script):
+        self.log.debug(f"Executing script async: {script}")
+        if self.shell_pool:
+            return await self.arun_pooled_script(script)
+        return await self.arun_script(self.get_command(script))
     
+    def query_resources(self, kind, namespace="", label_selector="", owner="", name="", limit=DEFAULT_QUERY_LIMIT):
+        return self.to_json(self.snapshot.query(kind, namespace, label_selector, owner, name, limit))
+
+    async def aquery_resources(self, kind, namespace="", label_selector="", owner="", name="", limit=DEFAULT_QUERY_LIMIT):
+        return self.to_json(await self.snapshot.aquery(kind, namespace, label_selector, owner, name, limit))
+
+    def summarize_resources(self, kind, namespace=""):
+        return self.to_json(self.snapshot.summary(kind, namespace))
+
+    async def asummarize_resources(self, kind, namespace=""):
+        return self.to_json(await self.snapshot.asummary(kind, namespace))
+
+    def to_json(self, data) -> str:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
     def get_system(self):
         if os.name == 'nt':  # Windows
             return "Windows"
@@ -1,10 +1,17 @@
 # In PC executor, it will inherit from Executor, in which, update base class method list to include its functions, and below methods are overrides except execute(),
 # get_prompt(): provide a prompt string to tell openai who are you and what you can do. for base class, just a common user enough.
 # get_tool_definition(): provide the function definitions of all methods of current class for openai to call.
-# execute_script(): script string will be as argument, check windows or linux, if windows, use cmd to execute, but for linue, adapt bash and return the result.
+# execute_script()/aexecute_script(): script string will be as argument, check windows or linux, if windows, use cmd to execute, but for linue, adapt bash and return the result. the async one runs by asyncio subprocess with timeout.
+# get_top_processes()/get_cpu_usage()/get_memory_info()/get_disk_usage()/get_load_average(): on Linux, read /proc and statvfs natively and return compact json, no script is spawned.
+# get_metric_stats()/get_metric_spikes(): windowed aggregates over the history kept by the background metrics sampler.
+# analyze_metrics(): anomaly and change-point detection over a metrics csv or the sampler history, only flagged windows are returned.
 import os
-import subprocess
+import time
+import asyncio
 from .executor import Executor
+from . import proc_metrics
+from . import anomaly
+from .metrics_sampler import get_metrics_sampler, read_metrics_csv, DEFAULT_SPIKE_THRESHOLD, METRICS
 import logging
 import json
 
@@ -14,12 +21,40 @@ class PCExecutor(Executor):
         self.log = log
         super().__init__()
         self.update_method_list()
+        self.setup_shell_pool()
+        self.setup_command_cache()
+        self.setup_admission()
+        self.setup_output_limits("PC")
+        self.setup_metrics_sampler()
         self.prompt = ""
         self.context = ""
 
     def update_method_list(self):
         self.methods[ "execute_script"] = self.execute_script
         self.methods[ "get_system"] = self.get_system
+        self.methods[ "analyze_metrics"] = self.analyze_metrics
+        self.async_methods[ "execute_script"] = self.aexecute_script
+        # reading a large csv and the detection are cpu bound, they run off the event loop
+        self.async_methods[ "analyze_metrics"] = self.aanalyze_metrics
+        if proc_metrics.is_supported():
+            self.methods[ "get_top_processes"] = self.get_top_processes
+            self.methods[ "get_cpu_usage"] = self.get_cpu_usage
+            self.methods[ "get_memory_info"] = self.get_memory_info
+            self.methods[ "get_disk_usage"] = self.get_disk_usage
+            self.methods[ "get_load_average"] = self.get_load_average
+            # cpu sampling waits for an interval, the async ones do not block the loop
+            self.async_methods[ "get_top_processes"] = self.aget_top_processes
+            self.async_methods[ "get_cpu_usage"] = self.aget_cpu_usage
+
+    def setup_metrics_sampler(self):
+        self.metrics_sampler = None
+        if proc_metrics.is_supported() and self.config.get("METRICS_SAMPLER_ENABLED", True):
+            self.metrics_sampler = get_metrics_sampler(self.config, self.log)
+            self.methods[ "get_metric_stats"] = self.get_metric_stats
+            self.methods[ "get_metric_spikes"] = self.get_metric_spikes
+
+    def is_async(self):
+        return True
 
     def get_prompt(self):
         if(self.prompt != ""):
@@ -34,11 +69,11 @@ class PCExecutor(Executor):
         return self.context
 
     def get_tool_definition(self):
-        return [{
+        tools = [{
             "type": "function",
             "function": {
                 "name": "execute_script",
-                "description": "Execute a script string. If on Windows, use power shell to execute. If on Linux, use bash and return the result.",
+                "description": "Execute a script string. If on Windows, use power shell to execute. If on Linux, use bash and return the result. " + self.get_output_limits_description(),
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -57,18 +92,209 @@ class PCExecutor(Executor):
                 "name": "get_system",
                 "description": "Return a string to indicate if it is Windows or Linux system.",
             },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "analyze_metrics",
+                "description": "Detect anomalies (rolling z-score spikes and dips) and change points (level shifts) in a usage time series and return only the flagged windows as json. Use it instead of reading a metrics csv.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "source": {
+                            "type": "string",
+                            "description": "Path of a metrics csv like memory_usage.csv (\"Timestamp\",\"Memory Usage (%)\" ...), or \"live\" for the history sampled in the background on Linux. Default live."
+                        },
+                        "metric": {
+                            "type": "string",
+                            "enum": list(METRICS),
+                            "description": "Only analyze this metric, default all metrics found."
+                        },
+                        "window": {
+                            "type": "integer",
+                            "description": f"Number of samples in the rolling window, default {anomaly.DEFAULT_WINDOW}."
+                        },
+                        "threshold": {
+                            "type": "number",
+                            "description": f"Number of standard deviations to flag, default {anomaly.DEFAULT_THRESHOLD}."
+                        }
+                    },
+                },
+            },
         }]
+        if proc_metrics.is_supported():
+            tools.extend(self.get_metrics_tool_definition())
+        if self.metrics_sampler:
+            tools.extend(self.get_history_tool_definition())
+        return tools
 
-    def execute_script(self, script):
-        self.log.debug(f"Executing script: {script}")
+    def get_history_tool_definition(self):
+        metric = {
+            "type": "string",
+            "enum": list(METRICS),
+            "description": "The usage percentage to query: cpu, memory or disk."
+        }
+        minutes = {
+            "type": "number",
+            "description": "Size of the window, the last N minutes, default 10."
+        }
+        return [{
+            "type": "function",
+            "function": {
+                "name": "get_metric_stats",
+                "description": f"Linux only. Return min, max, mean, p95, last value and trend slope (points per minute) of a usage percentage over the last N minutes as json, from the history sampled every {self.metrics_sampler.interval} seconds. Use it for trend questions instead of scripts.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "metric": metric,
+                        "minutes": minutes
+                    },
+                    "required": ["metric"]
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "get_metric_spikes",
+                "description": "Linux only. Return the samples of a usage percentage over the last N minutes that are more than threshold standard deviations above the window mean, as json.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "metric": metric,
+                        "minutes": minutes,
+                        "threshold": {
+                            "type": "number",
+                            "description": f"Number of standard deviations, default {DEFAULT_SPIKE_THRESHOLD}."
+                        }
+                    },
+                    "required": ["metric"]
+                },
+            },
+        }]
+
+    def get_metrics_tool_definition(self):
+        return [{
+            "type": "function",
+            "function": {
+                "name": "get_top_processes",
+                "description": "Linux only. Return the top processes as json with pid, name, cpu_percent (of one core), rss_mb, state and uid. Prefer it to ps/top scripts.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "sort_by": {
+                            "type": "string",
+                            "enum": ["rss", "cpu"],
+                            "description": "Sort by resident memory (rss) or cpu usage, default rss."
+                        },
+                        "count": {
+                            "type": "integer",
+                            "description": f"Number of processes to return, default {proc_metrics.DEFAULT_TOP_COUNT}, at most {proc_metrics.MAX_TOP_COUNT}."
+                        }
+                    },
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "get_cpu_usage",
+                "description": "Linux only. Return the overall cpu usage percentages (user, system, idle, iowait, steal, busy ...) as json. Prefer it to top/vmstat scripts.",
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "get_memory_info",
+                "description": "Linux only. Return the memory and swap breakdown in MB as json (total, used, free, available, buffers, cache, used_percent ...). Prefer it to free scripts.",
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "get_disk_usage",
+                "description": "Linux only. Return the usage of every mounted file system as json (mount, device, type, size_gb, used_gb, avail_gb, used_percent, inodes_used_percent). Prefer it to df scripts.",
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "get_load_average",
+                "description": "Linux only. Return the 1/5/15 minute load averages, cpu count, running and total tasks and uptime as json. Prefer it to uptime scripts.",
+            },
+        }]
+
+    def get_command(self, script):
         if os.name == 'nt':  # Windows
-            result = subprocess.run(['powershell', '-Command', script], capture_output=True, text=True)
+            return ['powershell', '-Command', script]
         else:  # Linux
-            result = subprocess.run(['bash', '-c', script], capture_output=True, text=True)
-        result = result.stdout
+            return ['bash', '-c', script]
+
+    def execute_script(self, script):
+        self.log.debug(f"Executing script: {script}")
+        result = self.run_script(self.get_command(script))
+        self.log.debug(f"Script result: {result}")
+        return result
+
+    async def aexecute_script(self, script):
+        self.log.debug(f"Executing script async: {script}")
+        if self.shell_pool:
+            result = await self.arun_pooled_script(script)
+        else:
+            result = await self.arun_script(self.get_command(script))
         self.log.debug(f"Script result: {result}")
         return result
     
+    def get_top_processes(self, sort_by="rss", count=proc_metrics.DEFAULT_TOP_COUNT):
+        before = proc_metrics.take_cpu_sample()
+        time.sleep(proc_metrics.DEFAULT_CPU_INTERVAL)
+        return self.to_json(proc_metrics.top_processes(before, proc_metrics.take_cpu_sample(), sort_by, int(count)))
+
+    async def aget_top_processes(self, sort_by="rss", count=proc_metrics.DEFAULT_TOP_COUNT):
+        before = proc_metrics.take_cpu_sample()
+        await asyncio.sleep(proc_metrics.DEFAULT_CPU_INTERVAL)
+        return self.to_json(proc_metrics.top_processes(before, proc_metrics.take_cpu_sample(), sort_by, int(count)))
+
+    def get_cpu_usage(self):
+        before = proc_metrics.take_cpu_sample(processes=False)
+        time.sleep(proc_metrics.DEFAULT_CPU_INTERVAL)
+        return self.to_json(proc_metrics.cpu_usage(before, proc_metrics.take_cpu_sample(processes=False)))
+
+    async def aget_cpu_usage(self):
+        before = proc_metrics.take_cpu_sample(processes=False)
+        await asyncio.sleep(proc_metrics.DEFAULT_CPU_INTERVAL)
+        return self.to_json(proc_metrics.cpu_usage(before, proc_metrics.take_cpu_sample(processes=False)))
+
+    def get_memory_info(self):
+        return self.to_json(proc_metrics.memory_info())
+
+    def get_disk_usage(self):
+        return self.to_json(proc_metrics.disk_usage())
+
+    def get_load_average(self):
+        return self.to_json(proc_metrics.load_average())
+
+    def get_metric_stats(self, metric, minutes=10):
+        return self.to_json(self.metrics_sampler.aggregate(metric, float(minutes)))
+
+    def get_metric_spikes(self, metric, minutes=10, threshold=DEFAULT_SPIKE_THRESHOLD):
+        return self.to_json(self.metrics_sampler.spikes(metric, float(minutes), float(threshold)))
+
+    def analyze_metrics(self, source="live", metric="", window=anomaly.DEFAULT_WINDOW, threshold=anomaly.DEFAULT_THRESHOLD):
+        if source == "live":
+            if not self.metrics_sampler:
+                return "Error: the metrics sampler is not running, give the path of a metrics csv."
+            data = anomaly.history_to_series(self.metrics_sampler.get_history())
+        else:
+            data = read_metrics_csv(source)
+        return self.to_json(anomaly.analyze(data, [metric] if metric else None, int(window), float(threshold)))
+
+    async def aanalyze_metrics(self, source="live", metric="", window=anomaly.DEFAULT_WINDOW, threshold=anomaly.DEFAULT_THRESHOLD):
+        return await asyncio.to_thread(self.analyze_metrics, source, metric, window, threshold)
+
+    def to_json(self, data) -> str:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
     def get_system(self):
         if os.name == 'nt':  # Windows
             return "Windows"
@@ -0,0 +1,107 @@
+# Vectorized anomaly and change-point detection over metric time series (memory_usage.csv or the live sampler).
+# Only flagged windows are returned, so the model reads a few lines instead of the whole series.
+# Anomalies: points whose rolling z-score against the preceding window exceeds the threshold, consecutive points merged.
+# Change points: points where the mean of the next window differs from the mean of the previous one by more than
+# threshold pooled standard deviations, the strongest point of every run kept.
+import numpy as np
+import pandas as pd
+from .metrics_sampler import format_timestamp, COLUMNS, METRICS
+
+DEFAULT_WINDOW = 12
+DEFAULT_THRESHOLD = 3.0
+MAX_FLAGGED = 20
+# a flat series still has some noise, so tiny deviations are not scored against a zero std
+MIN_STD = 0.01
+
+def history_to_series(history: np.ndarray) -> dict:
+    """Sampler ring buffer rows to {"time": array, metric: array}."""
+    data = {"time": history[:, 0]}
+    for metric in METRICS:
+        data[metric] = history[:, COLUMNS.index(metric)]
+    return data
+
+def find_runs(mask: np.ndarray) -> list:
+    """(start, end) index pairs, end inclusive, of the consecutive True runs in mask."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1))
+
+def detect_anomalies(times: np.ndarray, values: np.ndarray, window: int = DEFAULT_WINDOW,
+                     threshold: float = DEFAULT_THRESHOLD) -> list:
+    series = pd.Series(values)
+    # statistics of the preceding window only, so a spike does not hide itself
+    rolling = series.rolling(window, min_periods=max(window // 2, 3))
+    mean = rolling.mean().shift(1).to_numpy()
+    std = np.maximum(rolling.std().shift(1).to_numpy(), MIN_STD)
+    scores = (values - mean) / std
+    mask = np.nan_to_num(np.abs(scores)) > threshold
+    windows = []
+    for start, end in find_runs(mask):
+        peak = start + int(np.argmax(np.abs(scores[start:end + 1])))
+        windows.append({
+            "from": format_timestamp(times[start]),
+            "to": format_timestamp(times[end]),
+            "samples": int(end - start + 1),
+            "peak": round(float(values[peak]), 2),
+            "baseline": round(float(mean[peak]), 2),
+            "z": round(float(scores[peak]), 1),
+        })
+    return windows
+
+def detect_change_points(times: np.ndarray, values: np.ndarray, window: int = DEFAULT_WINDOW,
+                         threshold: float = DEFAULT_THRESHOLD) -> list:
+    count = len(values)
+    if count < 2 * window:
+        return []
+    # window sums before and after every split point from cumulative sums, O(n)
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    squares = np.concatenate(([0.0], np.cumsum(values * values)))
+    splits = np.arange(window, count - window + 1)
+    before = (sums[splits] - sums[splits - window]) / window
+    after = (sums[splits + window] - sums[splits]) / window
+    before_var = (squares[splits] - squares[splits - window]) / window - before ** 2
+    after_var = (squares[splits + window] - squares[splits]) / window - after ** 2
+    pooled = np.maximum(np.sqrt(np.maximum((before_var + after_var) / 2, 0)), MIN_STD)
+    scores = (after - before) / pooled
+    points = []
+    for start, end in find_runs(np.abs(scores) > threshold):
+        best = start + int(np.argmax(np.abs(scores[start:end + 1])))
+        split = splits[best]
+        points.append({
+            "time": format_timestamp(times[split]),
+            "before_mean": round(float(before[best]), 2),
+            "after_mean": round(float(after[best]), 2),
+            "shift": round(float(after[best] - before[best]), 2),
+            "score": round(float(scores[best]), 1),
+        })
+    return points
+
+def strongest(items: list, key: str, limit: int = MAX_FLAGGED) -> list:
+    """The limit items with the largest absolute key, kept in time order."""
+    if len(items) <= limit:
+        return items
+    keep = sorted(sorted(range(len(items)), key=lambda i: abs(items[i][key]), reverse=True)[:limit])
+    return [items[i] for i in keep]
+
+def analyze(data: dict, metrics: list = None, window: int = DEFAULT_WINDOW, threshold: float = DEFAULT_THRESHOLD) -> dict:
+    """Flagged anomaly windows and change points of every metric in data."""
+    window = max(int(window), 3)
+    result = {"window": window, "threshold": threshold}
+    for metric in metrics or [name for name in METRICS if name in data]:
+        if metric not in data:
+            result[metric] = {"error": "no such metric in the data"}
+            continue
+        values = data[metric]
+        valid = ~np.isnan(values)
+        times, values = data["time"][valid], values[valid]
+        summary = {"samples": int(len(values))}
+        if len(values):
+            summary.update({"from": format_timestamp(times[0]), "to": format_timestamp(times[-1]),
+                            "mean": round(float(values.mean()), 2)})
+        anomalies = detect_anomalies(times, values, window, threshold)
+        change_points = detect_change_points(times, values, window, threshold)
+        summary["anomaly_count"] = len(anomalies)
+        summary["anomalies"] = strongest(anomalies, "z")
+        summary["change_point_count"] = len(change_points)
+        summary["change_points"] = strongest(change_points, "score")
+        result[metric] = summary
+    return result
@@ -0,0 +1,312 @@
+# Shared cache of read-only command results in front of Executor.execute()/aexecute().
+# Only scripts whose every pipeline segment is a read-only command are cached: the command must be an allowlisted
+# data source or filter, and tools that can also change the system (ip, kubectl, systemctl, journalctl, mount, ...)
+# must be in one of their read-only forms, checked on the arguments (e.g. "ip link show", not "ip link set").
+# The TTL of a script is the shortest TTL of its data source commands (filters like grep/sort have no TTL).
+# Concurrent identical calls are coalesced (single-flight): the first one runs, the others await its result.
+import re
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from .output_capture import SCRIPT_TIMEOUT_MESSAGE, SHELL_FAILED_MESSAGE
+
+DEFAULT_COMMAND_CACHE_SIZE = 256
+CACHED_FUNCTIONS = ("execute_script",)
+NOT_CACHED_PREFIXES = (SCRIPT_TIMEOUT_MESSAGE, SHELL_FAILED_MESSAGE)
+
+# read-only data sources and their TTL in seconds
+DEFAULT_TTL_RULES = {
+    "df": 10, "du": 30, "free": 5, "uptime": 5, "ps": 3, "top": 3, "vmstat": 3, "iostat": 3,
+    "ls": 10, "cat": 5, "stat": 10, "lsblk": 60, "mount": 60, "findmnt": 60, "lscpu": 3600,
+    "uname": 3600, "hostname": 3600, "nproc": 3600, "whoami": 3600, "id": 3600,
+    "ip": 30, "ss": 5, "netstat": 5, "systemctl": 10, "journalctl": 10, "nvidia-smi": 5,
+    "kubectl": 10, "aws": 30,
+}
+# filters only transform the output of a data source
+FILTER_COMMANDS = {"grep", "egrep", "sort", "head", "tail", "awk", "sed", "wc", "cut", "uniq", "tr",
+                   "column", "jq", "echo", "printf", "true"}
+# options that make a filter write files
+WRITE_OPTIONS = {
+    "sed": ("-i", "--in-place"),
+    "awk": ("-i", "--include"),
+    "sort": ("-o", "--output"),
+}
+IP_OBJECTS = {"address", "addr", "a", "link", "l", "route", "r", "ro", "neighbour", "neighbor", "neigh", "n",
+              "rule", "ru", "maddress", "maddr", "m"}
+IP_READ_ONLY_ACTIONS = {"show", "sh", "list", "ls", "lst", "l", "get", "g"}
+IP_OPTIONS = {"-s", "-stats", "-statistics", "-d", "-details", "-4", "-6", "-br", "-brief", "-o", "-oneline",
+              "-j", "-json", "-p", "-pretty", "-c", "-color", "-h", "-human", "-human-readable"}
+KUBECTL_READ_ONLY = {"get", "describe", "top", "logs", "version", "cluster-info", "api-resources", "api-versions",
+                     "explain"}
+KUBECTL_CONFIG_READ_ONLY = {"view", "get-contexts", "current-context", "get-clusters", "get-users"}
+# global kubectl options that take a value as the next word
+KUBECTL_VALUE_OPTIONS = {"-n", "--namespace", "--context", "--kubeconfig", "--cluster", "--user", "-s", "--server",
+                         "--token", "--as", "--as-group", "--request-timeout", "-v", "--v"}
+SYSTEMCTL_READ_ONLY = {"status", "list-units", "list-unit-files", "list-timers", "list-sockets", "list-dependencies",
+                       "is-active", "is-enabled", "is-failed", "show", "cat"}
+JOURNALCTL_WRITE_OPTIONS = ("--vacuum", "--rotate", "--flush", "--sync", "--relinquish-var", "--smart-relinquish-var",
+                            "--setup-keys", "--update-catalog")
+AWS_READ_ONLY_PREFIXES = ("describe-", "list-", "get-")
+AWS_VALUE_OPTIONS = {"--region", "--profile", "--output", "--query", "--endpoint-url", "--cli-read-timeout",
+                     "--cli-connect-timeout", "--color", "--ca-bundle"}
+HOSTNAME_OPTIONS = {"-s", "--short", "-f", "--fqdn", "--long", "-d", "--domain", "-i", "--ip-address", "-I",
+                    "--all-ip-addresses", "-A", "--all-fqdns", "-a", "--alias", "-y", "--yp", "--nis"}
+NVIDIA_SMI_OPTIONS = {"-q", "--query", "-L", "--list-gpus", "-x", "--xml-format", "-u", "--unit"}
+NVIDIA_SMI_VALUE_OPTIONS = {"-i", "--id", "-d", "--display"}
+NVIDIA_SMI_QUERY_PREFIXES = ("--query-gpu=", "--query-compute-apps=", "--format=", "--id=", "--display=")
+
+def positional_args(args: list, value_options=()) -> list:
+    """The arguments that are not options ("-" is stdin), skipping the values of value_options given as a separate word."""
+    positional = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg.startswith("-") and arg != "-":
+            skip = arg in value_options
+        else:
+            positional.append(arg)
+    return positional
+
+def is_read_only_ip(args: list) -> bool:
+    # ip [options] <object> [show|list|get ...]
+    for index, arg in enumerate(args):
+        if not arg.startswith("-"):
+            break
+        if arg not in IP_OPTIONS:
+            return False
+    else:
+        return False
+    if args[index] not in IP_OBJECTS:
+        return False
+    return len(args) == index + 1 or args[index + 1] in IP_READ_ONLY_ACTIONS
+
+def is_read_only_kubectl(args: list) -> bool:
+    positional = positional_args(args, KUBECTL_VALUE_OPTIONS)
+    if not positional:
+        return False
+    if positional[0] == "config":
+        return len(positional) > 1 and positional[1] in KUBECTL_CONFIG_READ_ONLY
+    if positional[0] == "cluster-info":
+        # "cluster-info dump" can write to an output directory
+        return len(positional) == 1
+    return positional[0] in KUBECTL_READ_ONLY
+
+def is_read_only_systemctl(args: list) -> bool:
+    positional = positional_args(args, {"-t", "--type", "--state", "-p", "--property", "-H", "--host", "-M", "--machine"})
+    return bool(positional) and positional[0] in SYSTEMCTL_READ_ONLY
+
+def is_read_only_journalctl(args: list) -> bool:
+    return not any(arg.startswith(JOURNALCTL_WRITE_OPTIONS) for arg in args)
+
+def is_read_only_aws(args: list) -> bool:
+    # aws [options] <service> <operation>
+    positional = positional_args(args, AWS_VALUE_OPTIONS)
+    return len(positional) >= 2 and positional[1].startswith(AWS_READ_ONLY_PREFIXES)
+
+def is_read_only_mount(args: list) -> bool:
+    # without a device or mount point mount only lists
+    return all(arg == "-l" for arg in args)
+
+def is_read_only_hostname(args: list) -> bool:
+    # a name argument or -F/-b would set the hostname
+    return all(arg in HOSTNAME_OPTIONS for arg in args)
+
+def is_read_only_nvidia_smi(args: list) -> bool:
+    # device settings (-pm, -pl, -r, -ac, ...) and sub-commands are not cached, only queries
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in NVIDIA_SMI_VALUE_OPTIONS:
+            skip = True
+        elif arg not in NVIDIA_SMI_OPTIONS and not arg.startswith(NVIDIA_SMI_QUERY_PREFIXES):
+            return False
+    return True
+
+def is_read_only_uniq(args: list) -> bool:
+    # a second file name is the output file
+    return len(positional_args(args, {"-f", "--skip-fields", "-s", "--skip-chars", "-w", "--check-chars"})) < 2
+
+# commands that are read-only only with some arguments
+READ_ONLY_CHECKS = {
+    "ip": is_read_only_ip,
+    "kubectl": is_read_only_kubectl,
+    "systemctl": is_read_only_systemctl,
+    "journalctl": is_read_only_journalctl,
+    "aws": is_read_only_aws,
+    "mount": is_read_only_mount,
+    "hostname": is_read_only_hostname,
+    "nvidia-smi": is_read_only_nvidia_smi,
+    "uniq": is_read_only_uniq,
+}
+SEGMENT_SPLIT = re.compile(r"\|\||&&|\||;")
+# command substitution, process substitution, background jobs and privilege changes are never cached
+UNSAFE_PATTERN = re.compile(r"`|\$\(|<\(|>\(|(^|[^&>])&($|[^&>])|\bsudo\b|\btee\b|\bsystem\s*\(")
+# output redirection is only allowed to /dev/null or between streams
+REDIRECT_PATTERN = re.compile(r"\d*>>?\s*(&\d+|\S+)")
+
+class CommandCache:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.enabled = config.get("COMMAND_CACHE_ENABLED", True)
+        self.max_size = config.get("COMMAND_CACHE_SIZE", DEFAULT_COMMAND_CACHE_SIZE)
+        self.ttl_rules = dict(DEFAULT_TTL_RULES)
+        self.ttl_rules.update(config.get("COMMAND_CACHE_TTL_RULES", {}))
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # single-flight state, futures are bound to the loop they were created in
+        self.inflight = {}
+        self.inflight_sync = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "uncacheable": 0}
+
+    def normalize(self, script: str) -> str:
+        return " ".join(script.split())
+
+    def get_ttl(self, script: str):
+        """TTL of a read-only script, None when it must not be cached."""
+        script = self.normalize(script)
+        if not script or UNSAFE_PATTERN.search(script):
+            return None
+        for target in REDIRECT_PATTERN.findall(script):
+            if target != "/dev/null" and not target.startswith("&"):
+                return None
+        ttl = None
+        for segment in SEGMENT_SPLIT.split(script):
+            words = segment.split()
+            if not words:
+                return None
+            command, args = words[0].rsplit("/", 1)[-1], words[1:]
+            if any(arg.startswith(WRITE_OPTIONS.get(command, ())) for arg in args):
+                return None
+            check = READ_ONLY_CHECKS.get(command)
+            if check is not None and not check(args):
+                return None
+            if command in FILTER_COMMANDS:
+                continue
+            if command not in self.ttl_rules:
+                return None
+            rule = self.ttl_rules[command]
+            ttl = rule if ttl is None else min(ttl, rule)
+        return ttl
+
+    def make_key(self, scope: str, function_name: str, kwargs: dict):
+        if not self.enabled or function_name not in CACHED_FUNCTIONS:
+            return None, None
+        script = kwargs.get("script")
+        if not isinstance(script, str):
+            return None, None
+        ttl = self.get_ttl(script)
+        if not ttl:
+            with self.lock:
+                self.stats["uncacheable"] += 1
+            return None, None
+        return (scope, function_name, self.normalize(script)), ttl
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, result = entry
+            if expires < now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return result
+
+    def put(self, key, result, ttl):
+        if not isinstance(result, str) or result.startswith(NOT_CACHED_PREFIXES):
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    async def aget_or_run(self, key, ttl, run):
+        """Return the cached result, join an identical call in flight, or run and cache."""
+        result = self.get(key)
+        if result is not None:
+            return result
+        loop = asyncio.get_running_loop()
+        future = self.inflight.get(key)
+        if future is not None and future.get_loop() is loop:
+            with self.lock:
+                self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the leader was cancelled (e.g. at its own deadline), run for ourselves
+                if future.cancelled():
+                    return await run()
+                raise
+        future = loop.create_future()
+        self.inflight[key] = future
+        with self.lock:
+            self.stats["misses"] += 1
+        try:
+            result = await run()
+            self.put(key, result, ttl)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            # waiters see the same failure, a cancelled leader lets them run on their own
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # the exception is re-raised here, mark it retrieved when nobody waits
+                future.exception()
+            raise
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    def get_or_run(self, key, ttl, run):
+        result = self.get(key)
+        if result is not None:
+            return result
+        with self.lock:
+            waiter = self.inflight_sync.get(key)
+            if waiter is None:
+                event = threading.Event()
+                self.inflight_sync[key] = event
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if waiter is not None:
+            waiter.wait()
+            result = self.get(key)
+            return result if result is not None else run()
+        try:
+            result = run()
+            self.put(key, result, ttl)
+            return result
+        finally:
+            with self.lock:
+                del self.inflight_sync[key]
+            event.set()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self.entries)
+            stats["inflight"] = len(self.inflight) + len(self.inflight_sync)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_command_cache(config: dict, log: logging.Logger) -> CommandCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CommandCache(config, log)
+        return _cache
@@ -2,13 +2,77 @@
 # get_prompt(): provide a prompt string to tell openai who are you and what you can do. for base class, just a common user enough.
 # get_tool_definition(): provide the function definitions of all methods of current class for openai to call.
 # execute(): it will get function name and arguments from input, then execute the target function by the function name.
+# aexecute(): async version of execute(), it prefers the coroutine registered in async method list, and falls back to method list.
+# run_script()/arun_script(): run a command line with a timeout, the async one uses asyncio subprocess so the event loop is never blocked.
+# command_cache: when set, results of read-only scripts are cached for a short TTL and identical concurrent calls are coalesced.
+# arun_pooled_script(): run a bash script on the shared pool of long-lived shells, when SHELL_POOL_ENABLED is set on Linux.
+# output of all of them is streamed into bounded captures, the model gets head and tail of long output plus stderr and exit code.
+# admission: when set, the async runners take a slot of the subprocess stage first, bounding the processes of all requests.
+import os
+import signal
+import asyncio
+import inspect
+import threading
+import subprocess
+from contextlib import nullcontext
+from ..deadline import clamp_timeout
+from ..admission import ADMISSION_SUBPROCESS, get_admission_controller
+from .shell_pool import get_shell_pool
+from .command_cache import get_command_cache
+from .output_capture import (OutputCapture, format_output, DEFAULT_MAX_OUTPUT_BYTES, DEFAULT_MAX_OUTPUT_LINES,
+                             DEFAULT_MAX_STDERR_BYTES, SCRIPT_TIMEOUT_MESSAGE, SHELL_FAILED_MESSAGE)
+
+DEFAULT_SCRIPT_TIMEOUT = 60
+READ_CHUNK = 64 * 1024
+# seconds a killed command gets to close its pipes
+KILL_DRAIN_TIMEOUT = 5
 
 class Executor:
     def __init__(self):
         self.methods = {
         }
+        self.async_methods = {
+        }
         self.prompt = ""
         self.context = ""
+        self.shell_pool = None
+        self.command_cache = None
+        self.admission = None
+        self.max_output_bytes = DEFAULT_MAX_OUTPUT_BYTES
+        self.max_output_lines = DEFAULT_MAX_OUTPUT_LINES
+        self.max_stderr_bytes = DEFAULT_MAX_STDERR_BYTES
+
+    def setup_output_limits(self, prefix: str):
+        # e.g. PC_OUTPUT_MAX_BYTES overrides OUTPUT_MAX_BYTES for the PC executor
+        config = getattr(self, "config", None) or {}
+        self.max_output_bytes = config.get(f"{prefix}_OUTPUT_MAX_BYTES", config.get("OUTPUT_MAX_BYTES", DEFAULT_MAX_OUTPUT_BYTES))
+        self.max_output_lines = config.get(f"{prefix}_OUTPUT_MAX_LINES", config.get("OUTPUT_MAX_LINES", DEFAULT_MAX_OUTPUT_LINES))
+        self.max_stderr_bytes = config.get(f"{prefix}_OUTPUT_MAX_STDERR_BYTES", config.get("OUTPUT_MAX_STDERR_BYTES", DEFAULT_MAX_STDERR_BYTES))
+
+    def get_output_limits_description(self) -> str:
+        return (f"Output longer than {self.max_output_lines} lines or {self.max_output_bytes} bytes is truncated to its head and tail, "
+                f"so filter it in the script (grep, head, tail, a time range) when only part of it is needed.")
+
+    def new_captures(self):
+        return (OutputCapture(self.max_output_bytes, self.max_output_lines),
+                OutputCapture(self.max_stderr_bytes, self.max_output_lines))
+
+    def setup_command_cache(self):
+        config = getattr(self, "config", None) or {}
+        if config.get("COMMAND_CACHE_ENABLED", True):
+            self.command_cache = get_command_cache(config, self.log)
+
+    def setup_admission(self):
+        config = getattr(self, "config", None) or {}
+        self.admission = get_admission_controller(config, self.log)
+
+    def subprocess_slot(self):
+        return self.admission.slot(ADMISSION_SUBPROCESS) if self.admission else nullcontext()
+
+    def setup_shell_pool(self):
+        config = getattr(self, "config", None) or {}
+        if config.get("SHELL_POOL_ENABLED", False) and os.name != 'nt':
+            self.shell_pool = get_shell_pool(config, self.log)
 
     def get_prompt(self, file_path):
         try:
@@ -28,19 +92,155 @@ class Executor:
         raise NotImplementedError("Subclasses should implement this method.")
 
     def execute(self, function_name, *args, **kwargs):
+        if self.command_cache and not args:
+            key, ttl = self.command_cache.make_key(type(self).__name__, function_name, kwargs)
+            if key is not None:
+                return self.command_cache.get_or_run(key, ttl, lambda: self._execute(function_name, **kwargs))
+        return self._execute(function_name, *args, **kwargs)
+
+    def _execute(self, function_name, *args, **kwargs):
         if function_name in self.methods:
             return self.methods[function_name](*args, **kwargs)
         else:
             raise ValueError(f"Function '{function_name}' not found in methods.")
         
     async def aexecute(self, function_name, *args, **kwargs):
-        if function_name in self.methods:
-            return await self.methods[function_name](*args, **kwargs)
+        if self.command_cache and not args:
+            key, ttl = self.command_cache.make_key(type(self).__name__, function_name, kwargs)
+            if key is not None:
+                return await self.command_cache.aget_or_run(key, ttl, lambda: self._aexecute(function_name, **kwargs))
+        return await self._aexecute(function_name, *args, **kwargs)
+
+    async def _aexecute(self, function_name, *args, **kwargs):
+        if function_name in self.async_methods:
+            return await self.async_methods[function_name](*args, **kwargs)
+        elif function_name in self.methods:
+            result = self.methods[function_name](*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
         else:
             raise ValueError(f"Function '{function_name}' not found in methods.")
         
     def get_function(self, function_name):
-        return self.methods.get(function_name, None)
+        function = self.methods.get(function_name, None)
+        if function is None:
+            function = self.async_methods.get(function_name, None)
+        return function
     
     def is_async(self):
-        return False
\ No newline at end of file
+        return False
+
+    def get_script_timeout(self):
+        config = getattr(self, "config", None) or {}
+        return config.get("SCRIPT_TIMEOUT", DEFAULT_SCRIPT_TIMEOUT)
+
+    def run_script(self, command: list, timeout=None) -> str:
+        timeout = timeout or self.get_script_timeout()
+        stdout, stderr = self.new_captures()
+        kwargs = {} if os.name == 'nt' else {"start_new_session": True}
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        # drain both pipes while the command runs, so it never blocks on a full pipe
+        readers = [threading.Thread(target=self._pump, args=(process.stdout, stdout), daemon=True),
+                   threading.Thread(target=self._pump, args=(process.stderr, stderr), daemon=True)]
+        for reader in readers:
+            reader.start()
+        try:
+            process.wait(timeout=timeout)
+            timed_out = False
+        except subprocess.TimeoutExpired:
+            self._kill_process_sync(process)
+            timed_out = True
+        for reader in readers:
+            reader.join()
+        return self.format_result(stdout, stderr, process.returncode, timed_out, timeout)
+
+    async def arun_script(self, command: list, timeout=None) -> str:
+        async with self.subprocess_slot():
+            return await self._arun_script(command, timeout)
+
+    async def _arun_script(self, command: list, timeout=None) -> str:
+        # never run past the request deadline, the time queued for a slot included
+        timeout = clamp_timeout(timeout or self.get_script_timeout())
+        stdout, stderr = self.new_captures()
+        # run in a new session on Linux, so the whole process group can be killed on timeout or cancel
+        kwargs = {} if os.name == 'nt' else {"start_new_session": True}
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **kwargs
+        )
+        # the pumps are tasks of their own, they keep draining the pipes after a timeout or cancel kills the command
+        pumps = [asyncio.ensure_future(self._apump(process.stdout, stdout)),
+                 asyncio.ensure_future(self._apump(process.stderr, stderr))]
+        try:
+            _, pending = await asyncio.wait([*pumps, asyncio.ensure_future(process.wait())], timeout=timeout)
+        except asyncio.CancelledError:
+            await self._kill_process(process, pumps)
+            raise
+        if pending:
+            await self._kill_process(process, pumps)
+            return self.format_result(stdout, stderr, process.returncode, True, timeout)
+        return self.format_result(stdout, stderr, process.returncode, False, timeout)
+
+    async def arun_pooled_script(self, script: str, timeout=None) -> str:
+        async with self.subprocess_slot():
+            timeout = clamp_timeout(timeout or self.get_script_timeout())
+            stdout_capture, stderr_capture = self.new_captures()
+            stdout, stderr, returncode = await self.shell_pool.run(script, timeout, stdout_capture, stderr_capture)
+        if returncode == -1 and stderr.startswith((SCRIPT_TIMEOUT_MESSAGE, SHELL_FAILED_MESSAGE)):
+            return f"{stderr}\n{stdout}" if stdout else stderr
+        return format_output(stdout, stderr, returncode)
+
+    def format_result(self, stdout: OutputCapture, stderr: OutputCapture, returncode, timed_out: bool, timeout) -> str:
+        if timed_out:
+            # the timeout message stays first, so the command cache never keeps a partial result
+            message = f"{SCRIPT_TIMEOUT_MESSAGE} after {timeout} seconds."
+            output = format_output(stdout.get_text(), stderr.get_text())
+            return f"{message}\n{output}" if output.strip() else message
+        return format_output(stdout.get_text(), stderr.get_text(), returncode)
+
+    @staticmethod
+    def _pump(pipe, capture: OutputCapture):
+        with pipe:
+            for chunk in iter(lambda: pipe.read1(READ_CHUNK), b""):
+                capture.feed(chunk)
+
+    @staticmethod
+    async def _apump(reader: asyncio.StreamReader, capture: OutputCapture):
+        while True:
+            chunk = await reader.read(READ_CHUNK)
+            if not chunk:
+                return
+            capture.feed(chunk)
+
+    def _kill_process_sync(self, process):
+        try:
+            if os.name == 'nt':
+                process.kill()
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+    async def _kill_process(self, process, pumps=()):
+        if process.returncode is None:
+            try:
+                if os.name == 'nt':
+                    process.kill()
+                else:
+                    os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        # wait() only returns once the pipes are closed, output left in them is read to EOF first,
+        # through the bounded captures
+        if pumps:
+            _, pending = await asyncio.wait(pumps, timeout=KILL_DRAIN_TIMEOUT)
+            if pending:
+                # a process that left the group still holds the pipes, its output is dropped and the pipes closed
+                for pump in pending:
+                    pump.cancel()
+                process._transport.close()
+        await process.wait()
@@ -0,0 +1,399 @@
+# Snapshot cache of Kubernetes objects for the K8s executor.
+# One bulk "kubectl get <kind> --all-namespaces -o json" per kind and refresh interval fills an in-memory store
+# indexed by namespace, label and owner; structured queries are answered from it without another kubectl call.
+# Concurrent refreshes of a kind are coalesced, so a multi-task plan costs one process spawn per kind.
+# kubectl is looked up on PATH (or K8S_KUBECTL), so a fake kubectl script can stand in for a cluster in tests.
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import defaultdict
+from ..deadline import clamp_timeout
+from ..admission import ADMISSION_SUBPROCESS, get_admission_controller
+
+DEFAULT_SNAPSHOT_TTL = 30
+DEFAULT_SNAPSHOT_TIMEOUT = 60
+DEFAULT_QUERY_LIMIT = 50
+KIND_PATTERN = re.compile(r"^[a-z0-9][a-z0-9.-]*$")
+# short names the model tends to use
+KIND_ALIASES = {"po": "pods", "pod": "pods", "no": "nodes", "node": "nodes", "deploy": "deployments",
+                "deployment": "deployments", "rs": "replicasets", "replicaset": "replicasets",
+                "sts": "statefulsets", "statefulset": "statefulsets", "ds": "daemonsets", "daemonset": "daemonsets",
+                "svc": "services", "service": "services", "ns": "namespaces", "namespace": "namespaces",
+                "job": "jobs", "cj": "cronjobs", "cronjob": "cronjobs", "ev": "events", "event": "events",
+                "pvc": "persistentvolumeclaims", "pv": "persistentvolumes", "cm": "configmaps", "ing": "ingresses",
+                "rc": "replicationcontrollers", "replicationcontroller": "replicationcontrollers"}
+# owners that manage pods through an intermediate kind
+OWNER_CHAINS = {"Deployment": "replicasets", "CronJob": "jobs"}
+# the kind of ownerReferences for the resource names of the owning kinds
+OWNER_KINDS = {"deployments": "Deployment", "replicasets": "ReplicaSet", "statefulsets": "StatefulSet",
+               "daemonsets": "DaemonSet", "jobs": "Job", "cronjobs": "CronJob", "nodes": "Node",
+               "replicationcontrollers": "ReplicationController"}
+
+def normalize_kind(kind: str) -> str:
+    kind = kind.strip().lower()
+    kind = KIND_ALIASES.get(kind, kind)
+    if not KIND_PATTERN.match(kind):
+        raise ValueError(f"Invalid resource kind '{kind}'")
+    return kind
+
+def parse_selector(selector: str) -> list:
+    """Equality label selector "app=web,tier!=db,env" to [(key, op, value)]."""
+    terms = []
+    for term in filter(None, (part.strip() for part in (selector or "").split(","))):
+        if "!=" in term:
+            key, value = term.split("!=", 1)
+            terms.append((key.strip(), "!=", value.strip()))
+        elif "=" in term:
+            key, value = term.split("=", 1)
+            terms.append((key.strip(), "=", value.strip().lstrip("=")))
+        else:
+            terms.append((term.lstrip("!"), "!" if term.startswith("!") else "exists", None))
+    return terms
+
+
+class KindSnapshot:
+    """Parsed objects of one kind and their indexes."""
+    def __init__(self, kind: str, items: list):
+        self.kind = kind
+        self.items = items
+        self.fetched_at = time.monotonic()
+        self.by_namespace = defaultdict(list)
+        self.by_label = defaultdict(set)
+        self.by_owner = defaultdict(set)
+        self.by_name = defaultdict(list)
+        self.namespaces = []
+        for index, item in enumerate(items):
+            metadata = item.get("metadata", {})
+            self.namespaces.append(metadata.get("namespace", ""))
+            self.by_namespace[metadata.get("namespace", "")].append(index)
+            self.by_name[metadata.get("name", "")].append(index)
+            for key, value in (metadata.get("labels") or {}).items():
+                self.by_label[(key, value)].add(index)
+                self.by_label[(key, None)].add(index)
+            for owner in metadata.get("ownerReferences") or []:
+                self.by_owner[(owner.get("kind"), owner.get("name"))].add(index)
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+    def owned_by(self, owner) -> set:
+        """Objects owned by (namespace, kind, name); owner references never cross namespaces, "" matches any."""
+        namespace, kind, name = owner
+        indexes = self.by_owner.get((kind, name), set())
+        if not namespace:
+            return indexes
+        return {index for index in indexes if self.namespaces[index] == namespace}
+
+    def select(self, namespace: str = "", selector: str = "", owners: list = None, name: str = "") -> list:
+        """Indexes of the matching objects, narrowed index by index."""
+        candidates = None
+        def narrow(indexes):
+            nonlocal candidates
+            candidates = set(indexes) if candidates is None else candidates & set(indexes)
+        if namespace:
+            narrow(self.by_namespace.get(namespace, []))
+        if name:
+            narrow(self.by_name.get(name, []))
+        if owners is not None:
+            narrow(set().union(*(self.owned_by(owner) for owner in owners)) if owners else set())
+        for key, op, value in parse_selector(selector):
+            if op == "=":
+                narrow(self.by_label.get((key, value), set()))
+            elif op == "exists":
+                narrow(self.by_label.get((key, None), set()))
+        if candidates is None:
+            candidates = set(range(len(self.items)))
+        # negative terms cannot use the index
+        for key, op, value in parse_selector(selector):
+            if op == "!=":
+                candidates = {i for i in candidates if (self.items[i]["metadata"].get("labels") or {}).get(key) != value}
+            elif op == "!":
+                candidates = {i for i in candidates if key not in (self.items[i]["metadata"].get("labels") or {})}
+        return sorted(candidates)
+
+
+def summarize(kind: str, item: dict) -> dict:
+    """The fields worth sending to the model for an object, instead of its full json."""
+    metadata = item.get("metadata", {})
+    spec = item.get("spec", {}) or {}
+    status = item.get("status", {}) or {}
+    row = {"name": metadata.get("name")}
+    if metadata.get("namespace"):
+        row["namespace"] = metadata["namespace"]
+    if kind == "pods":
+        statuses = status.get("containerStatuses") or []
+        row.update({
+            "phase": status.get("phase"),
+            "ready": f"{sum(1 for s in statuses if s.get('ready'))}/{len(spec.get('containers') or statuses)}",
+            "restarts": sum(s.get("restartCount", 0) for s in statuses),
+            "node": spec.get("nodeName"),
+        })
+        # the reason a container is not running, e.g. CrashLoopBackOff or ImagePullBackOff
+        reasons = [s["state"]["waiting"].get("reason") for s in statuses if (s.get("state") or {}).get("waiting")]
+        reasons += [s["state"]["terminated"].get("reason") for s in statuses if (s.get("state") or {}).get("terminated")]
+        if reasons:
+            row["reasons"] = sorted(set(filter(None, reasons)))
+    elif kind == "nodes":
+        conditions = {c.get("type"): c.get("status") for c in status.get("conditions") or []}
+        labels = metadata.get("labels") or {}
+        row.update({
+            "ready": conditions.get("Ready"),
+            "pressure": [name for name, value in conditions.items() if name != "Ready" and value == "True"],
+            "roles": [key.split("/", 1)[1] for key in labels if key.startswith("node-role.kubernetes.io/")],
+            "unschedulable": bool(spec.get("unschedulable")),
+            "version": (status.get("nodeInfo") or {}).get("kubeletVersion"),
+            "allocatable": {key: value for key, value in (status.get("allocatable") or {}).items() if key in ("cpu", "memory", "pods")},
+        })
+    elif kind in ("deployments", "statefulsets", "replicasets"):
+        row.update({"replicas": spec.get("replicas"), "ready": status.get("readyReplicas", 0),
+                    "available": status.get("availableReplicas", 0)})
+    elif kind == "daemonsets":
+        row.update({"desired": status.get("desiredNumberScheduled"), "ready": status.get("numberReady"),
+                    "unavailable": status.get("numberUnavailable", 0)})
+    elif kind == "services":
+        row.update({"type": spec.get("type"), "cluster_ip": spec.get("clusterIP"),
+                    "ports": [f"{p.get('port')}/{p.get('protocol', 'TCP')}" for p in spec.get("ports") or []]})
+    elif kind == "jobs":
+        row.update({"succeeded": status.get("succeeded", 0), "failed": status.get("failed", 0),
+                    "active": status.get("active", 0)})
+    elif kind == "events":
+        row.update({"type": item.get("type"), "reason": item.get("reason"), "count": item.get("count"),
+                    "object": f"{(item.get('involvedObject') or {}).get('kind')}/{(item.get('involvedObject') or {}).get('name')}",
+                    "message": (item.get("message") or "")[:200], "last": item.get("lastTimestamp")})
+    elif "phase" in status:
+        row["phase"] = status["phase"]
+    if kind != "events":
+        row["created"] = metadata.get("creationTimestamp")
+    return row
+
+def get_status(kind: str, row: dict):
+    """One status word of a summarized object, for counting."""
+    if row.get("phase") or row.get("type"):
+        return row.get("phase") or row.get("type")
+    if kind == "nodes":
+        return "Ready" if row.get("ready") == "True" else "NotReady"
+    if "replicas" in row:
+        return "Ready" if (row.get("ready") or 0) >= (row.get("replicas") or 0) else "NotReady"
+    if "desired" in row:
+        return "Ready" if (row.get("ready") or 0) >= (row.get("desired") or 0) else "NotReady"
+    if "active" in row:
+        return "Failed" if row["failed"] else "Active" if row["active"] else "Complete" if row["succeeded"] else "Pending"
+    return None
+
+
+class K8sSnapshot:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.kubectl = config.get("K8S_KUBECTL", "kubectl")
+        self.ttl = config.get("K8S_SNAPSHOT_TTL", DEFAULT_SNAPSHOT_TTL)
+        self.timeout = config.get("K8S_SNAPSHOT_TIMEOUT", DEFAULT_SNAPSHOT_TIMEOUT)
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        # single-flight refreshes, futures are bound to the loop they were created in
+        self.inflight = {}
+        self.stats = {"fetches": 0, "hits": 0, "coalesced": 0, "errors": 0}
+        self.admission = get_admission_controller(config, log)
+
+    def get_command(self, kind: str) -> list:
+        return [self.kubectl, "get", kind, "--all-namespaces", "-o", "json"]
+
+    def parse(self, kind: str, output: bytes) -> KindSnapshot:
+        return KindSnapshot(kind, json.loads(output).get("items", []))
+
+    def get_fresh(self, kind: str):
+        with self.lock:
+            snapshot = self.snapshots.get(kind)
+            if snapshot is not None and snapshot.age() < self.ttl:
+                self.stats["hits"] += 1
+                return snapshot
+        return None
+
+    def store(self, snapshot: KindSnapshot):
+        with self.lock:
+            self.snapshots[snapshot.kind] = snapshot
+            self.stats["fetches"] += 1
+        self.log.info(f"K8s snapshot of {snapshot.kind} refreshed, {len(snapshot.items)} objects")
+
+    def fail(self, kind: str, stderr: bytes):
+        with self.lock:
+            self.stats["errors"] += 1
+        raise RuntimeError(f"kubectl get {kind} failed: {stderr.decode(errors='replace').strip()[:500]}")
+
+    async def aget(self, kind: str) -> KindSnapshot:
+        """The snapshot of a kind, refreshed when older than the TTL, identical refreshes coalesced."""
+        kind = normalize_kind(kind)
+        snapshot = self.get_fresh(kind)
+        if snapshot is not None:
+            return snapshot
+        loop = asyncio.get_running_loop()
+        future = self.inflight.get(kind)
+        if future is not None and future.get_loop() is loop:
+            with self.lock:
+                self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the leader was cancelled (e.g. at its own deadline), refresh as the next leader
+                if future.cancelled():
+                    return await self.aget(kind)
+                raise
+        future = loop.create_future()
+        self.inflight[kind] = future
+        try:
+            snapshot = await self.afetch(kind)
+            future.set_result(snapshot)
+            return snapshot
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            if self.inflight.get(kind) is future:
+                del self.inflight[kind]
+
+    async def afetch(self, kind: str) -> KindSnapshot:
+        # kubectl counts against the subprocess stage like any script
+        async with self.admission.slot(ADMISSION_SUBPROCESS):
+            timeout = clamp_timeout(self.timeout)
+            process = await asyncio.create_subprocess_exec(
+                *self.get_command(kind),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+        if process.returncode != 0:
+            self.fail(kind, stderr)
+        snapshot = self.parse(kind, stdout)
+        self.store(snapshot)
+        return snapshot
+
+    def get(self, kind: str) -> KindSnapshot:
+        kind = normalize_kind(kind)
+        snapshot = self.get_fresh(kind)
+        if snapshot is not None:
+            return snapshot
+        result = subprocess.run(self.get_command(kind), capture_output=True, timeout=self.timeout)
+        if result.returncode != 0:
+            self.fail(kind, result.stderr)
+        snapshot = self.parse(kind, result.stdout)
+        self.store(snapshot)
+        return snapshot
+
+    def invalidate(self, kind: str = ""):
+        with self.lock:
+            if kind:
+                self.snapshots.pop(normalize_kind(kind), None)
+            else:
+                self.snapshots.clear()
+
+    def parse_owner(self, owner: str):
+        """"Deployment/web", "deploy/web" or "statefulset/db" to the ownerReference kind and name."""
+        if not owner:
+            return None
+        owner_kind, _, owner_name = owner.partition("/")
+        if not owner_kind.strip() or not owner_name:
+            raise ValueError(f"Invalid owner '{owner}', use Kind/name, e.g. Deployment/web")
+        # kinds of custom controllers are used as given
+        return OWNER_KINDS.get(normalize_kind(owner_kind), owner_kind.strip()), owner_name.strip()
+
+    def get_intermediate_kind(self, kind: str, owner) -> str:
+        """Kind to resolve first when pods are asked by their Deployment or CronJob."""
+        if owner is None or kind != "pods":
+            return ""
+        return OWNER_CHAINS.get(owner[0], "")
+
+    def resolve_owners(self, owner, namespace: str = "", intermediate: KindSnapshot = None):
+        """(namespace, kind, name) of the owner and of the objects it manages pods through."""
+        if owner is None:
+            return None
+        owners = [(namespace, *owner)]
+        if intermediate is not None:
+            owned_kind = OWNER_KINDS[intermediate.kind]
+            for index in intermediate.select(namespace, owners=owners[:1]):
+                owners.append((intermediate.namespaces[index], owned_kind, intermediate.items[index]["metadata"]["name"]))
+        return owners
+
+    def build_result(self, snapshot: KindSnapshot, namespace, label_selector, owners, name, limit) -> dict:
+        indexes = snapshot.select(namespace, label_selector, owners, name)
+        limit = max(int(limit), 1)
+        return {
+            "kind": snapshot.kind,
+            "count": len(indexes),
+            "age_seconds": round(snapshot.age(), 1),
+            "truncated": len(indexes) > limit,
+            "items": [summarize(snapshot.kind, snapshot.items[index]) for index in indexes[:limit]],
+        }
+
+    async def aquery(self, kind: str, namespace: str = "", label_selector: str = "", owner: str = "",
+                     name: str = "", limit: int = DEFAULT_QUERY_LIMIT) -> dict:
+        kind = normalize_kind(kind)
+        owner = self.parse_owner(owner)
+        intermediate_kind = self.get_intermediate_kind(kind, owner)
+        if intermediate_kind:
+            snapshot, intermediate = await asyncio.gather(self.aget(kind), self.aget(intermediate_kind))
+        else:
+            snapshot, intermediate = await self.aget(kind), None
+        return self.build_result(snapshot, namespace, label_selector, self.resolve_owners(owner, namespace, intermediate), name, limit)
+
+    def query(self, kind: str, namespace: str = "", label_selector: str = "", owner: str = "",
+              name: str = "", limit: int = DEFAULT_QUERY_LIMIT) -> dict:
+        kind = normalize_kind(kind)
+        owner = self.parse_owner(owner)
+        intermediate_kind = self.get_intermediate_kind(kind, owner)
+        intermediate = self.get(intermediate_kind) if intermediate_kind else None
+        return self.build_result(self.get(kind), namespace, label_selector, self.resolve_owners(owner, namespace, intermediate), name, limit)
+
+    def count_by(self, snapshot: KindSnapshot, namespace: str = "") -> dict:
+        """Object counts per namespace and per status, the overview of a kind."""
+        indexes = snapshot.select(namespace)
+        by_namespace = defaultdict(int)
+        by_status = defaultdict(int)
+        for index in indexes:
+            item = snapshot.items[index]
+            by_namespace[item.get("metadata", {}).get("namespace", "")] += 1
+            status = get_status(snapshot.kind, summarize(snapshot.kind, item))
+            if status is not None:
+                by_status[str(status)] += 1
+        result = {"kind": snapshot.kind, "count": len(indexes), "age_seconds": round(snapshot.age(), 1)}
+        if any(by_namespace):
+            result["by_namespace"] = dict(sorted(by_namespace.items(), key=lambda entry: -entry[1]))
+        if by_status:
+            result["by_status"] = dict(by_status)
+        return result
+
+    async def asummary(self, kind: str, namespace: str = "") -> dict:
+        return self.count_by(await self.aget(kind), namespace)
+
+    def summary(self, kind: str, namespace: str = "") -> dict:
+        return self.count_by(self.get(kind), namespace)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["kinds"] = {kind: len(snapshot.items) for kind, snapshot in self.snapshots.items()}
+        return stats
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def get_k8s_snapshot(config: dict, log: logging.Logger) -> K8sSnapshot:
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = K8sSnapshot(config, log)
+        return _snapshot
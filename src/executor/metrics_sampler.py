@@ -0,0 +1,234 @@
+# Background sampler of CPU, memory and disk usage, kept in a fixed-size numpy ring buffer.
+# Trend questions ("memory over the last 30 minutes") are answered from the buffer by windowed aggregates
+# instead of shelling out; the history can be spilled to a CSV in the memory_usage.csv format, or to Parquet.
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from . import proc_metrics
+
+DEFAULT_SAMPLE_INTERVAL = 5
+DEFAULT_HISTORY_SIZE = 8640  # 12 hours at 5 seconds
+DEFAULT_SPILL_EVERY = 12
+DEFAULT_SPIKE_THRESHOLD = 3.0
+MAX_SPIKES = 20
+METRICS = ("cpu", "memory", "disk")
+# column 0 is the epoch time, then one column per metric
+COLUMNS = ("time",) + METRICS
+# memory first, so the first two columns read like memory_usage.csv
+CSV_ORDER = ("memory", "cpu", "disk")
+CSV_HEADERS = {"memory": "Memory Usage (%)", "cpu": "CPU Usage (%)", "disk": "Disk Usage (%)"}
+CSV_TIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
+def format_timestamp(epoch: float) -> str:
+    """Timestamp as in memory_usage.csv, e.g. 5/20/2025 5:27:22 PM."""
+    moment = datetime.fromtimestamp(epoch)
+    return f"{moment.month}/{moment.day}/{moment.year} {moment.hour % 12 or 12}:{moment:%M:%S %p}"
+
+def parse_timestamps(values) -> np.ndarray:
+    """Epoch seconds of local timestamps as in memory_usage.csv, parsed in one pass."""
+    import pandas as pd
+    stamps = pd.to_datetime(pd.Series(values, dtype=str).str.strip(), format=CSV_TIME_FORMAT)
+    naive = stamps.to_numpy(dtype="datetime64[s]").astype(np.int64)
+    # the times are local like datetime.timestamp() reads them, the UTC offset is looked up once per hour
+    hours, inverse = np.unique(naive // 3600, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(hour * 3600, timezone.utc).replace(tzinfo=None).timestamp() - hour * 3600
+                        for hour in hours.tolist()], dtype=np.float64)
+    return naive.astype(np.float64) + offsets[inverse]
+
+def read_metrics_csv(path: str) -> dict:
+    """Read a memory_usage.csv style file into {"time": array, metric: array} for the metrics found in it."""
+    import pandas as pd
+    frame = pd.read_csv(path)
+    data = {"time": parse_timestamps(frame["Timestamp"])}
+    for metric, header in CSV_HEADERS.items():
+        if header in frame.columns:
+            data[metric] = frame[header].to_numpy(dtype=np.float64)
+    return data
+
+
+class MetricsSampler:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.interval = config.get("METRICS_SAMPLE_INTERVAL", DEFAULT_SAMPLE_INTERVAL)
+        self.capacity = max(config.get("METRICS_HISTORY_SIZE", DEFAULT_HISTORY_SIZE), 2)
+        self.disk_path = config.get("METRICS_DISK_PATH", "/")
+        self.spill_file = config.get("METRICS_SPILL_FILE", "")
+        self.spill_every = max(config.get("METRICS_SPILL_EVERY", DEFAULT_SPILL_EVERY), 1)
+        self.buffer = np.full((self.capacity, len(COLUMNS)), np.nan, dtype=np.float64)
+        self.index = 0
+        self.count = 0
+        self.recorded = 0
+        self.spilled = 0
+        self.last_cpu = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="metrics-sampler", daemon=True)
+        self.thread.start()
+        self.log.info(f"Metrics sampler started, every {self.interval}s, {self.capacity} samples")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.spill()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                self.log.warning(f"Metrics sampling failed: {e}")
+            self.stop_event.wait(self.interval)
+
+    def sample(self):
+        cpu_times = proc_metrics.read_cpu_times()
+        cpu = np.nan
+        if self.last_cpu is not None:
+            deltas = [b - a for a, b in zip(self.last_cpu, cpu_times)]
+            total = sum(deltas)
+            # idle and iowait are not busy time
+            cpu = (total - deltas[3] - deltas[4]) * 100 / total if total else np.nan
+        self.last_cpu = cpu_times
+        memory = proc_metrics.memory_info()["used_percent"]
+        stat = os.statvfs(self.disk_path)
+        used = stat.f_blocks - stat.f_bfree
+        disk = used * 100 / (used + stat.f_bavail) if used + stat.f_bavail else np.nan
+        self.record(time.time(), cpu, memory, disk)
+
+    def record(self, timestamp: float, cpu: float, memory: float, disk: float):
+        with self.lock:
+            self.buffer[self.index] = (timestamp, cpu, memory, disk)
+            self.index = (self.index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self.recorded += 1
+            due = self.spill_file and self.recorded - self.spilled >= self.spill_every
+        if due:
+            self.spill()
+
+    def get_history(self) -> np.ndarray:
+        """Samples in time order, a copy that is safe to use without the lock."""
+        with self.lock:
+            if self.count < self.capacity:
+                return self.buffer[:self.count].copy()
+            return np.concatenate((self.buffer[self.index:], self.buffer[:self.index]))
+
+    def get_window(self, metric: str, minutes: float):
+        """(times, values) of a metric over the last N minutes, missing samples dropped."""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', use one of {', '.join(METRICS)}")
+        history = self.get_history()
+        if not len(history):
+            return history[:, 0], history[:, 0]
+        history = history[history[:, 0] >= history[-1, 0] - minutes * 60]
+        values = history[:, COLUMNS.index(metric)]
+        valid = ~np.isnan(values)
+        return history[valid, 0], values[valid]
+
+    def aggregate(self, metric: str, minutes: float) -> dict:
+        times, values = self.get_window(metric, minutes)
+        result = {"metric": metric, "unit": "%", "minutes": minutes, "samples": int(len(values))}
+        if not len(values):
+            return result
+        result.update({
+            "from": format_timestamp(times[0]),
+            "to": format_timestamp(times[-1]),
+            "min": round(float(values.min()), 2),
+            "max": round(float(values.max()), 2),
+            "mean": round(float(values.mean()), 2),
+            "p95": round(float(np.percentile(values, 95)), 2),
+            "last": round(float(values[-1]), 2),
+            "slope_per_minute": round(self.slope(times, values), 4),
+        })
+        return result
+
+    def slope(self, times: np.ndarray, values: np.ndarray) -> float:
+        """Least-squares trend in percentage points per minute."""
+        if len(values) < 2 or times[-1] == times[0]:
+            return 0.0
+        minutes = (times - times[0]) / 60
+        return float(np.polyfit(minutes, values, 1)[0])
+
+    def spikes(self, metric: str, minutes: float, threshold: float = DEFAULT_SPIKE_THRESHOLD) -> dict:
+        """Samples more than threshold standard deviations above the window mean."""
+        times, values = self.get_window(metric, minutes)
+        result = {"metric": metric, "minutes": minutes, "samples": int(len(values)), "threshold": threshold, "spikes": []}
+        if len(values) < 3:
+            return result
+        mean, std = float(values.mean()), float(values.std())
+        result["mean"] = round(mean, 2)
+        result["std"] = round(std, 3)
+        if std == 0:
+            return result
+        scores = (values - mean) / std
+        flagged = np.flatnonzero(scores > threshold)
+        result["count"] = int(len(flagged))
+        # only the strongest spikes are listed, in time order
+        flagged = np.sort(flagged[np.argsort(scores[flagged])[::-1][:MAX_SPIKES]])
+        result["spikes"] = [{"time": format_timestamp(times[i]), "value": round(float(values[i]), 2)} for i in flagged]
+        return result
+
+    def spill(self):
+        """Write samples not yet spilled, appended to a CSV or rewritten as Parquet."""
+        if not self.spill_file:
+            return
+        history = self.get_history()
+        try:
+            if self.spill_file.endswith(".parquet"):
+                # parquet cannot be appended, the whole ring buffer is rewritten
+                self.to_frame(history).to_parquet(self.spill_file, index=False)
+                with self.lock:
+                    self.spilled = self.recorded
+                return
+            with self.lock:
+                # samples overwritten before a spill are lost
+                pending = min(self.recorded - self.spilled, len(history))
+                self.spilled = self.recorded
+            if not pending:
+                return
+            rows = history[-pending:]
+            write_header = not os.path.exists(self.spill_file) or os.path.getsize(self.spill_file) == 0
+            with open(self.spill_file, "a", encoding="utf-8") as f:
+                if write_header:
+                    f.write('"Timestamp",' + ",".join(f'"{CSV_HEADERS[metric]}"' for metric in CSV_ORDER) + "\n")
+                for row in rows:
+                    values = [row[COLUMNS.index(metric)] for metric in CSV_ORDER]
+                    f.write(f'"{format_timestamp(row[0])}",' +
+                            ",".join('""' if np.isnan(value) else f'"{round(float(value), 2)}"' for value in values) + "\n")
+        except Exception as e:
+            self.log.warning(f"Metrics spill to {self.spill_file} failed: {e}")
+
+    def to_frame(self, history: np.ndarray):
+        import pandas as pd
+        data = {"Timestamp": [format_timestamp(value) for value in history[:, 0]]}
+        for metric in CSV_ORDER:
+            data[CSV_HEADERS[metric]] = np.round(history[:, COLUMNS.index(metric)], 2)
+        return pd.DataFrame(data)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {"samples": self.count, "capacity": self.capacity, "interval": self.interval,
+                    "running": self.thread is not None and self.thread.is_alive()}
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+def get_metrics_sampler(config: dict, log: logging.Logger) -> MetricsSampler:
+    """The process-wide sampler, started on first use."""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = MetricsSampler(config, log)
+            _sampler.start()
+        return _sampler
@@ -0,0 +1,94 @@
+# Bounded capture of command output.
+# Output is fed chunk by chunk while the command runs, only the head and a rolling tail are kept in memory,
+# so a runaway journalctl or kubectl logs costs at most max_bytes whatever it prints.
+# When the byte or line limit is hit the text keeps head and tail and says what was dropped,
+# so the model can refine its query.
+from collections import deque
+
+DEFAULT_MAX_OUTPUT_BYTES = 32 * 1024
+DEFAULT_MAX_OUTPUT_LINES = 400
+DEFAULT_MAX_STDERR_BYTES = 4 * 1024
+SCRIPT_TIMEOUT_MESSAGE = "Script timed out"
+SHELL_FAILED_MESSAGE = "Shell session failed"
+
+class OutputCapture:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_OUTPUT_BYTES, max_lines: int = DEFAULT_MAX_OUTPUT_LINES):
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.head_limit = max_bytes // 2
+        self.tail_limit = max_bytes - self.head_limit
+        self.head = bytearray()
+        self.tail = deque()
+        self.tail_size = 0
+        self.total_bytes = 0
+        self.total_lines = 0
+        self.last_byte = b"\n"
+
+    def feed(self, data: bytes):
+        if not data:
+            return
+        self.total_bytes += len(data)
+        self.total_lines += data.count(b"\n")
+        self.last_byte = data[-1:]
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if not data:
+            return
+        self.tail.append(data)
+        self.tail_size += len(data)
+        # drop whole chunks from the left while the rest still covers the tail limit
+        while self.tail and self.tail_size - len(self.tail[0]) >= self.tail_limit:
+            self.tail_size -= len(self.tail.popleft())
+
+    def get_line_count(self) -> int:
+        # a last line without newline still counts
+        return self.total_lines + (0 if self.last_byte == b"\n" else 1)
+
+    def is_truncated(self) -> bool:
+        return self.total_bytes > self.max_bytes or self.get_line_count() > self.max_lines
+
+    def get_text(self) -> str:
+        head = bytes(self.head)
+        tail = b"".join(self.tail)
+        if not self.is_truncated():
+            return (head + tail).decode("utf-8", errors="replace")
+        if self.total_bytes <= self.max_bytes:
+            # only the line limit is hit, everything is still in memory
+            lines = (head + tail).decode("utf-8", errors="replace").split("\n")
+            head_lines, tail_lines = lines, lines
+        else:
+            tail = tail[-self.tail_limit:]
+            head_lines = head.decode("utf-8", errors="replace").split("\n")
+            tail_lines = tail.decode("utf-8", errors="replace").split("\n")
+            # the last head line and the first tail line may be cut in the middle
+            if len(head_lines) > 1:
+                head_lines = head_lines[:-1]
+            if len(tail_lines) > 1:
+                tail_lines = tail_lines[1:]
+        if tail_lines and tail_lines[-1] == "":
+            tail_lines = tail_lines[:-1]
+        # cut to the line limit, half for the head and half for the tail
+        keep_head = max(self.max_lines // 2, 1)
+        keep_tail = max(self.max_lines - keep_head, 1)
+        head_lines = head_lines[:keep_head]
+        tail_lines = tail_lines[-keep_tail:]
+        kept = "\n".join(head_lines).encode("utf-8", errors="replace")
+        kept_tail = "\n".join(tail_lines).encode("utf-8", errors="replace")
+        dropped_lines = max(self.get_line_count() - len(head_lines) - len(tail_lines), 0)
+        dropped_bytes = max(self.total_bytes - len(kept) - len(kept_tail), 0)
+        marker = (f"... [output truncated: {dropped_lines} lines / {dropped_bytes} bytes dropped of "
+                  f"{self.get_line_count()} lines / {self.total_bytes} bytes; limits {self.max_lines} lines / "
+                  f"{self.max_bytes} bytes; refine the command with grep, head, tail or a time range to see more] ...")
+        return "\n".join(head_lines + [marker] + tail_lines) + "\n"
+
+
+def format_output(stdout: str, stderr: str = "", returncode: int = 0) -> str:
+    """Text sent to the model, stderr and the exit code are only added when there is something to say."""
+    result = stdout
+    if stderr.strip():
+        result += f"\n[stderr]\n{stderr}"
+    if returncode:
+        result += f"\n[exit code: {returncode}]"
+    return result
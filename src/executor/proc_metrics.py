@@ -0,0 +1,165 @@
+# Native Linux system metrics read from /proc and os.statvfs, no process is spawned.
+# Results are small dicts meant to be sent to the model as compact JSON instead of ps/free/df text.
+# CPU percentages need two samples: take_cpu_sample() before and after a short interval, then cpu_usage()/top_processes().
+import os
+import time
+
+PROC = "/proc"
+DEFAULT_CPU_INTERVAL = 0.5
+DEFAULT_TOP_COUNT = 10
+MAX_TOP_COUNT = 50
+# pseudo and virtual file systems never hold user data
+PSEUDO_FS = {"proc", "sysfs", "devtmpfs", "devpts", "tmpfs", "cgroup", "cgroup2", "securityfs", "pstore",
+             "debugfs", "tracefs", "configfs", "fusectl", "mqueue", "hugetlbfs", "bpf", "autofs", "binfmt_misc",
+             "rpc_pipefs", "nsfs", "ramfs", "squashfs", "overlay", "efivarfs", "selinuxfs"}
+MEMINFO_FIELDS = {"MemTotal": "total", "MemFree": "free", "MemAvailable": "available", "Buffers": "buffers",
+                  "Cached": "cached", "Shmem": "shared", "SReclaimable": "slab_reclaimable", "Dirty": "dirty",
+                  "SwapTotal": "swap_total", "SwapFree": "swap_free"}
+
+def is_supported() -> bool:
+    return os.path.isdir(os.path.join(PROC, "self"))
+
+def read_file(path: str) -> str:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+def to_mb(value_kb: float) -> float:
+    return round(value_kb / 1024, 1)
+
+def memory_info() -> dict:
+    """Memory breakdown in MB, as free(1) computes it."""
+    values = {}
+    for line in read_file(os.path.join(PROC, "meminfo")).splitlines():
+        name, _, rest = line.partition(":")
+        if name in MEMINFO_FIELDS:
+            values[MEMINFO_FIELDS[name]] = int(rest.split()[0])
+    total = values.get("total", 0)
+    available = values.get("available", values.get("free", 0))
+    cache = values.get("cached", 0) + values.get("slab_reclaimable", 0)
+    used = total - values.get("free", 0) - values.get("buffers", 0) - cache
+    swap_used = values.get("swap_total", 0) - values.get("swap_free", 0)
+    return {
+        "unit": "MB",
+        "total": to_mb(total),
+        "used": to_mb(used),
+        "free": to_mb(values.get("free", 0)),
+        "available": to_mb(available),
+        "buffers": to_mb(values.get("buffers", 0)),
+        "cache": to_mb(cache),
+        "shared": to_mb(values.get("shared", 0)),
+        "dirty": to_mb(values.get("dirty", 0)),
+        "used_percent": round((total - available) * 100 / total, 1) if total else 0.0,
+        "swap_total": to_mb(values.get("swap_total", 0)),
+        "swap_used": to_mb(swap_used),
+    }
+
+def load_average() -> dict:
+    fields = read_file(os.path.join(PROC, "loadavg")).split()
+    running, total = fields[3].split("/")
+    return {
+        "load1": float(fields[0]),
+        "load5": float(fields[1]),
+        "load15": float(fields[2]),
+        "cpus": os.cpu_count() or 1,
+        "running": int(running),
+        "tasks": int(total),
+        "uptime_seconds": int(float(read_file(os.path.join(PROC, "uptime")).split()[0])),
+    }
+
+def disk_usage(include_pseudo: bool = False) -> list:
+    """Usage of every mounted file system in GB, like df -h."""
+    mounts = []
+    seen = set()
+    for line in read_file(os.path.join(PROC, "mounts")).splitlines():
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        device, mount_point, fs_type = fields[0], fields[1].replace("\\040", " "), fields[2]
+        if (fs_type in PSEUDO_FS and not include_pseudo) or mount_point in seen:
+            continue
+        try:
+            stat = os.statvfs(mount_point)
+        except OSError:
+            continue
+        if stat.f_blocks == 0:
+            continue
+        seen.add(mount_point)
+        total = stat.f_blocks * stat.f_frsize
+        free = stat.f_bavail * stat.f_frsize
+        used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+        mounts.append({
+            "mount": mount_point,
+            "device": device,
+            "type": fs_type,
+            "size_gb": round(total / 1024 ** 3, 2),
+            "used_gb": round(used / 1024 ** 3, 2),
+            "avail_gb": round(free / 1024 ** 3, 2),
+            # percentage of the space usable by non-root users, as df reports it
+            "used_percent": round(used * 100 / (used + free), 1) if used + free else 0.0,
+            "inodes_used_percent": round((stat.f_files - stat.f_ffree) * 100 / stat.f_files, 1) if stat.f_files else 0.0,
+        })
+    return mounts
+
+def read_cpu_times() -> list:
+    """Aggregate CPU jiffies from /proc/stat: user nice system idle iowait irq softirq steal."""
+    for line in read_file(os.path.join(PROC, "stat")).splitlines():
+        if line.startswith("cpu "):
+            return [int(value) for value in line.split()[1:9]]
+    return []
+
+def read_process(pid: str):
+    """(name, cpu ticks, rss KB, state, user id) of one process, None when it is gone."""
+    try:
+        stat = read_file(os.path.join(PROC, pid, "stat"))
+        status = read_file(os.path.join(PROC, pid, "status"))
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    # the command name is in parentheses and may contain spaces
+    name = stat[stat.find("(") + 1:stat.rfind(")")]
+    fields = stat[stat.rfind(")") + 2:].split()
+    ticks = int(fields[11]) + int(fields[12])
+    rss = 0
+    uid = ""
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1])
+        elif line.startswith("Uid:"):
+            uid = line.split()[1]
+    return name, ticks, rss, fields[0], uid
+
+def take_cpu_sample(processes: bool = True) -> dict:
+    """CPU times of the system and, when asked, of every process."""
+    sample = {"time": time.monotonic(), "cpu": read_cpu_times(), "processes": {}}
+    if not processes:
+        return sample
+    for pid in os.listdir(PROC):
+        if pid.isdigit():
+            info = read_process(pid)
+            if info is not None:
+                sample["processes"][pid] = info
+    return sample
+
+def cpu_usage(before: dict, after: dict) -> dict:
+    deltas = [b - a for a, b in zip(before["cpu"], after["cpu"])]
+    total = sum(deltas) or 1
+    names = ["user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal"]
+    usage = {name: round(delta * 100 / total, 1) for name, delta in zip(names, deltas)}
+    usage["busy"] = round(100 - usage.get("idle", 0) - usage.get("iowait", 0), 1)
+    usage["cpus"] = os.cpu_count() or 1
+    return usage
+
+def top_processes(before: dict, after: dict, sort_by: str = "rss", count: int = DEFAULT_TOP_COUNT) -> list:
+    """Top processes by rss or cpu, cpu percent is of one core over the sample interval."""
+    ticks_per_second = os.sysconf("SC_CLK_TCK")
+    elapsed = max(after["time"] - before["time"], 1e-3)
+    rows = []
+    for pid, (name, ticks, rss, state, uid) in after["processes"].items():
+        previous = before["processes"].get(pid)
+        # a pid reused by another program in between starts from zero
+        start_ticks = previous[1] if previous and previous[0] == name else ticks
+        cpu = (ticks - start_ticks) * 100 / ticks_per_second / elapsed
+        rows.append({"pid": int(pid), "name": name, "cpu_percent": round(cpu, 1), "rss_mb": to_mb(rss),
+                     "state": state, "uid": uid})
+    key = "cpu_percent" if sort_by == "cpu" else "rss_mb"
+    rows.sort(key=lambda row: (row[key], row["rss_mb"]), reverse=True)
+    return rows[:max(1, min(count, MAX_TOP_COUNT))]
@@ -4,8 +4,11 @@ import os
 import subprocess
 from typing import List
 from .executor import Executor
+from .task_graph import TaskGraph
 from ..assistant.base_assistant import BaseAssistant
+from ..assistant.worker_pool import WorkerPool, get_worker_pool
 from ..const import *
+from ..deadline import DeadlineExceeded, gather_with_deadline, wait_for_deadline, DEFAULT_SUMMARY_RESERVE
 import logging
 import json
 
@@ -16,6 +19,8 @@ class SchedulerExecutor(Executor):
         super().__init__()
         self.prompt = ""
         self.context = ""
+        # time kept back from workers at the deadline, for the scheduler and manager summaries
+        self.summary_reserve = config.get("SUMMARY_RESERVE", DEFAULT_SUMMARY_RESERVE)
         self.update_method_list()
         self._create_creator()
 
@@ -34,6 +39,7 @@ class SchedulerExecutor(Executor):
     def update_method_list(self):
         self.methods[ "execute_single_task"] = self.execute_single_task
         self.methods[ "execute_multiple_tasks"] = self.execute_multiple_tasks
+        self.methods[ "execute_task_graph"] = self.execute_task_graph
 
     def is_async(self):
         return True
@@ -81,40 +87,67 @@ class SchedulerExecutor(Executor):
                     "required": ["tasks", "context"]
                 },
             },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "execute_task_graph",
+                "description": "Asynchronously execute tasks with dependencies. Independent tasks run in parallel, a task starts after the tasks it depends on and gets their results as context.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "tasks": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "task description for each task, starting with its id, like 任务1: ..."
+                        },
+                        "dependencies": {
+                            "type": "array",
+                            "items": {"type": "array", "items": {"type": "string"}},
+                            "description": "for each task, the ids of tasks it depends on, like [[], [\"任务1\"]]"
+                        },
+                        "context": {
+                            "type": "string",
+                            "description": "The context for all the tasks."
+                        }
+                    },
+                    "required": ["tasks", "dependencies", "context"]
+                },
+            },
         }]
 
     async def execute_single_task(self, task: str, context: str) -> str:
         self.log.info(f"Executing single task: {task}")
         self.log.info(f"Executing single task context: {context}")
-        worker = self.creator.create_worker()
-        result = await self._process_task(task, context, worker)
+        try:
+            result = await wait_for_deadline(self._process_pooled_task(task, context), self.summary_reserve)
+        except DeadlineExceeded as e:
+            self.log.warning(f"Task timed out: {task}")
+            result = f"{TASK_TIMEOUT}: {e}"
         self.log.info(f"Task result: {result}")
         return result
         
     
     async def execute_multiple_tasks(self, tasks: List[str], context: str) -> str:
         self.log.info("Executing tasks asynchronously...")
-        workers = {}
         try:
-            for i, task in enumerate(tasks):
-                worker_name = f"worker_{i+1}"
-                workers[worker_name] = self.creator.create_worker()
-                self.log.debug(f"Workers created: {worker_name}-{task}")
-
             task_results = ""
 
             # 创建所有任务的协程
             task_coroutines = []
             for i, task in enumerate(tasks):
                 context = f"背景：{context}\n当前任务：{task}\n任务序号：{i+1}/{len(tasks)}"
-                task_coroutines.append(self._process_task(task, context, workers[f"worker_{i+1}"]))
+                task_coroutines.append(self._process_pooled_task(task, context))
 
-            # 并行执行所有任务
-            results = await asyncio.gather(*task_coroutines, return_exceptions=True)
+            # 并行执行所有任务, 超过截止时间的任务被取消, 用已完成的部分结果汇总
+            results = await gather_with_deadline(task_coroutines, self.summary_reserve)
 
             # 处理结果
             for i, (task, result) in enumerate(zip(tasks, results)):
-                if isinstance(result, Exception):
+                if isinstance(result, DeadlineExceeded):
+                    self.log.warning(f"{task} timed out")
+                    task_results += f"{TASK}{i}:\n{task}\n{TASK_TIMEOUT}:{result}\n\n"
+                elif isinstance(result, BaseException):
                     self.log.error(f"{task} failed: {str(result)}")
                     task_results += f"{TASK}{i}:\n{task}\n{TASK_FAILED}:{result}\n\n"
                 else:
@@ -125,6 +158,53 @@ class SchedulerExecutor(Executor):
             self.log.error(f"Executing multi tasks: {str(e)}")
             return str(e)
     
+    async def execute_task_graph(self, tasks: List[str], dependencies: List[List[str]], context: str) -> str:
+        """按依赖关系分波次执行任务，同一波次并行，前置任务结果作为后续任务的背景"""
+        # 循环依赖或未知依赖在执行前抛出 ValueError
+        graph = TaskGraph(tasks, dependencies)
+        self.log.info(f"Executing task graph in waves: {graph.waves()}")
+        results = {}
+        failed = set()
+        for wave in graph.waves():
+            runnable = []
+            for task_id in wave:
+                broken = [dep for dep in graph.get_dependencies(task_id) if dep in failed]
+                if broken:
+                    # 前置任务失败或超时，跳过
+                    failed.add(task_id)
+                    results[task_id] = (TASK_SKIPPED, f"{', '.join(broken)} {TASK_FAILED}")
+                else:
+                    runnable.append(task_id)
+            task_coroutines = []
+            for task_id in runnable:
+                task = graph.get_task(task_id)
+                dep_results = "\n".join(f"{dep}{RESULT}：{results[dep][1]}" for dep in graph.get_dependencies(task_id))
+                task_context = f"背景：{context}\n前置任务结果：\n{dep_results}\n当前任务：{task}" if dep_results \
+                    else f"背景：{context}\n当前任务：{task}"
+                task_coroutines.append(self._process_pooled_task(task, task_context))
+            wave_results = await gather_with_deadline(task_coroutines, self.summary_reserve)
+            for task_id, result in zip(runnable, wave_results):
+                if isinstance(result, DeadlineExceeded):
+                    failed.add(task_id)
+                    results[task_id] = (TASK_TIMEOUT, result)
+                elif isinstance(result, BaseException):
+                    failed.add(task_id)
+                    results[task_id] = (TASK_FAILED, result)
+                else:
+                    results[task_id] = (RESULT, result)
+
+        task_results = ""
+        for task_id in graph.tasks:
+            status, result = results[task_id]
+            task_results += f"{task_id}:\n{graph.get_task(task_id)}\n{status}:{result}\n\n"
+        self.log.info(f"Task results: {task_results}")
+        return task_results
+
+    async def _process_pooled_task(self, task: str, context: str) -> str:
+        # check out a warm worker, it is reset and returned to the pool when the task ends
+        async with self.pool.worker() as worker:
+            return await self._process_task(task, context, worker)
+
     async def _process_task(self, task: str, context: str, assistant: BaseAssistant) -> str:
         if not assistant:
             raise ValueError(f"Assistant for task {task} not found")
@@ -140,4 +220,5 @@ class SchedulerExecutor(Executor):
     
     def _create_creator(self):
         from ..assist_creator import AssistantCreator
-        self.creator = AssistantCreator(self.config, self.log)
\ No newline at end of file
+        self.creator = AssistantCreator(self.config, self.log)
+        self.pool: WorkerPool = get_worker_pool(self.config, self.log, self.creator.create_worker)
\ No newline at end of file
@@ -0,0 +1,285 @@
+# Pool of long-lived bash processes for script execution, an optional mode of PC/K8s executors (SHELL_POOL_ENABLED).
+# A command is sent to an idle shell and run in a subshell, so cd/exit/set in one script never leak into the next;
+# its stdout and stderr are framed by a random sentinel line carrying the exit code.
+# A shell that dies, hangs past the timeout or breaks the framing is killed and replaced.
+# Run "python -m src.executor.shell_pool" to compare the pool with one-shot subprocess.run at the same concurrency.
+import os
+import time
+import uuid
+import signal
+import asyncio
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from .output_capture import OutputCapture, SCRIPT_TIMEOUT_MESSAGE, SHELL_FAILED_MESSAGE
+
+DEFAULT_SHELL_POOL_SIZE = 4
+DEFAULT_SHELL_TIMEOUT = 60
+READ_CHUNK = 64 * 1024
+# seconds a killed shell gets to close its pipes
+KILL_DRAIN_TIMEOUT = 5
+
+def quote_script(script: str) -> str:
+    """Quote a script as a bash $'...' string, so any text can be passed to eval."""
+    quoted = []
+    for ch in script:
+        if ch == "\\":
+            quoted.append("\\\\")
+        elif ch == "'":
+            quoted.append("\\'")
+        elif ch == "\n":
+            quoted.append("\\n")
+        elif ch == "\t":
+            quoted.append("\\t")
+        elif ord(ch) < 32 or ord(ch) == 127:
+            quoted.append(f"\\x{ord(ch):02x}")
+        else:
+            quoted.append(ch)
+    return "$'" + "".join(quoted) + "'"
+
+class ShellSession:
+    def __init__(self, log: logging.Logger):
+        self.log = log
+        self.process = None
+        self.stdout_buffer = b""
+        self.stderr_buffer = b""
+        self.commands = 0
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            "bash", "--noprofile", "--norc",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def run(self, script: str, stdout_capture: OutputCapture, stderr_capture: OutputCapture):
+        """Run one script into the captures, return the exit code."""
+        sentinel = f"__AIA_{uuid.uuid4().hex}__"
+        command = (f"( eval {quote_script(script)} ) </dev/null; "
+                   f"printf '\\n{sentinel} %d\\n' $?; printf '\\n{sentinel}\\n' >&2\n")
+        self.process.stdin.write(command.encode("utf-8"))
+        await self.process.stdin.drain()
+        marker = f"\n{sentinel}".encode()
+        async def read_stdout():
+            self.stdout_buffer = await self.read_frame(self.process.stdout, self.stdout_buffer, marker, stdout_capture)
+            # the rest of the stdout frame is " <exit code>\n"
+            status, self.stdout_buffer = await self.read_until(self.process.stdout, self.stdout_buffer, b"\n")
+            return status
+        async def read_stderr():
+            self.stderr_buffer = await self.read_frame(self.process.stderr, self.stderr_buffer, marker + b"\n", stderr_capture)
+        # both pipes are read at once, a command filling one of them never blocks on it
+        readers = [asyncio.ensure_future(read_stdout()), asyncio.ensure_future(read_stderr())]
+        try:
+            status, _ = await asyncio.gather(*readers)
+        except BaseException:
+            for reader in readers:
+                reader.cancel()
+            await asyncio.wait(readers)
+            raise
+        self.commands += 1
+        return int(status.strip() or -1)
+
+    async def read_frame(self, reader: asyncio.StreamReader, buffer: bytes, marker: bytes, capture: OutputCapture):
+        """Feed the output up to the marker into the capture while it streams, return what follows the marker."""
+        keep = len(marker) - 1
+        while True:
+            index = buffer.find(marker)
+            if index >= 0:
+                capture.feed(buffer[:index])
+                return buffer[index + len(marker):]
+            # only a possible partial marker at the end stays buffered
+            if len(buffer) > keep:
+                capture.feed(buffer[:len(buffer) - keep])
+                buffer = buffer[len(buffer) - keep:]
+            chunk = await reader.read(READ_CHUNK)
+            if not chunk:
+                raise ConnectionError("Shell exited before the command finished")
+            buffer += chunk
+
+    async def read_until(self, reader: asyncio.StreamReader, buffer: bytes, marker: bytes):
+        while True:
+            index = buffer.find(marker)
+            if index >= 0:
+                return buffer[:index], buffer[index + len(marker):]
+            chunk = await reader.read(READ_CHUNK)
+            if not chunk:
+                raise ConnectionError("Shell exited before the command finished")
+            buffer += chunk
+
+    async def kill(self):
+        if not self.is_alive():
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        # wait() only returns once the pipes are closed, what is left in them is read and dropped
+        try:
+            await asyncio.wait_for(asyncio.gather(self.discard(self.process.stdout), self.discard(self.process.stderr)),
+                                   timeout=KILL_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            # a process that left the group still holds the pipes
+            self.process._transport.close()
+        await self.process.wait()
+
+    def kill_now(self):
+        """Kill and reap the shell without its event loop, which may be closed already."""
+        if not self.is_alive():
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        try:
+            os.waitpid(self.process.pid, 0)
+        except ChildProcessError:
+            # reaped by the loop's child watcher
+            pass
+
+    @staticmethod
+    async def discard(reader: asyncio.StreamReader):
+        while await reader.read(READ_CHUNK):
+            pass
+
+
+class ShellPool:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.size = max(config.get("SHELL_POOL_SIZE", DEFAULT_SHELL_POOL_SIZE), 1)
+        # sessions and their queue are bound to the running loop
+        self.loop = None
+        self.idle = None
+        self.closer = None
+        self.created = 0
+        self.stats = {"commands": 0, "started": 0, "recycled": 0, "timeouts": 0}
+
+    def check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # shells left by a previous loop that was not closed by asyncio.run() can not be awaited any more
+            while self.idle is not None and not self.idle.empty():
+                self.idle.get_nowait().kill_now()
+            self.loop = loop
+            self.idle = asyncio.Queue()
+            self.created = 0
+            # the loop only keeps a weak reference to its tasks, a collected closer would close the pool too early
+            self.closer = loop.create_task(self.close_with_loop(loop))
+
+    async def close_with_loop(self, loop: asyncio.AbstractEventLoop):
+        # waits until asyncio.run() cancels the remaining tasks of the loop (the CLI runs one per question),
+        # then kills the idle shells while the loop still runs
+        try:
+            await loop.create_future()
+        finally:
+            if self.loop is loop:
+                await self.aclose()
+
+    async def acquire(self) -> ShellSession:
+        self.check_loop()
+        if self.idle.empty() and self.created < self.size:
+            self.created += 1
+            session = ShellSession(self.log)
+            try:
+                await session.start()
+            except BaseException:
+                self.created -= 1
+                raise
+            self.stats["started"] += 1
+            return session
+        return await self.idle.get()
+
+    async def release(self, session: ShellSession, healthy: bool):
+        if healthy and session.is_alive():
+            self.idle.put_nowait(session)
+            return
+        # replace the broken shell lazily, the slot is free again
+        self.stats["recycled"] += 1
+        self.created -= 1
+        await session.kill()
+
+    async def run(self, script: str, timeout=None, stdout_capture: OutputCapture = None, stderr_capture: OutputCapture = None):
+        """Run a script on a pooled shell, return (stdout, stderr, exit code), the output bounded by the captures."""
+        timeout = timeout or self.config.get("SCRIPT_TIMEOUT", DEFAULT_SHELL_TIMEOUT)
+        stdout_capture = stdout_capture or OutputCapture()
+        stderr_capture = stderr_capture or OutputCapture()
+        session = await self.acquire()
+        healthy = False
+        try:
+            returncode = await asyncio.wait_for(session.run(script, stdout_capture, stderr_capture), timeout=timeout)
+            healthy = True
+            self.stats["commands"] += 1
+            return stdout_capture.get_text(), stderr_capture.get_text(), returncode
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self.log.warning(f"Shell command timed out after {timeout} seconds, recycling shell")
+            # keep what was printed before the timeout, it often tells where the command hung
+            return stdout_capture.get_text(), f"{SCRIPT_TIMEOUT_MESSAGE} after {timeout} seconds.", -1
+        except (ConnectionError, ValueError, BrokenPipeError) as e:
+            self.log.warning(f"Shell session broken, recycling shell: {e}")
+            return "", f"{SHELL_FAILED_MESSAGE}: {e}", -1
+        finally:
+            # a cancelled or timed out command leaves the shell in an unknown state, it is killed
+            await asyncio.shield(self.release(session, healthy))
+
+    async def aclose(self):
+        if self.idle is None:
+            return
+        while not self.idle.empty():
+            await self.idle.get_nowait().kill()
+        self.created = 0
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["size"] = self.created
+        stats["idle"] = self.idle.qsize() if self.idle is not None else 0
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_shell_pool(config: dict, log: logging.Logger) -> ShellPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ShellPool(config, log)
+        return _pool
+
+
+def benchmark(script: str = "echo hello", count: int = 200, concurrency: int = 4):
+    """Compare one-shot subprocess.run with the shell pool at the same concurrency, print commands per second."""
+    log = logging.getLogger("shell_pool")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        list(threads.map(lambda _: subprocess.run(["bash", "-c", script], capture_output=True, text=True), range(count)))
+    oneshot = time.perf_counter() - start
+
+    async def run_pool():
+        pool = ShellPool({"SHELL_POOL_SIZE": concurrency}, log)
+        semaphore = asyncio.Semaphore(concurrency)
+        async def one():
+            async with semaphore:
+                await pool.run(script)
+        await pool.run(script)  # warm up
+        begin = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(count)))
+        elapsed = time.perf_counter() - begin
+        await pool.aclose()
+        return elapsed
+    pooled = asyncio.run(run_pool())
+    print(f"script: {script!r}, commands: {count}")
+    print(f"one-shot subprocess.run ({concurrency} threads): {oneshot:.3f}s ({count / oneshot:.0f}/s)")
+    print(f"shell pool ({concurrency} shells): {pooled:.3f}s ({count / pooled:.0f}/s)")
+    print(f"speedup: {oneshot / pooled:.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
+    benchmark("df -h / && free -m", count=100)
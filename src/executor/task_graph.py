@@ -0,0 +1,64 @@
+# Dependency graph of the tasks in a manager plan.
+# Tasks are identified by their "任务N" prefix, dependencies reference those ids.
+# waves(): topological levels (Kahn's algorithm), every task in a wave only depends on earlier waves, so a wave runs in parallel.
+# Unknown references and cycles raise ValueError before anything is executed.
+import re
+from typing import Dict, List
+
+TASK_ID_PATTERN = re.compile(r'^(任务\d+)')
+
+class TaskGraph:
+    def __init__(self, tasks: List[str], dependencies: List[List[str]]):
+        if len(tasks) != len(dependencies):
+            raise ValueError("Each task needs a dependency list")
+        self.tasks: Dict[str, str] = {}
+        self.dependencies: Dict[str, List[str]] = {}
+        for i, (task, deps) in enumerate(zip(tasks, dependencies)):
+            match = TASK_ID_PATTERN.match(task.strip())
+            task_id = match.group(1) if match else f"任务{i+1}"
+            if task_id in self.tasks:
+                raise ValueError(f"Duplicate task id: {task_id}")
+            self.tasks[task_id] = task
+            # keep order, drop duplicates
+            self.dependencies[task_id] = list(dict.fromkeys(deps))
+        for task_id, deps in self.dependencies.items():
+            for dep in deps:
+                if dep not in self.tasks:
+                    raise ValueError(f"{task_id} depends on unknown task {dep}")
+        self.levels = self._build_waves()
+
+    def _build_waves(self) -> List[List[str]]:
+        indegree = {task_id: len(deps) for task_id, deps in self.dependencies.items()}
+        dependents = {task_id: [] for task_id in self.tasks}
+        for task_id, deps in self.dependencies.items():
+            for dep in deps:
+                dependents[dep].append(task_id)
+        wave = [task_id for task_id in self.tasks if indegree[task_id] == 0]
+        waves = []
+        done = 0
+        while wave:
+            waves.append(wave)
+            done += len(wave)
+            next_wave = []
+            for task_id in wave:
+                for dependent in dependents[task_id]:
+                    indegree[dependent] -= 1
+                    if indegree[dependent] == 0:
+                        next_wave.append(dependent)
+            wave = next_wave
+        if done != len(self.tasks):
+            cycle = [task_id for task_id, degree in indegree.items() if degree > 0]
+            raise ValueError(f"Dependency cycle between tasks: {', '.join(cycle)}")
+        return waves
+
+    def waves(self) -> List[List[str]]:
+        return self.levels
+
+    def get_task(self, task_id: str) -> str:
+        return self.tasks[task_id]
+
+    def get_dependencies(self, task_id: str) -> List[str]:
+        return self.dependencies[task_id]
+
+    def has_dependencies(self) -> bool:
+        return any(self.dependencies.values())
@@ -0,0 +1,122 @@
+# Rolling summarization of long chat histories, off the request path.
+# Once a history passes HISTORY_SUMMARIZE_THRESHOLD of its token budget, its oldest turns and the previous summary are
+# sent to the model on a background event loop; the history folds them into the new summary when it is ready,
+# so the summary is updated incrementally and never regenerated from the whole conversation.
+# Summaries are cached by a hash of the previous summary and the folded turns, an unchanged prefix is never resummarized.
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from langchain_core.messages import HumanMessage
+
+DEFAULT_SUMMARIZE_THRESHOLD = 0.75
+DEFAULT_KEEP_TURNS = 2
+DEFAULT_SUMMARY_CACHE_SIZE = 256
+DEFAULT_SUMMARIZE_TIMEOUT = 60
+SUMMARY_INSTRUCTION = """You compress the history of a system diagnostics conversation.
+Merge the previous summary and the new turns into one updated summary of at most {max_words} words.
+Keep the user's goals, the facts found (hosts, metrics, errors, commands run and their key results) and open questions.
+Drop greetings and repetition. Answer with the summary only, in the language of the conversation."""
+
+class HistorySummarizer:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.threshold = config.get("HISTORY_SUMMARIZE_THRESHOLD", DEFAULT_SUMMARIZE_THRESHOLD)
+        self.keep_turns = config.get("HISTORY_SUMMARIZE_KEEP_TURNS", DEFAULT_KEEP_TURNS)
+        self.cache_size = config.get("HISTORY_SUMMARY_CACHE_SIZE", DEFAULT_SUMMARY_CACHE_SIZE)
+        self.timeout = config.get("HISTORY_SUMMARIZE_TIMEOUT", DEFAULT_SUMMARIZE_TIMEOUT)
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.loop = None
+        self.thread = None
+        self.stats = {"jobs": 0, "cache_hits": 0, "failures": 0, "folded_tokens": 0, "summary_tokens": 0,
+                      "prompts": 0, "prompt_tokens_saved": 0}
+
+    def start(self):
+        # a loop of its own, so summaries outlive the asyncio.run() of the request that started them
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="history-summarizer", daemon=True)
+            self.thread.start()
+
+    def make_key(self, previous: str, messages: list) -> str:
+        payload = json.dumps([previous, [(type(message).__name__, message.content) for message in messages]],
+                             ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def submit(self, model, previous: str, messages: list, max_tokens: int) -> concurrent.futures.Future:
+        """Start summarizing previous summary + messages, the future gives the new summary."""
+        key = self.make_key(previous, messages)
+        with self.lock:
+            summary = self.cache.get(key)
+            if summary is not None:
+                self.cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                future = concurrent.futures.Future()
+                future.set_result(summary)
+                return future
+            self.stats["jobs"] += 1
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self.asummarize(model, previous, messages, max_tokens, key), self.loop)
+
+    def build_messages(self, previous: str, messages: list, max_tokens: int) -> list:
+        turns = "\n".join(f"{'User' if isinstance(message, HumanMessage) else 'Assistant'}: {message.content}"
+                          for message in messages)
+        return [
+            # about three quarters of a word per token
+            {"role": "system", "content": SUMMARY_INSTRUCTION.format(max_words=max(max_tokens * 3 // 4, 50))},
+            {"role": "user", "content": f"Previous summary:\n{previous or '(none)'}\n\nNew turns:\n{turns}"},
+        ]
+
+    async def asummarize(self, model, previous: str, messages: list, max_tokens: int, key: str) -> str:
+        try:
+            response = await asyncio.wait_for(model.aask(self.build_messages(previous, messages, max_tokens), []),
+                                              timeout=self.timeout)
+            if response is None or not response.choices[0].message.content:
+                raise ValueError("empty summary")
+            summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            with self.lock:
+                self.stats["failures"] += 1
+            self.log.warning(f"History summarization failed: {e}")
+            raise
+        with self.lock:
+            self.cache[key] = summary
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return summary
+
+    def record_fold(self, folded_tokens: int, summary_tokens: int):
+        with self.lock:
+            self.stats["folded_tokens"] += folded_tokens
+            self.stats["summary_tokens"] += summary_tokens
+
+    def record_prompt(self, saved_tokens: int):
+        """Tokens a prompt did not send because of the summary."""
+        with self.lock:
+            self.stats["prompts"] += 1
+            self.stats["prompt_tokens_saved"] += max(saved_tokens, 0)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["cache_size"] = len(self.cache)
+        return stats
+
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+
+def get_history_summarizer(config: dict, log: logging.Logger) -> HistorySummarizer:
+    global _summarizer
+    with _summarizer_lock:
+        if _summarizer is None:
+            _summarizer = HistorySummarizer(config, log)
+        return _summarizer
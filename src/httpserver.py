@@ -1,34 +1,151 @@
+import os
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
 import uvicorn
-from .aiservice import AiService
+from .aiservice import AiService, ServiceUnavailable
+from .deadline import DeadlineExceeded
+from .logger import setup_logger
+from . import __version__
 import logging
 
+CONFIG_FILE_ENV = "AIA_CONFIG"
+DEFAULT_CONFIG_FILE = "config.json"
+
+class AskRequest(BaseModel):
+    question: str
+    session_id: Optional[str] = None
+
+
 class HttpServer:
-    def __init__(self, ai_service: AiService, log: logging.Logger):
+    def __init__(self, ai_service: AiService, log: logging.Logger, config: dict = None):
         self.log = log
-        self.app = FastAPI()
-        self.setup_routes()
+        self.config = config or {}
         self.service = ai_service
+        self.app = FastAPI(lifespan=self.lifespan)
+        self.setup_routes()
+
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI):
+        self.log.info(f"HTTP server started, pid {os.getpid()}")
+        yield
+        # uvicorn has stopped accepting connections, let the running multi-agent runs finish
+        await self.service.close()
 
     def setup_routes(self):
+        @self.app.exception_handler(ServiceUnavailable)
+        async def service_unavailable(request, e: ServiceUnavailable):
+            return JSONResponse(status_code=503, content={"error": str(e)},
+                                headers={"Retry-After": str(int(e.retry_after))})
+
+        @self.app.exception_handler(DeadlineExceeded)
+        async def deadline_exceeded(request, e: DeadlineExceeded):
+            return JSONResponse(status_code=504, content={"error": str(e)})
+
         @self.app.get("/GetVersion")
         async def get_version():
-            return {"version": "1.0.0"}
+            return {"version": __version__}
+
+        @self.app.get("/Health")
+        async def health():
+            if not self.service.accepting:
+                raise ServiceUnavailable("Service is shutting down", retry_after=self.service.drain_timeout)
+            return {"status": "ok", "inflight": self.service.inflight}
+
+        @self.app.get("/Stats")
+        async def stats():
+            return self.service.get_stats()
 
         @self.app.get("/Ask")
-        async def ask(question: str):
-            # Implement your logic to handle the question here
-            answer=await self.service.ask(question)
-            return {"question": question, "answer": answer}
+        async def ask(question: str, session_id: Optional[str] = None):
+            result = await self.service.ask(question, session_id)
+            return {"question": question, **result}
+
+        @self.app.post("/Ask")
+        async def ask_post(request: AskRequest):
+            result = await self.service.ask(request.question, request.session_id)
+            return {"question": request.question, **result}
+
+        @self.app.get("/AskStream")
+        async def ask_stream(question: str, session_id: Optional[str] = None):
+            return self.stream_response(question, session_id)
+
+        @self.app.post("/AskStream")
+        async def ask_stream_post(request: AskRequest):
+            return self.stream_response(request.question, request.session_id)
+
+        @self.app.delete("/Session/{session_id}")
+        async def delete_session(session_id: str):
+            self.service.remove_session(session_id)
+            return {"session_id": session_id, "deleted": True}
+
+    def stream_response(self, question: str, session_id: Optional[str]) -> StreamingResponse:
+        # reject before the stream starts, a 503 cannot be sent once events are flowing
+        self.service.check()
+        if not session_id:
+            session_id = os.urandom(16).hex()
+        # Server-Sent Events, one event per delta and a final done event
+        async def events():
+            try:
+                yield f"event: session\ndata: {json.dumps({'session_id': session_id})}\n\n"
+                async for stage, delta in self.service.astream(question, session_id):
+                    yield f"event: {stage}\ndata: {json.dumps({'content': delta}, ensure_ascii=False)}\n\n"
+                yield "event: done\ndata: {}\n\n"
+            except Exception as e:
+                self.log.error(f"Error streaming answer: {e}")
+                yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
     def run(self, host="0.0.0.0", port=8000):
         uvicorn.run(
-            self.app, 
-            host=host, 
-            port=port, 
-            workers=1, 
-            loop="asyncio", 
-            http="auto", 
-            timeout_keep_alive=30
+            self.app,
+            host=host,
+            port=port,
+            workers=1,
+            loop="asyncio",
+            http="auto",
+            timeout_keep_alive=30,
+            timeout_graceful_shutdown=self.service.drain_timeout,
             )
 
+
+def load_config() -> dict:
+    with open(os.environ.get(CONFIG_FILE_ENV, DEFAULT_CONFIG_FILE)) as config_file:
+        return json.load(config_file)
+
+def create_app() -> FastAPI:
+    """App factory, every uvicorn worker process builds its own service from the config file."""
+    config = load_config()
+    log = setup_logger(config)
+    return HttpServer(AiService(config, log), log, config).app
+
+def main():
+    config = load_config()
+    host = config.get("SERVICE_HOST", "0.0.0.0")
+    port = config.get("SERVICE_PORT", 8000)
+    workers = config.get("SERVICE_WORKERS", 1)
+    if workers <= 1:
+        log = setup_logger(config)
+        log.info(f"Starting AI service version {__version__} on {host}:{port}")
+        HttpServer(AiService(config, log), log, config).run(host, port)
+        return
+    # several processes on one port, caches shared through RESPONSE_CACHE_DB and the SQL_CONN_STR session store
+    uvicorn.run(
+        "src.httpserver:create_app",
+        factory=True,
+        host=host,
+        port=port,
+        workers=workers,
+        loop="asyncio",
+        http="auto",
+        timeout_keep_alive=30,
+        timeout_graceful_shutdown=config.get("SERVICE_DRAIN_TIMEOUT", 60),
+    )
+
+
+if __name__ == "__main__":
+    main()
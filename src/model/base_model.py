@@ -1,16 +1,71 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Iterable
+from contextlib import asynccontextmanager, nullcontext
+from types import SimpleNamespace
+from typing import AsyncIterator, Iterable
 from openai.types.chat import (
     ChatCompletionMessageParam,
     ChatCompletionToolParam,
     ChatCompletion
 )
 import logging
+from .response_cache import get_response_cache
+from ..coalescer import get_request_coalescer
+from ..deadline import wait_for_deadline
+from .rate_limiter import Permit, MAX_BACKOFF, get_retry_after, get_usage_tokens, is_retryable, is_throttled
+
+# Stream event types yielded by BaseModel.astream()
+STREAM_DELTA = "delta"
+STREAM_DONE = "done"
+DEFAULT_MAX_RETRIES = 3
+
+class ToolCallAccumulator:
+    """Merge streamed tool call fragments into complete tool calls.
+
+    Fragments are keyed by their index when the service sends one, otherwise by id;
+    a fragment with neither continues the last tool call.
+    """
+    def __init__(self):
+        self.tool_calls = []
+        self.keys = {}
+
+    def add(self, fragment):
+        index = getattr(fragment, "index", None)
+        call_id = getattr(fragment, "id", None)
+        key = index if index is not None else call_id
+        if key is not None and key in self.keys:
+            tool_call = self.keys[key]
+        elif key is None and self.tool_calls:
+            tool_call = self.tool_calls[-1]
+        else:
+            tool_call = SimpleNamespace(id=None, type="function",
+                                        function=SimpleNamespace(name="", arguments=""))
+            self.tool_calls.append(tool_call)
+            if key is not None:
+                self.keys[key] = tool_call
+        if call_id:
+            tool_call.id = call_id
+        function = getattr(fragment, "function", None)
+        if function is not None:
+            if getattr(function, "name", None):
+                tool_call.function.name += function.name
+            if getattr(function, "arguments", None):
+                tool_call.function.arguments += function.arguments
+
+    def get_tool_calls(self) -> list:
+        return self.tool_calls
+
 
 class BaseModel(ABC):
     def __init__(self, config: dict, log: logging.Logger):
         self.config = config
         self.log = log
+        self.cache = get_response_cache(config, log)
+        # identical calls in flight share one request, MODEL_COALESCE_* staleness rules
+        self.coalescer = get_request_coalescer(config, log, "MODEL")
+        # the deployment's rate limiter, set by setup_model() when RATE_LIMIT_ENABLED
+        self.limiter = None
+        self.max_retries = config.get("MODEL_MAX_RETRIES", DEFAULT_MAX_RETRIES)
 
     @abstractmethod
     def ask(self, question: str) -> str:
@@ -27,4 +82,105 @@ class BaseModel(ABC):
 
     @abstractmethod
     def setup_model(self):
-        pass    
\ No newline at end of file
+        pass
+
+    def get_cache_name(self) -> str:
+        # model class and deployment are part of the cache key
+        return f"{type(self).__name__}:{getattr(self, 'model_name', '')}"
+
+    def get_cached_response(self, messages, tools_definitions):
+        """Return (key, response); pass key to put_cached_response() after a miss."""
+        return self.cache.get(self.get_cache_name(), messages, tools_definitions)
+
+    def put_cached_response(self, key, response):
+        self.cache.put(key, response)
+
+    async def acoalesce(self, key, messages, tools_definitions, call):
+        """Await call() once for every identical aask() in flight; key is the cache key, if any."""
+        if key is None and self.coalescer.enabled:
+            # turns that bypass the cache are still identical requests while they run
+            key = self.cache.make_key(self.get_cache_name(), messages, tools_definitions)
+        return await self.coalescer.run(key, call)
+
+    def get_concurrency_guard(self):
+        """Bounds concurrent calls when there is no rate limiter."""
+        return nullcontext()
+
+    @asynccontextmanager
+    async def limited(self, messages, tools_definitions):
+        """Hold the deployment's rate limit for one call, the permit takes the usage of the response."""
+        if self.limiter is None:
+            async with self.get_concurrency_guard():
+                yield Permit(0)
+            return
+        async with self.limiter.slot(self.limiter.estimate(messages, tools_definitions)) as permit:
+            yield permit
+
+    async def acall_limited(self, messages, tools_definitions, call):
+        """Await call() within the rate limits. Throttled and transient failures are retried up to
+        MODEL_MAX_RETRIES times, a 429 after its Retry-After, before the caller sees the error."""
+        if self.limiter is None:
+            async with self.get_concurrency_guard():
+                return await call()
+        attempt = 0
+        while True:
+            try:
+                async with self.limited(messages, tools_definitions) as permit:
+                    response = await call()
+                    permit.used_tokens = get_usage_tokens(response)
+                    return response
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                attempt += 1
+                self.log.warning(f"Model call failed, retry {attempt}/{self.max_retries}: {e}")
+                # a 429 holds back the whole deployment in the limiter, other failures back off here
+                if not is_throttled(e):
+                    await wait_for_deadline(asyncio.sleep(get_retry_after(e) or min(2 ** attempt, MAX_BACKOFF)))
+
+    async def astream(self, messages, tools_definitions) -> AsyncIterator[dict]:
+        """Stream a chat completion.
+
+        Yields {"type": STREAM_DELTA, "content": str} for every content delta, and a final
+        {"type": STREAM_DONE, "finish_reason": str, "message": message} where message has
+        role, content and the accumulated tool_calls like a ChatCompletion message.
+        The default implementation falls back to aask() for models without streaming.
+        """
+        response = await self.aask(messages, tools_definitions)
+        if response is None:
+            return
+        choice = response.choices[0]
+        if choice.message.content:
+            yield {"type": STREAM_DELTA, "content": choice.message.content}
+        yield {"type": STREAM_DONE, "finish_reason": choice.finish_reason, "message": choice.message}
+
+    async def astream_chunks(self, chunks) -> AsyncIterator[dict]:
+        # shared by openai and azure inference streams, both have choices[0].delta with content/tool_calls
+        content = ""
+        finish_reason = None
+        accumulator = ToolCallAccumulator()
+        iterator = chunks.__aiter__()
+        while True:
+            # a stalled stream must not outlive the request deadline
+            try:
+                chunk = await wait_for_deadline(iterator.__anext__())
+            except StopAsyncIteration:
+                break
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if delta is not None:
+                if delta.content:
+                    content += delta.content
+                    yield {"type": STREAM_DELTA, "content": delta.content}
+                for fragment in delta.tool_calls or []:
+                    accumulator.add(fragment)
+            if choice.finish_reason:
+                finish_reason = str(getattr(choice.finish_reason, "value", choice.finish_reason))
+        tool_calls = accumulator.get_tool_calls()
+        if tool_calls and finish_reason != "tool_calls":
+            finish_reason = "tool_calls"
+        message = SimpleNamespace(role="assistant", content=content or None, tool_calls=tool_calls or None)
+        yield {"type": STREAM_DONE, "finish_reason": finish_reason, "message": message}
+
@@ -0,0 +1,182 @@
+# Process-wide registry of model clients, keyed by endpoint and deployment.
+# All OpenAI clients share one keep-alive httpx connection pool, so workers created per task reuse warm connections.
+# Async clients are bound to an event loop, every loop gets its own set (the CLI uses asyncio.run per question, the history
+# summarizer has a loop of its own). They are closed while their loop shuts down, when asyncio.run cancels its tasks.
+import asyncio
+import logging
+import threading
+import httpx
+import aiohttp
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from azure.ai.inference import ChatCompletionsClient
+from azure.ai.inference.aio import ChatCompletionsClient as AsyncChatCompletionsClient
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import AioHttpTransport
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_CLIENT_MAX_RETRIES = 2
+
+class LoopClients:
+    """The async clients, their pools and the semaphores of one event loop."""
+    def __init__(self):
+        self.http_client = None
+        self.clients = {}
+        self.semaphores = {}
+        self.closer = None
+
+    async def aclose(self, log: logging.Logger):
+        clients, self.clients = list(self.clients.values()), {}
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                log.warning(f"Error closing async client: {e}")
+        if self.http_client is not None:
+            await self.http_client.aclose()
+        self.http_client = None
+        self.semaphores = {}
+
+
+class ClientRegistry:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.lock = threading.Lock()
+        self.max_connections = config.get("HTTP_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)
+        self.max_keepalive = config.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", DEFAULT_MAX_KEEPALIVE_CONNECTIONS)
+        self.keepalive_expiry = config.get("HTTP_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)
+        # with the rate limiter on, async calls are retried by the model after Retry-After, not by the client
+        self.async_max_retries = 0 if config.get("RATE_LIMIT_ENABLED", True) else DEFAULT_CLIENT_MAX_RETRIES
+        self.http_client = None
+        self.clients = {}
+        # LoopClients of every running loop
+        self.loops = {}
+
+    def get_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def get_openai_client(self, endpoint: str, deployment: str, key: str, version: str) -> AzureOpenAI:
+        with self.lock:
+            client_key = ("openai", endpoint, deployment)
+            client = self.clients.get(client_key)
+            if client is None:
+                if self.http_client is None:
+                    self.http_client = httpx.Client(limits=self.get_limits())
+                client = AzureOpenAI(azure_endpoint=endpoint, api_key=key, api_version=version,
+                                     http_client=self.http_client)
+                self.clients[client_key] = client
+                self.log.debug(f"Created shared OpenAI client: {endpoint} {deployment}")
+            return client
+
+    def get_openai_async_client(self, endpoint: str, deployment: str, key: str, version: str) -> AsyncAzureOpenAI:
+        loop_clients = self.get_loop_clients()
+        with self.lock:
+            client_key = ("openai", endpoint, deployment)
+            client = loop_clients.clients.get(client_key)
+            if client is None:
+                if loop_clients.http_client is None:
+                    loop_clients.http_client = httpx.AsyncClient(limits=self.get_limits())
+                client = AsyncAzureOpenAI(azure_endpoint=endpoint, api_key=key, api_version=version,
+                                          http_client=loop_clients.http_client, max_retries=self.async_max_retries)
+                loop_clients.clients[client_key] = client
+                self.log.debug(f"Created shared async OpenAI client: {endpoint} {deployment}")
+            return client
+
+    def get_deepseek_client(self, endpoint: str, deployment: str, key: str) -> ChatCompletionsClient:
+        with self.lock:
+            client_key = ("deepseek", endpoint, deployment)
+            client = self.clients.get(client_key)
+            if client is None:
+                client = ChatCompletionsClient(endpoint=endpoint, credential=AzureKeyCredential(key))
+                self.clients[client_key] = client
+            return client
+
+    def get_deepseek_async_client(self, endpoint: str, deployment: str, key: str,
+                                  max_connections: int) -> AsyncChatCompletionsClient:
+        loop_clients = self.get_loop_clients()
+        with self.lock:
+            client_key = ("deepseek", endpoint, deployment)
+            client = loop_clients.clients.get(client_key)
+            if client is None:
+                connector = aiohttp.TCPConnector(limit=max_connections, keepalive_timeout=self.keepalive_expiry)
+                session = aiohttp.ClientSession(connector=connector)
+                transport = AioHttpTransport(session=session, session_owner=True)
+                kwargs = {} if self.async_max_retries else {"retry_total": 0}
+                client = AsyncChatCompletionsClient(endpoint=endpoint, credential=AzureKeyCredential(key),
+                                                    transport=transport, **kwargs)
+                loop_clients.clients[client_key] = client
+                self.log.debug(f"Created shared async DeepSeek client: {endpoint} {deployment}")
+            return client
+
+    def get_semaphore(self, endpoint: str, deployment: str, limit: int) -> asyncio.Semaphore:
+        # one concurrency limit per deployment and loop, shared by all model instances
+        loop_clients = self.get_loop_clients()
+        with self.lock:
+            semaphore = loop_clients.semaphores.get((endpoint, deployment))
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(limit)
+                loop_clients.semaphores[(endpoint, deployment)] = semaphore
+            return semaphore
+
+    def get_loop_clients(self) -> LoopClients:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            loop_clients = self.loops.get(loop)
+            if loop_clients is not None:
+                return loop_clients
+            # a loop closed without cancelling its tasks left its clients behind, they can not be closed any more
+            for closed in [other for other in self.loops if other.is_closed()]:
+                self.log.debug("Dropping async clients of a closed event loop")
+                del self.loops[closed]
+            loop_clients = self.loops[loop] = LoopClients()
+            loop_clients.closer = loop.create_task(self.close_with_loop(loop, loop_clients))
+            return loop_clients
+
+    async def close_with_loop(self, loop: asyncio.AbstractEventLoop, loop_clients: LoopClients):
+        # waits until asyncio.run() cancels the remaining tasks of the loop, then closes the clients while it still runs
+        try:
+            await loop.create_future()
+        finally:
+            with self.lock:
+                if self.loops.get(loop) is loop_clients:
+                    del self.loops[loop]
+            await loop_clients.aclose(self.log)
+
+    async def aclose(self):
+        """Close the async clients of the running loop."""
+        with self.lock:
+            loop_clients = self.loops.pop(asyncio.get_running_loop(), None)
+        if loop_clients is None:
+            return
+        loop_clients.closer.cancel()
+        await loop_clients.aclose(self.log)
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                try:
+                    client.close()
+                except Exception as e:
+                    self.log.warning(f"Error closing client: {e}")
+            if self.http_client is not None:
+                self.http_client.close()
+            self.http_client = None
+            self.clients = {}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_client_registry(config: dict, log: logging.Logger) -> ClientRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry(config, log)
+        return _registry
@@ -1,9 +1,13 @@
-# Install the following dependencies: azure.identity and azure-ai-inference
+# Install the following dependencies: azure.identity, azure-ai-inference and aiohttp
 import asyncio
 from azure.ai.inference import ChatCompletionsClient
+from azure.ai.inference.aio import ChatCompletionsClient as AsyncChatCompletionsClient
 from azure.ai.inference.models import SystemMessage, UserMessage, ChatCompletionsToolChoicePreset, ChatCompletionsToolDefinition, FunctionDefinition
 from azure.core.credentials import AzureKeyCredential
 from .base_model import BaseModel
+from ..deadline import DeadlineExceeded, wait_for_deadline
+from .client_registry import get_client_registry
+from .rate_limiter import get_rate_limiter
 import logging
 from openai import AzureOpenAI
 from typing import Iterable
@@ -15,16 +19,25 @@ from openai.types.chat import (
 
 from langchain_deepseek import ChatDeepSeek
 
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_CONCURRENCY = 32
+
 class DeepSeek(BaseModel):
     def __init__(self, config: dict, log: logging.Logger):
         super().__init__(config, log)
         self.client = None
+        self.registry = None
         self.model_name = None
+        self.max_connections = config.get("DS_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)
+        self.max_concurrency = config.get("DS_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
         self.setup_model()
 
 
     def ask(self, messages, 
             tools_definitions) -> ChatCompletion:
+        key, response = self.get_cached_response(messages, tools_definitions)
+        if response is not None:
+            return response
         try:
             response = self.client.complete(
                 messages=messages,
@@ -32,6 +45,7 @@ class DeepSeek(BaseModel):
                 tools=tools_definitions,
                 tool_choice=ChatCompletionsToolChoicePreset.AUTO,
             )
+            self.put_cached_response(key, response)
             return response
         except Exception as e:
             self.log.error(f"Error asking question: {e}")
@@ -39,32 +53,71 @@ class DeepSeek(BaseModel):
     
     async def aask(self, messages: Iterable[ChatCompletionMessageParam],
             tools_definitions: Iterable[ChatCompletionToolParam]) -> str:
+        key, response = self.get_cached_response(messages, tools_definitions)
+        if response is not None:
+            return response
+        return await self.acoalesce(key, messages, tools_definitions,
+                                    lambda: self._aask(messages, tools_definitions, key))
+
+    async def _aask(self, messages, tools_definitions, key):
+        try:
+            client = await self.get_async_client()
+            # 使用原生异步客户端，按部署的 RPM/TPM 限流并自适应并发 (未启用时由信号量限制)，不占用线程池
+            response = await self.acall_limited(messages, tools_definitions, lambda: wait_for_deadline(client.complete(
+                messages=messages,
+                model=self.model_name,
+                tools=tools_definitions,
+                tool_choice=ChatCompletionsToolChoicePreset.AUTO,
+            )))
+            self.put_cached_response(key, response)
+            return response
+        except DeadlineExceeded:
+            self.log.warning("Model call cancelled at the request deadline")
+            raise
+        except Exception as e:
+            self.log.error(f"Error asking question: {e}")
+            return None
+
+    async def astream(self, messages: Iterable[ChatCompletionMessageParam],
+            tools_definitions: Iterable[ChatCompletionToolParam]):
         try:
-            loop = asyncio.get_event_loop()
-            # 将同步方法包装到线程池中执行
-            response = await loop.run_in_executor(
-                None,  # 使用默认线程池
-                lambda: self.client.complete(
+            client = await self.get_async_client()
+            async with self.limited(messages, tools_definitions):
+                chunks = await wait_for_deadline(client.complete(
                     messages=messages,
                     model=self.model_name,
                     tools=tools_definitions,
                     tool_choice=ChatCompletionsToolChoicePreset.AUTO,
-                )
-            )
-            return response
+                    stream=True,
+                ))
+                async for event in self.astream_chunks(chunks):
+                    yield event
         except Exception as e:
-            self.log.error(f"Error asking question: {e}")
-            return None
-    
+            # a stream that fails part way has no answer to fall back on, the caller reports the error
+            self.log.error(f"Error streaming question: {e}")
+            raise
+
+    async def get_async_client(self) -> AsyncChatCompletionsClient:
+        return self.registry.get_deepseek_async_client(
+            self.config["AZURE_DS_ENDPOINT"], self.model_name, self.config["AZURE_DS_KEY"], self.max_connections)
+
+    def get_concurrency_guard(self):
+        return self.get_semaphore()
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        # the concurrency limit is shared by all DeepSeek instances of the same deployment
+        return self.registry.get_semaphore(self.config["AZURE_DS_ENDPOINT"], self.model_name, self.max_concurrency)
+
     def setup_model(self):
         try:
             endpoint = self.config["AZURE_DS_ENDPOINT"]
             model_name = self.config["AZURE_DS_NAME"]
             key = self.config["AZURE_DS_KEY"]
             version = self.config["DS_API_VERSION"]
-            self.client  = ChatCompletionsClient(endpoint=endpoint, credential=AzureKeyCredential(key))
-            
+            self.registry = get_client_registry(self.config, self.log)
+            self.client = self.registry.get_deepseek_client(endpoint, model_name, key)
             self.model_name = model_name
+            self.limiter = get_rate_limiter(self.config, self.log).get(endpoint, model_name, "DS", self.max_concurrency)
         except Exception as e:
             self.log.error(f"Error setting up model: {e}")
             return None
\ No newline at end of file
@@ -1,6 +1,9 @@
 from .base_model import BaseModel
+from ..deadline import DeadlineExceeded, wait_for_deadline
 import logging
 from openai import AzureOpenAI, AsyncAzureOpenAI
+from .client_registry import get_client_registry
+from .rate_limiter import get_rate_limiter, DEFAULT_MAX_CONCURRENCY
 from typing import Iterable
 from openai.types.chat import (
     ChatCompletionMessageParam,
@@ -12,13 +15,16 @@ class OpenAI(BaseModel):
     def __init__(self, config: dict, log: logging.Logger):
         super().__init__(config, log)
         self.client = None
-        self.client_async = None
+        self.registry = None
         self.model_name = None
         self.setup_model()
 
 
     def ask(self, messages: Iterable[ChatCompletionMessageParam], 
             tools_definitions: Iterable[ChatCompletionToolParam]) -> ChatCompletion:
+        key, response = self.get_cached_response(messages, tools_definitions)
+        if response is not None:
+            return response
         try:
             response = self.client.chat.completions.create(
                 model=self.model_name,
@@ -26,6 +32,7 @@ class OpenAI(BaseModel):
                 tools=tools_definitions,
                 tool_choice="auto",
             )
+            self.put_cached_response(key, response)
             return response
         except Exception as e:
             self.log.error(f"Error asking question: {e}")
@@ -33,34 +40,70 @@ class OpenAI(BaseModel):
         
     async def aask(self, messages: Iterable[ChatCompletionMessageParam],
             tools_definitions: Iterable[ChatCompletionToolParam]) -> str:
+        key, response = self.get_cached_response(messages, tools_definitions)
+        if response is not None:
+            return response
+        return await self.acoalesce(key, messages, tools_definitions,
+                                    lambda: self._aask(messages, tools_definitions, key))
+
+    async def _aask(self, messages, tools_definitions, key):
         try:
-            response = await self.client_async.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                tools=tools_definitions,
-                tool_choice="auto",
-            )
+            response = await self.acall_limited(messages, tools_definitions, lambda: wait_for_deadline(
+                self.get_async_client().chat.completions.create(
+                    model=self.model_name,
+                    messages=messages,
+                    tools=tools_definitions,
+                    tool_choice="auto",
+                )))
+            self.put_cached_response(key, response)
             return response
+        except DeadlineExceeded:
+            self.log.warning("Model call cancelled at the request deadline")
+            raise
         except Exception as e:
             self.log.error(f"Error asking question: {e}")
             return None
-    
+
+    async def astream(self, messages: Iterable[ChatCompletionMessageParam],
+            tools_definitions: Iterable[ChatCompletionToolParam]):
+        try:
+            async with self.limited(messages, tools_definitions):
+                chunks = await wait_for_deadline(self.get_async_client().chat.completions.create(
+                    model=self.model_name,
+                    messages=messages,
+                    tools=tools_definitions,
+                    tool_choice="auto",
+                    stream=True,
+                ))
+                async for event in self.astream_chunks(chunks):
+                    yield event
+        except Exception as e:
+            # a stream that fails part way has no answer to fall back on, the caller reports the error
+            self.log.error(f"Error streaming question: {e}")
+            raise
     
     def setup_model(self):
         try:
-            self.client = AzureOpenAI(
-                azure_endpoint=self.config["AZURE_OPENAI_ENDPOINT"],  # The base URL for your Azure OpenAI resource. e.g. "https://<your resource name>.openai.azure.com"
-                api_key=self.config["AZURE_OPENAI_KEY"],  # The API key for your Azure OpenAI resource.
-                api_version=self.config["OPENAI_API_VERSION"],  # This version supports function calling
-            )
-
-            self.client_async = AsyncAzureOpenAI(
-                azure_endpoint=self.config["AZURE_OPENAI_ENDPOINT"],  # The base URL for your Azure OpenAI resource. e.g. "https://<your resource name>.openai.azure.com"
-                api_key=self.config["AZURE_OPENAI_KEY"],  # The API key for your Azure OpenAI resource.
-                api_version=self.config["OPENAI_API_VERSION"],  # This version supports function calling
-            )
-
+            # clients are shared per endpoint and deployment, so every worker reuses the same connection pool
+            self.registry = get_client_registry(self.config, self.log)
             self.model_name = self.config["MODEL_NAME"] # You need to ensure the version of the model you are using supports the function calling feature
+            self.client = self.registry.get_openai_client(
+                self.config["AZURE_OPENAI_ENDPOINT"],  # The base URL for your Azure OpenAI resource. e.g. "https://<your resource name>.openai.azure.com"
+                self.model_name,
+                self.config["AZURE_OPENAI_KEY"],  # The API key for your Azure OpenAI resource.
+                self.config["OPENAI_API_VERSION"],  # This version supports function calling
+            )
+            self.limiter = get_rate_limiter(self.config, self.log).get(
+                self.config["AZURE_OPENAI_ENDPOINT"], self.model_name, "OPENAI",
+                self.config.get("OPENAI_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
         except Exception as e:
             self.log.error(f"Error setting up model: {e}")
             return None
+
+    def get_async_client(self) -> AsyncAzureOpenAI:
+        return self.registry.get_openai_async_client(
+            self.config["AZURE_OPENAI_ENDPOINT"],
+            self.model_name,
+            self.config["AZURE_OPENAI_KEY"],
+            self.config["OPENAI_API_VERSION"],
+        )
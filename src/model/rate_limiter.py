@@ -0,0 +1,261 @@
+# Client-side rate limiting per model deployment, shared by all model instances of the process.
+# Azure deployments enforce requests and tokens per minute, so every call first takes one request from an RPM
+# token bucket and its estimated tokens (prompt, tools and expected output) from a TPM bucket; the estimate is
+# corrected with the usage the response reports. Buckets hold a burst of RATE_LIMIT_BURST_SECONDS of quota,
+# since the service evaluates quotas over short windows.
+# Concurrency adapts AIMD-style: it grows by one per round of successful calls and is cut multiplicatively on
+# a 429 or when latency passes RATE_LIMIT_LATENCY_TARGET. A 429 blocks the whole deployment for its Retry-After.
+# State is guarded by a thread lock and waiters poll, so the request loop and the summarizer loop can share it.
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from openai import APIConnectionError
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from ..deadline import DeadlineExceeded, remaining
+from token_counter import count_message_tokens, count_tokens
+
+DEFAULT_OUTPUT_TOKENS = 512
+DEFAULT_BURST_SECONDS = 10
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_LATENCY_TARGET = 60
+THROTTLE_DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+MAX_BACKOFF = 30
+POLL_INTERVAL = 0.05
+THROTTLE_STATUS = 429
+RETRY_STATUS = (408, THROTTLE_STATUS, 500, 502, 503, 504)
+
+def get_retry_after(error: Exception):
+    """Seconds the service asked to wait in the Retry-After headers of error, None if it did not say."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms")
+        if value:
+            return float(value) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # an HTTP date
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except Exception:
+        return None
+
+def is_throttled(error: BaseException) -> bool:
+    return getattr(error, "status_code", None) == THROTTLE_STATUS
+
+def is_retryable(error: BaseException) -> bool:
+    """Throttling, server errors and lost connections are worth another try."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUS
+    return isinstance(error, (APIConnectionError, ServiceRequestError, ServiceResponseError))
+
+def get_usage_tokens(response):
+    return getattr(getattr(response, "usage", None), "total_tokens", None)
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second up to burst_seconds of it; 0 per minute is unlimited."""
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60
+        self.capacity = self.rate * burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if not self.rate:
+            return 0
+        # a request larger than the bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        return max(amount - self.level, 0) / self.rate
+
+    def take(self, amount: float):
+        if self.rate:
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """Give back (positive) or charge (negative) tokens once the real usage is known, the level may go below 0."""
+        if self.rate:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class Permit:
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        # set by the caller from the response usage
+        self.used_tokens = None
+
+
+class DeploymentLimiter:
+    def __init__(self, name: str, rpm: float, tpm: float, max_concurrency: int, config: dict):
+        self.name = name
+        burst_seconds = config.get("RATE_LIMIT_BURST_SECONDS", DEFAULT_BURST_SECONDS)
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        self.output_tokens = config.get("RATE_LIMIT_OUTPUT_TOKENS", DEFAULT_OUTPUT_TOKENS)
+        self.latency_target = config.get("RATE_LIMIT_LATENCY_TARGET", DEFAULT_LATENCY_TARGET)
+        self.min_concurrency = max(config.get("RATE_LIMIT_MIN_CONCURRENCY", DEFAULT_MIN_CONCURRENCY), 1)
+        self.max_concurrency = max(max_concurrency, self.min_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.active = 0
+        self.blocked_until = 0.0
+        self.throttle_streak = 0
+        self.last_decrease = 0.0
+        self.latency = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "waits": 0, "wait_time": 0.0, "estimated_tokens": 0,
+                      "used_tokens": 0, "decreases": 0}
+
+    def estimate(self, messages, tools_definitions) -> int:
+        """Tokens a call will count against TPM: prompt, tool definitions and the expected output."""
+        tokens = sum(count_message_tokens(message) for message in messages or [])
+        if tools_definitions:
+            tokens += count_tokens(json.dumps(tools_definitions, ensure_ascii=False, separators=(",", ":")))
+        return tokens + self.output_tokens
+
+    def try_acquire(self, tokens: int) -> float:
+        """Take a slot and the quota of a call, or tell how long to wait before trying again."""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.active >= int(self.limit):
+                return POLL_INTERVAL
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.active += 1
+            self.stats["requests"] += 1
+            self.stats["estimated_tokens"] += tokens
+            return 0
+
+    async def acquire(self, tokens: int):
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                break
+            left = remaining()
+            if left is not None and wait > left:
+                raise DeadlineExceeded(f"Rate limit of {self.name} needs a {wait:.1f}s wait, {left:.1f}s left")
+            await asyncio.sleep(wait)
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            with self.lock:
+                self.stats["waits"] += 1
+                self.stats["wait_time"] += waited
+
+    def release(self, permit: Permit, latency: float, error: BaseException = None):
+        throttled = error is not None and is_throttled(error)
+        with self.lock:
+            now = time.monotonic()
+            self.active -= 1
+            if permit.used_tokens is not None:
+                self.tokens.adjust(permit.tokens - permit.used_tokens)
+                self.stats["used_tokens"] += permit.used_tokens
+            if error is not None and not throttled:
+                # failures and cancellations say nothing about the quota
+                return
+            if throttled:
+                self.stats["throttled"] += 1
+                self.throttle_streak += 1
+                # a rejected call does not count against the quota
+                self.tokens.adjust(permit.tokens)
+                self.decrease(now, THROTTLE_DECREASE)
+                retry_after = get_retry_after(error)
+                if retry_after is None:
+                    retry_after = min(2 ** self.throttle_streak, MAX_BACKOFF)
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                return
+            self.throttle_streak = 0
+            self.latency = latency if not self.latency else self.latency * 0.8 + latency * 0.2
+            if self.latency_target and latency > self.latency_target:
+                self.decrease(now, LATENCY_DECREASE)
+            else:
+                # additive increase, about one more slot per round of limit calls
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def decrease(self, now: float, factor: float):
+        # calls of one round fail together, cut once per round
+        if now - self.last_decrease < max(self.latency, 1):
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * factor)
+        self.stats["decreases"] += 1
+
+    @asynccontextmanager
+    async def slot(self, tokens: int):
+        """Hold a slot and the quota of one call, the caller sets permit.used_tokens from the response."""
+        await self.acquire(tokens)
+        permit = Permit(tokens)
+        start = time.monotonic()
+        try:
+            yield permit
+        except BaseException as e:
+            self.release(permit, time.monotonic() - start, e)
+            raise
+        self.release(permit, time.monotonic() - start)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["limit"] = round(self.limit, 2)
+            stats["active"] = self.active
+            stats["latency"] = self.latency
+            stats["blocked_for"] = max(self.blocked_until - time.monotonic(), 0)
+        return stats
+
+
+class RateLimiter:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.enabled = config.get("RATE_LIMIT_ENABLED", True)
+        self.lock = threading.Lock()
+        self.deployments = {}
+
+    def get(self, endpoint: str, deployment: str, prefix: str, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        """The limiter of a deployment, quotas read from <prefix>_RPM and <prefix>_TPM; None when disabled."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            limiter = self.deployments.get((endpoint, deployment))
+            if limiter is None:
+                limiter = DeploymentLimiter(f"{prefix}:{deployment}", self.config.get(f"{prefix}_RPM", 0),
+                                            self.config.get(f"{prefix}_TPM", 0), max_concurrency, self.config)
+                self.deployments[(endpoint, deployment)] = limiter
+            return limiter
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            limiters = list(self.deployments.values())
+        return {limiter.name: limiter.get_stats() for limiter in limiters}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter(config: dict, log: logging.Logger) -> RateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(config, log)
+        return _limiter
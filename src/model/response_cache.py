@@ -0,0 +1,151 @@
+# Exact-match cache of model responses, keyed on a canonical hash of model name, messages and tool definitions.
+# Entries live in an in-memory LRU with a per-entry TTL, and optionally in a SQLite file so they survive restarts.
+# Turns that carry tool results are never cached, their answers depend on live local data.
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 300
+BYPASS_ROLES = ("tool", "function")
+
+class ResponseCache:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.enabled = config.get("RESPONSE_CACHE_ENABLED", True)
+        self.max_size = config.get("RESPONSE_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+        self.ttl = config.get("RESPONSE_CACHE_TTL", DEFAULT_CACHE_TTL)
+        self.db_path = config.get("RESPONSE_CACHE_DB", "")
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.db = None
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "bypasses": 0, "stores": 0}
+        if self.enabled and self.db_path:
+            self.setup_db()
+
+    def setup_db(self):
+        try:
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, expires REAL, value BLOB)")
+            self.db.execute("DELETE FROM response_cache WHERE expires < ?", (time.time(),))
+            self.db.commit()
+        except Exception as e:
+            self.log.error(f"Error opening response cache db {self.db_path}: {e}")
+            self.db = None
+
+    def make_key(self, model_name: str, messages, tools_definitions) -> str:
+        payload = json.dumps([model_name, messages, tools_definitions],
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def should_bypass(self, messages) -> bool:
+        for message in messages or []:
+            role = message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+            if role in BYPASS_ROLES:
+                return True
+        return False
+
+    def get(self, model_name: str, messages, tools_definitions):
+        """Return (key, response), key is None when the turn bypasses the cache."""
+        if not self.enabled:
+            return None, None
+        if self.should_bypass(messages):
+            with self.lock:
+                self.stats["bypasses"] += 1
+            return None, None
+        key = self.make_key(model_name, messages, tools_definitions)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, response = entry
+                if expires >= now:
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return key, response
+                del self.entries[key]
+            response = self.get_from_db(key, now)
+            if response is not None:
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+                return key, response
+            self.stats["misses"] += 1
+        return key, None
+
+    def put(self, key: str, response, ttl=None):
+        if key is None or response is None:
+            return
+        expires = time.time() + (ttl if ttl is not None else self.ttl)
+        with self.lock:
+            self.entries[key] = (expires, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self.stats["stores"] += 1
+            self.put_to_db(key, expires, response)
+
+    def get_from_db(self, key: str, now: float):
+        if self.db is None:
+            return None
+        try:
+            row = self.db.execute("SELECT expires, value FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            expires, value = row
+            if expires < now:
+                self.db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            response = pickle.loads(value)
+            # promote to memory tier
+            self.entries[key] = (expires, response)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return response
+        except Exception as e:
+            self.log.warning(f"Error reading response cache db: {e}")
+            return None
+
+    def put_to_db(self, key: str, expires: float, response):
+        if self.db is None:
+            return
+        try:
+            self.db.execute("INSERT OR REPLACE INTO response_cache (key, expires, value) VALUES (?, ?, ?)",
+                            (key, expires, pickle.dumps(response)))
+            self.db.commit()
+        except Exception as e:
+            self.log.warning(f"Error writing response cache db: {e}")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM response_cache")
+                self.db.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache(config: dict, log: logging.Logger) -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(config, log)
+        return _cache
@@ -0,0 +1,282 @@
+# Chat histories of many sessions, keyed by session id and persisted in SQLite (SQL_CONN_STR).
+# Hot sessions stay in a bounded in-memory LRU; every appended message, summary change and clear is queued
+# and written behind in batches by a background thread, so a request never waits on the disk.
+# Messages are stored compactly: the role as an integer, the token count, and the content zlib-compressed
+# when that saves space. Loading a session reads only the newest messages that fit its token budget.
+import time
+import zlib
+import atexit
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from langchain_core.messages import HumanMessage, AIMessage
+from chat_history import ChatHistory
+
+DEFAULT_SESSION_CACHE_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_FLUSH_BATCH = 200
+COMPRESS_MIN_BYTES = 256
+ROLE_USER = 0
+ROLE_AI = 1
+# the low bit of the flags column tells the content is compressed
+FLAG_COMPRESSED = 1
+
+def get_db_path(conn_str: str) -> str:
+    """SQL_CONN_STR as a SQLite file path, "sqlite:///data/chat.db" or a plain path."""
+    for prefix in ("sqlite:///", "sqlite://"):
+        if conn_str.startswith(prefix):
+            return conn_str[len(prefix):]
+    return conn_str
+
+def encode_content(text: str):
+    data = text.encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(data, 6)
+        if len(compressed) < len(data):
+            return compressed, FLAG_COMPRESSED
+    return data, 0
+
+def decode_content(data: bytes, flags: int) -> str:
+    if flags & FLAG_COMPRESSED:
+        data = zlib.decompress(data)
+    return data.decode("utf-8")
+
+
+class SessionChatHistory(ChatHistory):
+    """A ChatHistory that queues its changes to the session store."""
+    def __init__(self, config: dict, store: "SessionStore", session_id: str, next_seq: int = 0):
+        super().__init__(config)
+        self.store = store
+        self.session_id = session_id
+        self.next_seq = next_seq
+        self.loading = False
+
+    def append(self, message):
+        super().append(message)
+        if self.loading:
+            return
+        role = ROLE_USER if isinstance(message, HumanMessage) else ROLE_AI
+        self.store.queue_message(self.session_id, self.next_seq, role, self.tokens[-1], message.content)
+        self.next_seq += 1
+
+    def set_summary(self, summary: str):
+        super().set_summary(summary)
+        if not self.loading:
+            # the summary stands for every message before the first one still in memory
+            self.store.queue_summary(self.session_id, self.summary, self.next_seq - len(self.history))
+
+    def clear_history(self):
+        super().clear_history()
+        self.store.queue_clear(self.session_id)
+
+
+class SessionStore:
+    def __init__(self, config: dict, log: logging.Logger):
+        self.config = config
+        self.log = log
+        self.db_path = get_db_path(config.get("SQL_CONN_STR", "") or "")
+        self.max_sessions = config.get("SESSION_CACHE_SIZE", DEFAULT_SESSION_CACHE_SIZE)
+        self.flush_interval = config.get("SESSION_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)
+        self.flush_batch = config.get("SESSION_FLUSH_BATCH", DEFAULT_FLUSH_BATCH)
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        # one flush at a time, so batches land in the order they were queued
+        self.flush_lock = threading.Lock()
+        self.sessions = OrderedDict()
+        self.pending = []
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+        self.db = None
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0, "writes": 0, "flushes": 0}
+        if self.db_path:
+            self.setup_db()
+
+    def setup_db(self):
+        try:
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS chat_sessions "
+                            "(id TEXT PRIMARY KEY, summary TEXT NOT NULL DEFAULT '', start_seq INTEGER NOT NULL DEFAULT 0, updated REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS chat_messages "
+                            "(session_id TEXT, seq INTEGER, role INTEGER, tokens INTEGER, flags INTEGER, content BLOB, "
+                            "PRIMARY KEY (session_id, seq)) WITHOUT ROWID")
+            self.db.commit()
+        except Exception as e:
+            self.log.error(f"Error opening session db {self.db_path}: {e}")
+            self.db = None
+            return
+        self.thread = threading.Thread(target=self.run, name="session-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def get_history(self, session_id: str) -> ChatHistory:
+        """The chat history of a session, from the LRU or loaded from the db."""
+        with self.lock:
+            history = self.sessions.get(session_id)
+            if history is not None:
+                self.sessions.move_to_end(session_id)
+                self.stats["hits"] += 1
+                return history
+        history = self.load(session_id)
+        with self.lock:
+            # another request may have loaded it meanwhile
+            current = self.sessions.get(session_id)
+            if current is not None:
+                self.sessions.move_to_end(session_id)
+                return current
+            self.sessions[session_id] = history
+            while len(self.sessions) > self.max_sessions:
+                # the queued writes of an evicted session stay queued, the db is the source of truth
+                self.sessions.popitem(last=False)
+                self.stats["evictions"] += 1
+        return history
+
+    def load(self, session_id: str) -> SessionChatHistory:
+        history = SessionChatHistory(self.config, self, session_id)
+        if self.db is None:
+            return history
+        # queued writes of this session must land before it is read back
+        self.flush()
+        with self.db_lock:
+            row = self.db.execute("SELECT summary, start_seq FROM chat_sessions WHERE id = ?", (session_id,)).fetchone()
+            last = self.db.execute("SELECT MAX(seq) FROM chat_messages WHERE session_id = ?", (session_id,)).fetchone()
+            # newest first, stop reading once the token budget is filled; messages folded into the summary are skipped
+            cursor = self.db.execute("SELECT role, tokens, flags, content FROM chat_messages "
+                                     "WHERE session_id = ? AND seq >= ? ORDER BY seq DESC",
+                                     (session_id, row[1] if row else 0))
+            rows = []
+            used = 0
+            for role, tokens, flags, content in cursor:
+                if used + tokens > history.max_tokens:
+                    break
+                used += tokens
+                rows.append((role, flags, content))
+            cursor.close()
+        history.loading = True
+        try:
+            if row and row[0]:
+                history.set_summary(row[0])
+            for role, flags, content in reversed(rows):
+                text = decode_content(content, flags)
+                history.append(HumanMessage(content=text) if role == ROLE_USER else AIMessage(content=text))
+            history.trim()
+        finally:
+            history.loading = False
+        history.next_seq = (last[0] + 1) if last and last[0] is not None else 0
+        with self.lock:
+            self.stats["loads"] += 1
+        return history
+
+    def queue(self, operation: tuple):
+        if self.db is None:
+            return
+        with self.lock:
+            self.pending.append(operation)
+            full = len(self.pending) >= self.flush_batch
+        if full:
+            self.wakeup.set()
+
+    def queue_message(self, session_id: str, seq: int, role: int, tokens: int, text: str):
+        content, flags = encode_content(text)
+        self.queue(("message", session_id, seq, role, tokens, flags, content))
+
+    def queue_summary(self, session_id: str, summary: str, start_seq: int):
+        self.queue(("summary", session_id, summary, start_seq))
+
+    def queue_clear(self, session_id: str):
+        self.queue(("clear", session_id))
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write the queued operations in one transaction, consecutive messages with one executemany."""
+        with self.flush_lock:
+            with self.lock:
+                operations, self.pending = self.pending, []
+            if operations and self.db is not None:
+                self.write(operations)
+
+    def write(self, operations: list):
+        now = time.time()
+        try:
+            with self.db_lock, self.db:
+                messages = []
+                touched = set()
+                for operation in operations:
+                    kind, session_id = operation[0], operation[1]
+                    touched.add(session_id)
+                    if kind == "message":
+                        messages.append(operation[1:])
+                        continue
+                    if messages:
+                        self.write_messages(messages)
+                        messages = []
+                    if kind == "summary":
+                        self.db.execute("INSERT INTO chat_sessions (id, summary, start_seq, updated) VALUES (?, ?, ?, ?) "
+                                        "ON CONFLICT(id) DO UPDATE SET summary = excluded.summary, "
+                                        "start_seq = excluded.start_seq, updated = excluded.updated",
+                                        (session_id, operation[2], operation[3], now))
+                    elif kind == "clear":
+                        self.db.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+                        self.db.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
+                        touched.discard(session_id)
+                if messages:
+                    self.write_messages(messages)
+                self.db.executemany("INSERT INTO chat_sessions (id, updated) VALUES (?, ?) "
+                                    "ON CONFLICT(id) DO UPDATE SET updated = excluded.updated",
+                                    [(session_id, now) for session_id in touched])
+            with self.lock:
+                self.stats["writes"] += len(operations)
+                self.stats["flushes"] += 1
+        except Exception as e:
+            self.log.error(f"Error writing {len(operations)} chat operations to {self.db_path}: {e}")
+
+    def write_messages(self, messages: list):
+        self.db.executemany("INSERT OR REPLACE INTO chat_messages (session_id, seq, role, tokens, flags, content) "
+                            "VALUES (?, ?, ?, ?, ?, ?)", messages)
+
+    def reload(self, session_id: str) -> ChatHistory:
+        """The history of a session as stored, for processes that share the db."""
+        with self.lock:
+            self.sessions.pop(session_id, None)
+        return self.get_history(session_id)
+
+    def delete_session(self, session_id: str):
+        with self.lock:
+            history = self.sessions.pop(session_id, None)
+        if history is not None:
+            history.clear_history()
+        else:
+            self.queue_clear(session_id)
+
+    def close(self):
+        self.stopped = True
+        self.wakeup.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+        self.flush()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["sessions"] = len(self.sessions)
+            stats["pending"] = len(self.pending)
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_session_store(config: dict, log: logging.Logger) -> SessionStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore(config, log)
+        return _store
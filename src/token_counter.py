@@ -0,0 +1,76 @@
+# Token counting for prompt budgets.
+# tiktoken is used when it is installed and its encoding can be loaded, otherwise a cheap estimate:
+# one token per CJK character and about four characters per token for the rest.
+# The first load of an encoding may download it, so it is loaded in a background thread started at startup
+# (preload_encoder()); counts fall back to the estimate until it is ready and never wait for the download.
+import re
+import threading
+
+DEFAULT_ENCODING = "cl100k_base"
+# seconds startup waits for the encoding before going on with the estimate
+ENCODER_LOAD_TIMEOUT = 2
+# every chat message costs a few tokens for its role and separators
+MESSAGE_OVERHEAD = 4
+CJK_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+_encoder = None
+_encoder_loader = None
+_encoder_lock = threading.Lock()
+
+def load_encoder(encoding: str):
+    global _encoder
+    try:
+        import tiktoken
+        _encoder = tiktoken.get_encoding(encoding)
+    except Exception:
+        # not installed, or the encoding file cannot be downloaded
+        _encoder = None
+
+def preload_encoder(encoding: str = DEFAULT_ENCODING, timeout: float = ENCODER_LOAD_TIMEOUT):
+    """Start loading the encoding once, waiting at most timeout seconds for it."""
+    global _encoder_loader
+    with _encoder_lock:
+        if _encoder_loader is None:
+            _encoder_loader = threading.Thread(target=load_encoder, args=(encoding,), name="encoder-loader", daemon=True)
+            _encoder_loader.start()
+        loader = _encoder_loader
+    if timeout:
+        loader.join(timeout)
+
+def get_encoder():
+    """The loaded encoding, None while it is loading or when it is unavailable."""
+    if _encoder_loader is None:
+        preload_encoder(timeout=0)
+    return _encoder
+
+def estimate_tokens(text: str) -> int:
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+def count_message_tokens(message) -> int:
+    """Tokens of a langchain message or an openai message dict, content plus overhead."""
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+    if not isinstance(content, str):
+        content = str(content or "")
+    return count_tokens(content) + MESSAGE_OVERHEAD
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the head of a text within max_tokens, marking the cut."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoder = get_encoder()
+    if encoder is not None:
+        return encoder.decode(encoder.encode(text, disallowed_special=())[:max_tokens]) + " ...[truncated]"
+    # shrink by the measured ratio until the estimate fits
+    cut = len(text)
+    while cut > 0 and estimate_tokens(text[:cut]) > max_tokens:
+        cut = int(cut * max_tokens / estimate_tokens(text[:cut])) - 1
+    return text[:max(cut, 0)] + " ...[truncated]"
@@ -0,0 +1,24 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+
+# the app imports its top-level modules (chat_history, session_store, ...) from src, like the entry points do
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "src")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def run_bounded(coroutine, limit: float = 15):
+    """Run coroutine on a loop of its own thread, a hung run fails the test instead of hanging it."""
+    result = {}
+    def target():
+        result["value"] = asyncio.run(coroutine)
+    thread = threading.Thread(target=target, daemon=True)
+    start = time.monotonic()
+    thread.start()
+    thread.join(limit)
+    assert not thread.is_alive(), f"still running after {limit}s"
+    return result["value"], time.monotonic() - start
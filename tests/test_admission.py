@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import pytest
+from src.admission import AdmissionController, ADMISSION_REQUEST, ADMISSION_WORKER, ServiceUnavailable, session_scope
+from src.aiservice import AiService, SERVICE_MODE_SINGLE
+from src.deadline import DeadlineExceeded, deadline_scope
+
+LOG = logging.getLogger("test")
+
+async def hold(controller: AdmissionController, stage: str, session: str, order: list, release: asyncio.Event):
+    with session_scope(session):
+        async with controller.slot(stage):
+            order.append(session)
+            await release.wait()
+
+
+def test_waiters_are_served_round_robin_across_sessions():
+    controller = AdmissionController({"ADMISSION_WORKER_CONCURRENCY": 1}, LOG)
+    async def run():
+        order = []
+        release = asyncio.Event()
+        release.set()
+        gate = asyncio.Event()
+        first = asyncio.ensure_future(hold(controller, ADMISSION_WORKER, "a", order, gate))
+        await asyncio.sleep(0)
+        # session a fans out before b asks once
+        waiters = [asyncio.ensure_future(hold(controller, ADMISSION_WORKER, "a", order, release)) for _ in range(3)]
+        await asyncio.sleep(0)
+        waiters.append(asyncio.ensure_future(hold(controller, ADMISSION_WORKER, "b", order, release)))
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, *waiters)
+        return order
+    assert asyncio.run(run()) == ["a", "a", "b", "a", "a"]
+
+
+def test_full_queue_rejects_with_retry_after():
+    controller = AdmissionController({"ADMISSION_WORKER_CONCURRENCY": 1, "ADMISSION_WORKER_QUEUE": 1}, LOG)
+    async def run():
+        gate = asyncio.Event()
+        running = [asyncio.ensure_future(hold(controller, ADMISSION_WORKER, "a", [], gate)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(ServiceUnavailable) as e:
+            async with controller.slot(ADMISSION_WORKER):
+                pass
+        assert e.value.retry_after >= 1
+        # a new request is turned away at the door while a stage behind it is full
+        with pytest.raises(ServiceUnavailable):
+            async with controller.slot(ADMISSION_REQUEST):
+                pass
+        gate.set()
+        await asyncio.gather(*running)
+    asyncio.run(run())
+    assert controller.get_stats()[ADMISSION_WORKER]["rejected"] == 2
+
+
+def test_deadline_while_queued():
+    controller = AdmissionController({"ADMISSION_WORKER_CONCURRENCY": 1}, LOG)
+    async def run():
+        gate = asyncio.Event()
+        holder = asyncio.ensure_future(hold(controller, ADMISSION_WORKER, "a", [], gate))
+        await asyncio.sleep(0)
+        with deadline_scope(0.05):
+            with pytest.raises(DeadlineExceeded):
+                async with controller.slot(ADMISSION_WORKER):
+                    pass
+        gate.set()
+        await holder
+        # the expired waiter left the queue
+        assert controller.get_stats()[ADMISSION_WORKER]["queued"] == 0
+    asyncio.run(run())
+
+
+def test_queued_request_of_a_busy_session_holds_no_request_slot(monkeypatch):
+    class GatedAssistant:
+        def __init__(self, session_id):
+            self.session_id = session_id
+        async def aask(self, question):
+            started.append(question)
+            await gates[question].wait()
+            return question
+    monkeypatch.setattr(AiService, "create_assistant", lambda self, session_id: GatedAssistant(session_id))
+    config = {"SERVICE_MODE": SERVICE_MODE_SINGLE, "SERVICE_COALESCE_ENABLED": False, "ADMISSION_REQUEST_CONCURRENCY": 2}
+    service = AiService(config, LOG)
+    service.admission = AdmissionController(config, LOG)
+    started = []
+    gates = {}
+    async def run():
+        for question in ("a1", "a2", "b1"):
+            gates[question] = asyncio.Event()
+        a1 = asyncio.ensure_future(service.ask("a1", "a"))
+        await asyncio.sleep(0.01)
+        # a2 waits for session a, b1 gets the second slot
+        a2 = asyncio.ensure_future(service.ask("a2", "a"))
+        await asyncio.sleep(0.01)
+        b1 = asyncio.ensure_future(service.ask("b1", "b"))
+        await asyncio.sleep(0.01)
+        assert started == ["a1", "b1"]
+        for gate in gates.values():
+            gate.set()
+        return [result["answer"] for result in await asyncio.gather(a1, a2, b1)]
+    assert asyncio.run(run()) == ["a1", "a2", "b1"]
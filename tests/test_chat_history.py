@@ -0,0 +1,76 @@
+import time
+import threading
+import pytest
+import token_counter
+from langchain_core.messages import AIMessage, HumanMessage
+from chat_history import ChatHistory
+from token_counter import MESSAGE_OVERHEAD, count_tokens, estimate_tokens, truncate_to_tokens
+
+# 40 ascii characters estimate to 10 tokens, a message of them costs 14 and a turn 28
+TEXT = "a" * 40
+TURN_TOKENS = 2 * (10 + MESSAGE_OVERHEAD)
+
+@pytest.fixture(autouse=True)
+def estimate(monkeypatch):
+    monkeypatch.setattr(token_counter, "get_encoder", lambda: None)
+
+def add_turns(history: ChatHistory, count: int):
+    for i in range(count):
+        history.add_user_message(f"{i}" + TEXT[1:])
+        history.add_ai_message(f"{i}" + TEXT[1:])
+
+
+def test_oldest_whole_turns_are_dropped_over_the_budget():
+    history = ChatHistory({"HISTORY_MAX_TOKENS": 2 * TURN_TOKENS + 4})
+    add_turns(history, 3)
+    messages = history.get_full_history()
+    assert [type(m) for m in messages] == [HumanMessage, AIMessage, HumanMessage, AIMessage]
+    assert messages[0].content.startswith("1")
+    assert history.get_token_count() == 2 * TURN_TOKENS
+
+
+def test_reserved_tokens_pin_the_system_prompt_and_question():
+    history = ChatHistory({"HISTORY_MAX_TOKENS": 2 * TURN_TOKENS})
+    add_turns(history, 2)
+    # the caller reserves the tokens of its system prompt and of the question
+    messages = history.get_full_history(reserved_tokens=TURN_TOKENS)
+    assert [m.content[0] for m in messages] == ["1", "1"]
+    # only the last answer would fit, it is never kept without its question
+    assert history.get_full_history(reserved_tokens=TURN_TOKENS + 10) == []
+    assert len(history.get_full_history()) == 4
+
+
+def test_max_history_len_caps_the_message_count():
+    history = ChatHistory({"MAX_HISTORY_LEN": 4})
+    add_turns(history, 5)
+    assert [m.content[0] for m in history.get_full_history()] == ["3", "3", "4", "4"]
+
+
+def test_estimate_truncates_long_text_within_the_budget():
+    text = "磁盘使用率" * 100 + "disk usage " * 100
+    truncated = truncate_to_tokens(text, 50)
+    assert truncated.endswith(" ...[truncated]") and text.startswith(truncated[:-len(" ...[truncated]")])
+    assert estimate_tokens(truncated[:-len(" ...[truncated]")]) <= 50
+    assert truncate_to_tokens("short", 50) == "short"
+    # one message never takes more than its share of the budget
+    history = ChatHistory({"HISTORY_MAX_TOKENS": 100})
+    history.add_user_message(text)
+    assert history.get_token_count() <= 50 + count_tokens(" ...[truncated]") + MESSAGE_OVERHEAD
+
+
+def test_counting_does_not_wait_for_the_encoder_to_load(monkeypatch):
+    monkeypatch.undo()
+    loaded = threading.Event()
+    encoder = type("Encoder", (), {"encode": lambda self, text, disallowed_special: text.split()})()
+    def load(encoding):
+        loaded.wait(5)
+        token_counter._encoder = encoder
+    monkeypatch.setattr(token_counter, "load_encoder", load)
+    monkeypatch.setattr(token_counter, "_encoder", None)
+    monkeypatch.setattr(token_counter, "_encoder_loader", None)
+    start = time.monotonic()
+    assert count_tokens("disk usage of web01") == estimate_tokens("disk usage of web01")
+    assert time.monotonic() - start < 1
+    loaded.set()
+    token_counter._encoder_loader.join(5)
+    assert count_tokens("disk usage of web01") == 4
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import threading
+from src.model.client_registry import ClientRegistry
+
+LOG = logging.getLogger("test")
+ENDPOINT = "https://example.openai.azure.com"
+
+def get_client(registry: ClientRegistry):
+    return registry.get_openai_async_client(ENDPOINT, "gpt", "key", "2024-06-01")
+
+
+def test_client_reused_within_a_loop_and_closed_with_it():
+    registry = ClientRegistry({}, LOG)
+    async def run():
+        client = get_client(registry)
+        assert get_client(registry) is client
+        assert registry.get_semaphore(ENDPOINT, "ds", 2) is registry.get_semaphore(ENDPOINT, "ds", 2)
+        return client, registry.loops[asyncio.get_running_loop()].http_client
+    client, http_client = asyncio.run(run())
+    assert not registry.loops
+    assert http_client.is_closed
+    # the next asyncio.run() builds a fresh client
+    other, _ = asyncio.run(run())
+    assert other is not client
+
+
+def test_loops_keep_their_own_clients():
+    registry = ClientRegistry({}, LOG)
+    background = asyncio.new_event_loop()
+    thread = threading.Thread(target=background.run_forever, daemon=True)
+    thread.start()
+    try:
+        async def get():
+            return get_client(registry)
+        background_client = asyncio.run_coroutine_threadsafe(get(), background).result(5)
+        async def run():
+            client = get_client(registry)
+            # using the background loop does not take the clients of this one away
+            assert asyncio.run_coroutine_threadsafe(get(), background).result(5) is background_client
+            assert get_client(registry) is client
+            return client
+        assert asyncio.run(run()) is not background_client
+        assert list(registry.loops) == [background]
+        assert not registry.loops[background].http_client.is_closed
+    finally:
+        asyncio.run_coroutine_threadsafe(registry.aclose(), background).result(5)
+        background.call_soon_threadsafe(background.stop)
+        thread.join(5)
+        background.close()
+    assert not registry.loops
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from src.aiservice import AiService, COALESCE_SCOPE_GLOBAL, SERVICE_MODE_SINGLE
+from src.coalescer import RequestCoalescer
+from chat_history import ChatHistory
+
+LOG = logging.getLogger("test")
+
+def counted(calls: list, seconds: float = 0.05, result: str = "ok"):
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(seconds)
+        return result
+    return work
+
+
+def test_identical_requests_run_once():
+    coalescer = RequestCoalescer({}, LOG, "TEST")
+    calls = []
+    async def run():
+        return await asyncio.gather(*(coalescer.run("key", counted(calls)) for _ in range(5)),
+                                    coalescer.run("other", counted(calls)))
+    assert asyncio.run(run()) == ["ok"] * 6
+    assert len(calls) == 2
+    assert coalescer.get_stats()["coalesced"] == 4
+
+
+def test_follower_keeps_the_run_when_the_leader_leaves():
+    coalescer = RequestCoalescer({}, LOG, "TEST")
+    calls = []
+    async def run():
+        leader = asyncio.ensure_future(coalescer.run("key", counted(calls)))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(coalescer.run("key", counted(calls)))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+    assert asyncio.run(run()) == "ok"
+    assert len(calls) == 1
+
+
+def test_run_is_cancelled_when_every_request_left():
+    coalescer = RequestCoalescer({}, LOG, "TEST")
+    async def run():
+        flight, _ = coalescer.join("key", counted([], 5))
+        waiter = asyncio.ensure_future(flight.result())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        return flight
+    flight = asyncio.run(run())
+    assert flight.abandoned and flight.task.cancelled()
+
+
+def test_stale_runs_are_not_joined_and_results_expire():
+    coalescer = RequestCoalescer({"TEST_COALESCE_MAX_AGE": 0.02, "TEST_COALESCE_RESULT_TTL": 0.05}, LOG, "TEST")
+    calls = []
+    async def run():
+        first = asyncio.ensure_future(coalescer.run("key", counted(calls, 0.05, "first")))
+        await asyncio.sleep(0.03)
+        # too old to join
+        second = await coalescer.run("key", counted(calls, 0.05, "second"))
+        # finished within the TTL
+        shared = await coalescer.run("key", counted(calls, 0, "third"))
+        await asyncio.sleep(0.06)
+        expired = await coalescer.run("key", counted(calls, 0, "fourth"))
+        return await first, second, shared, expired
+    assert asyncio.run(run()) == ("first", "second", "second", "fourth")
+    assert len(calls) == 3
+    assert coalescer.get_stats()["stale"] == 1
+
+
+def service_sessions(monkeypatch, config: dict):
+    monkeypatch.setattr(AiService, "create_assistant",
+                        lambda self, session_id: type("Assistant", (), {"chat_history": ChatHistory({})})())
+    service = AiService({"SERVICE_MODE": SERVICE_MODE_SINGLE, **config}, LOG)
+    fresh, other, talking = (service.get_session(session_id) for session_id in ("fresh", "other", "talking"))
+    talking.assistant.chat_history.add_user_message("web01 的内存够用吗")
+    talking.assistant.chat_history.add_ai_message("web01 还有 12GB")
+    return service, fresh, other, talking
+
+
+def test_sessions_do_not_share_runs_by_default(monkeypatch):
+    service, fresh, other, _ = service_sessions(monkeypatch, {})
+    assert service.coalesce_key("内存呢", fresh) != service.coalesce_key("内存呢", other)
+    assert service.coalesce_key("内存呢", fresh) == service.coalesce_key("内存呢？", fresh)
+
+
+def test_global_scope_shares_only_opening_questions(monkeypatch):
+    service, fresh, other, talking = service_sessions(monkeypatch, {"SERVICE_COALESCE_SCOPE": COALESCE_SCOPE_GLOBAL})
+    assert service.coalesce_key("内存呢", fresh) == service.coalesce_key("内存呢", other)
+    # a follow-up depends on the conversation before it
+    assert service.coalesce_key("内存呢", talking) != service.coalesce_key("内存呢", fresh)
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import pytest
+from src.executor.command_cache import CommandCache
+
+LOG = logging.getLogger("test")
+
+@pytest.fixture
+def cache():
+    return CommandCache({}, LOG)
+
+@pytest.mark.parametrize("script", [
+    "df -h",
+    "free -m | grep Mem | awk '{print $3}'",
+    "ps aux --sort=-%mem | head -5",
+    "mount",
+    "mount -l | grep ext4",
+    "hostname",
+    "hostname -I",
+    "journalctl -u nginx -n 50 --no-pager",
+    "ip a",
+    "ip addr",
+    "ip -s link",
+    "ip -4 route show",
+    "ip -br addr show dev eth0",
+    "ip route get 8.8.8.8",
+    "kubectl get pods -A",
+    "kubectl -n kube-system describe pod coredns",
+    "kubectl --context prod get nodes -o wide",
+    "kubectl config view",
+    "kubectl config current-context",
+    "kubectl cluster-info",
+    "systemctl status nginx",
+    "systemctl --no-pager list-units --type service",
+    "aws ec2 describe-instances --region us-east-1",
+    "aws --profile prod eks list-clusters",
+    "aws sts get-caller-identity",
+    "nvidia-smi",
+    "nvidia-smi --query-gpu=utilization.gpu --format=csv",
+    "nvidia-smi -i 0 -q",
+    "cat /proc/meminfo 2>/dev/null | sort | uniq -c",
+])
+def test_read_only_scripts_are_cached(cache, script):
+    assert cache.get_ttl(script)
+
+
+@pytest.mark.parametrize("script", [
+    # mutating forms of allowlisted tools
+    "mount /dev/sdb1 /mnt",
+    "mount -o remount,rw /",
+    "hostname web02",
+    "hostname -F /etc/hostname",
+    "date",
+    "date -s '2024-01-01 00:00'",
+    "journalctl --vacuum-size=100M",
+    "journalctl --rotate",
+    "ip link set eth0 down",
+    "ip addr add 10.0.0.2/24 dev eth0",
+    "ip -4 route add default via 10.0.0.1",
+    "ip -s -b /tmp/batch",
+    "ip route flush cache",
+    "kubectl config use-context prod",
+    "kubectl config set-context --current --namespace=x",
+    "kubectl delete pod web-0",
+    "kubectl -n default apply -f app.yaml",
+    "kubectl cluster-info dump --output-directory=/tmp/dump",
+    "systemctl stop status",
+    "systemctl restart nginx",
+    "aws sts assume-role --role-arn arn:aws:iam::1:role/x --role-session-name s",
+    "aws ec2 terminate-instances --instance-ids i-1",
+    "nvidia-smi -pm 1",
+    "nvidia-smi -r -i 0",
+    # filters that write files
+    "cat /etc/hosts | sed -i s/a/b/ /etc/hosts",
+    "ps aux | sort -o /tmp/ps.txt",
+    "ps aux | uniq - /tmp/out",
+    # unknown commands, redirections and shell tricks
+    "rm -rf /tmp/x",
+    "df -h > /tmp/df.txt",
+    "df -h; reboot",
+    "echo $(reboot)",
+    "sudo df -h",
+    "df -h | tee /tmp/df.txt",
+    "ps aux &",
+])
+def test_mutating_scripts_are_not_cached(cache, script):
+    assert cache.get_ttl(script) is None
+
+
+def test_ttl_is_the_shortest_of_the_sources(cache):
+    assert cache.get_ttl("lscpu && free -m | grep Mem") == 5
+
+
+def test_coalesced_call_runs_once_and_follower_survives_cancelled_leader(cache):
+    key, ttl = cache.make_key("pc", "execute_script", {"script": "df -h"})
+    calls = []
+
+    async def run():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def scenario():
+        results = await asyncio.gather(*(cache.aget_or_run(key, ttl, run) for _ in range(3)))
+        assert results == ["ok"] * 3 and len(calls) == 1
+        # a fresh key: the leader is cancelled, its follower runs on its own
+        other, _ = cache.make_key("pc", "execute_script", {"script": "free -m"})
+        leader = asyncio.ensure_future(cache.aget_or_run(other, ttl, run))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(cache.aget_or_run(other, ttl, run))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == "ok"
+    asyncio.run(scenario())
@@ -0,0 +1,72 @@
+import time
+import asyncio
+import logging
+import pytest
+from types import SimpleNamespace
+from chat_history import ChatHistory
+from src.assistant.MutiAssistant import MultiAssistant
+from src.const import STAGE_ANALYZE
+from src.deadline import (DeadlineExceeded, clamp_timeout, deadline_scope, gather_with_deadline, get_deadline,
+                          remaining, wait_for_deadline)
+from src.model.base_model import BaseModel, STREAM_DELTA
+
+LOG = logging.getLogger("test")
+
+def test_inner_scope_never_extends_the_outer_deadline():
+    assert remaining() is None
+    with deadline_scope(1):
+        outer = get_deadline()
+        with deadline_scope(10):
+            assert get_deadline() == outer
+        with deadline_scope(0.5):
+            assert get_deadline() < outer
+        assert clamp_timeout(30) <= 1
+    assert get_deadline() is None
+
+
+def test_gather_cancels_work_left_at_the_deadline():
+    async def run():
+        with deadline_scope(0.1):
+            return await gather_with_deadline([asyncio.sleep(0, "fast"), asyncio.sleep(5)])
+    fast, slow = asyncio.run(run())
+    assert fast == "fast"
+    assert isinstance(slow, DeadlineExceeded)
+
+
+def test_stalled_model_stream_stops_at_the_deadline():
+    async def chunks():
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="partial", tool_calls=None),
+                                                       finish_reason=None)])
+        await asyncio.sleep(5)
+    async def run():
+        events = []
+        with deadline_scope(0.2):
+            with pytest.raises(DeadlineExceeded):
+                async for event in BaseModel.astream_chunks(None, chunks()):
+                    events.append(event)
+        return events
+    start = time.monotonic()
+    assert asyncio.run(run()) == [{"type": STREAM_DELTA, "content": "partial"}]
+    assert time.monotonic() - start < 2
+
+
+def test_streamed_multi_assistant_answer_runs_under_the_request_deadline():
+    config = {"REQUEST_TIMEOUT": 0.2, "ROUTER_ENABLED": False}
+    assistant = MultiAssistant(ChatHistory(config), config, LOG)
+    class Manager:
+        chat_history = None
+        def set_chat_history(self, chat_history):
+            self.chat_history = chat_history
+        async def astream(self, question):
+            yield "analyzing"
+            await wait_for_deadline(asyncio.sleep(5))
+    assistant.set_manager(Manager())
+    async def run():
+        stages = []
+        with pytest.raises(DeadlineExceeded):
+            async for stage, _ in assistant.astream_with_scheduler("why is web01 slow?"):
+                stages.append(stage)
+        return stages
+    start = time.monotonic()
+    assert asyncio.run(run()) == [STAGE_ANALYZE]
+    assert time.monotonic() - start < 2
@@ -0,0 +1,27 @@
+import importlib
+import pytest
+
+ENTRY_MODULES = [
+    "src.cli",
+    "src.httpserver",
+    "src.aiservice",
+    "src.assist_creator",
+    "src.assistant.MyAssistant",
+    "src.assistant.MutiAssistant",
+    "src.executor.PCExecutor",
+    "src.executor.K8sExecutor",
+    "src.model.openai",
+    "src.model.deepseek_azure",
+]
+
+@pytest.mark.parametrize("name", ENTRY_MODULES)
+def test_entry_module_imports(name):
+    importlib.import_module(name)
+
+
+def test_model_package_loaded_once():
+    # a second copy of base_model would bring a second coalescer and rate limiter registry with it
+    from src.assistant import MyAssistant
+    from src.model.openai import OpenAI
+    assert MyAssistant.BaseModel is importlib.import_module("src.model.base_model").BaseModel
+    assert issubclass(OpenAI, MyAssistant.BaseModel)
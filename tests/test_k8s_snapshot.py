@@ -0,0 +1,102 @@
+import os
+import json
+import asyncio
+import logging
+import pytest
+from src.executor.k8s_snapshot import K8sSnapshot
+
+LOG = logging.getLogger("test")
+
+# a kubectl that prints "<dir>/<kind>.json", logs each call and takes DELAY seconds
+KUBECTL = """#!/bin/sh
+echo "$2" >> "{dir}/calls.log"
+sleep "${{KUBECTL_DELAY:-0}}"
+cat "{dir}/$2.json"
+"""
+
+def obj(namespace, name, owner=None, labels=None):
+    metadata = {"namespace": namespace, "name": name, "labels": labels or {}}
+    if owner:
+        metadata["ownerReferences"] = [{"kind": owner[0], "name": owner[1]}]
+    return {"metadata": metadata, "spec": {}, "status": {"phase": "Running"}}
+
+CLUSTER = {
+    "deployments": [obj("a", "web"), obj("b", "api")],
+    # the replicaset names collide across namespaces
+    "replicasets": [obj("a", "web-1", ("Deployment", "web")), obj("b", "web-1", ("Deployment", "api"))],
+    "statefulsets": [obj("a", "db")],
+    "pods": [
+        obj("a", "web-1-x", ("ReplicaSet", "web-1"), {"app": "web"}),
+        obj("b", "web-1-y", ("ReplicaSet", "web-1"), {"app": "api"}),
+        obj("a", "db-0", ("StatefulSet", "db"), {"app": "db"}),
+        obj("a", "agent-z", ("DaemonSet", "agent")),
+    ],
+}
+
+@pytest.fixture
+def kubectl(tmp_path, monkeypatch):
+    for kind, items in CLUSTER.items():
+        (tmp_path / f"{kind}.json").write_text(json.dumps({"items": items}))
+    script = tmp_path / "kubectl"
+    script.write_text(KUBECTL.format(dir=tmp_path))
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    return tmp_path
+
+def calls(kubectl) -> list:
+    log = kubectl / "calls.log"
+    return log.read_text().split() if log.exists() else []
+
+def names(result: dict) -> list:
+    return sorted(item["name"] for item in result["items"])
+
+
+def test_concurrent_queries_share_one_kubectl_call(kubectl, monkeypatch):
+    monkeypatch.setenv("KUBECTL_DELAY", "0.2")
+    snapshot = K8sSnapshot({}, LOG)
+    async def run():
+        return await asyncio.gather(*(snapshot.aquery("po", namespace="a") for _ in range(5)))
+    results = asyncio.run(run())
+    assert all(names(result) == ["agent-z", "db-0", "web-1-x"] for result in results)
+    assert calls(kubectl) == ["pods"]
+    # fresh within the TTL
+    snapshot.query("pods")
+    assert calls(kubectl) == ["pods"]
+
+
+def test_follower_refreshes_when_the_leader_is_cancelled(kubectl, monkeypatch):
+    monkeypatch.setenv("KUBECTL_DELAY", "0.3")
+    snapshot = K8sSnapshot({}, LOG)
+    async def run():
+        leader = asyncio.ensure_future(snapshot.aget("pods"))
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(snapshot.aget("pods"))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        return await follower
+    assert len(asyncio.run(run()).items) == 4
+    assert calls(kubectl) == ["pods", "pods"]
+
+
+@pytest.mark.parametrize("owner, expected", [
+    ("statefulset/db", ["db-0"]),
+    ("sts/db", ["db-0"]),
+    ("StatefulSet/db", ["db-0"]),
+    ("daemonset/agent", ["agent-z"]),
+    ("replicaset/web-1", ["web-1-x", "web-1-y"]),
+])
+def test_owner_kinds_are_canonical(kubectl, owner, expected):
+    assert names(K8sSnapshot({}, LOG).query("pods", owner=owner)) == expected
+
+
+def test_owner_chain_stays_in_its_namespace(kubectl):
+    snapshot = K8sSnapshot({}, LOG)
+    # replicaset web-1 of namespace b belongs to another deployment
+    assert names(snapshot.query("pods", owner="deployment/web")) == ["web-1-x"]
+    assert names(asyncio.run(snapshot.aquery("pods", owner="deploy/api"))) == ["web-1-y"]
+    assert names(snapshot.query("pods", namespace="b", owner="Deployment/web")) == []
+
+
+def test_invalid_owner_is_rejected(kubectl):
+    with pytest.raises(ValueError):
+        K8sSnapshot({}, LOG).query("pods", owner="web")
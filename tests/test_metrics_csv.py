@@ -0,0 +1,47 @@
+import json
+import asyncio
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+from src.executor import PCExecutor as pc_module
+from src.executor.PCExecutor import PCExecutor
+from src.executor.metrics_sampler import CSV_TIME_FORMAT, format_timestamp, read_metrics_csv
+
+LOG = logging.getLogger("test")
+
+def write_csv(path, count: int, start: float = 1747733242):
+    times = start + np.arange(count) * 5.0
+    memory = np.full(count, 40.0)
+    memory[count // 2:] = 80.0
+    with open(path, "w") as f:
+        f.write("Timestamp,Memory Usage (%)\n")
+        for moment, value in zip(times, memory):
+            f.write(f"{format_timestamp(moment)},{value}\n")
+    return times
+
+
+def test_timestamps_are_read_as_local_time(tmp_path):
+    path = tmp_path / "memory_usage.csv"
+    times = write_csv(path, 1000)
+    data = read_metrics_csv(str(path))
+    assert np.array_equal(data["time"], times)
+    assert data["time"][0] == datetime.strptime(format_timestamp(times[0]), CSV_TIME_FORMAT).timestamp()
+    assert data["memory"][-1] == 80.0
+
+
+def test_async_analysis_runs_off_the_event_loop(tmp_path, monkeypatch):
+    path = tmp_path / "memory_usage.csv"
+    write_csv(path, 2000)
+    threads = []
+    def read(source):
+        threads.append(threading.get_ident())
+        return read_metrics_csv(source)
+    monkeypatch.setattr(pc_module, "read_metrics_csv", read)
+    executor = PCExecutor({"METRICS_SAMPLER_ENABLED": False, "COMMAND_CACHE_ENABLED": False}, LOG)
+    async def run():
+        result = await executor.aexecute("analyze_metrics", source=str(path), metric="memory")
+        return result, threading.get_ident()
+    result, loop_thread = asyncio.run(run())
+    assert threads and threads[0] != loop_thread
+    assert json.loads(result)
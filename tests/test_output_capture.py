@@ -0,0 +1,35 @@
+from src.executor.output_capture import OutputCapture
+
+def feed_lines(capture: OutputCapture, count: int, chunk_lines: int = 7):
+    lines = [f"line {i}\n".encode() for i in range(count)]
+    for i in range(0, count, chunk_lines):
+        capture.feed(b"".join(lines[i:i + chunk_lines]))
+
+
+def test_small_output_is_kept_whole():
+    capture = OutputCapture(1024, 10)
+    capture.feed(b"a\nb")
+    assert not capture.is_truncated()
+    assert capture.get_text() == "a\nb"
+    assert capture.get_line_count() == 2
+
+
+def test_line_limit_keeps_head_and_tail():
+    capture = OutputCapture(1024 * 1024, 10)
+    feed_lines(capture, 100)
+    lines = capture.get_text().splitlines()
+    assert lines[:5] == [f"line {i}" for i in range(5)]
+    assert lines[-5:] == [f"line {i}" for i in range(95, 100)]
+    assert "90 lines" in lines[5]
+
+
+def test_byte_limit_bounds_memory_and_keeps_whole_lines():
+    capture = OutputCapture(200, 1000)
+    feed_lines(capture, 10000)
+    assert len(capture.head) + capture.tail_size < 400
+    lines = capture.get_text().splitlines()
+    assert lines[0] == "line 0"
+    assert lines[-1] == "line 9999"
+    markers = [line for line in lines if "output truncated" in line]
+    assert len(markers) == 1
+    assert all(line.startswith("line ") for line in lines if line not in markers)
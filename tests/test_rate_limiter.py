@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from src.deadline import DeadlineExceeded, deadline_scope
+from src.model.rate_limiter import DeploymentLimiter, TokenBucket, get_retry_after
+
+class Throttled(Exception):
+    status_code = 429
+    def __init__(self, retry_after: str = None):
+        super().__init__("429 Too Many Requests")
+        self.response = SimpleNamespace(headers={"retry-after": retry_after} if retry_after else {})
+
+async def call(limiter: DeploymentLimiter, error: Exception = None, tokens: int = 10):
+    async with limiter.slot(tokens):
+        if error is not None:
+            raise error
+
+
+def test_concurrency_grows_additively_and_halves_once_per_round_of_429s():
+    limiter = DeploymentLimiter("test", 0, 0, 8, {})
+    limiter.limit = 4.0
+    async def run():
+        for _ in range(4):
+            await call(limiter)
+        assert limiter.limit == pytest.approx(4.9, abs=0.1)
+        for _ in range(3):
+            with pytest.raises(Throttled):
+                await call(limiter, Throttled("0"))
+    asyncio.run(run())
+    assert limiter.limit == pytest.approx(2.45, abs=0.05)
+    assert limiter.get_stats()["throttled"] == 3 and limiter.get_stats()["decreases"] == 1
+
+
+def test_retry_after_blocks_the_deployment_within_the_deadline():
+    limiter = DeploymentLimiter("test", 0, 0, 8, {})
+    async def run():
+        with pytest.raises(Throttled):
+            await call(limiter, Throttled("30"))
+        with deadline_scope(1):
+            with pytest.raises(DeadlineExceeded):
+                await call(limiter)
+    asyncio.run(run())
+    assert limiter.get_stats()["blocked_for"] > 25
+
+
+def test_other_failures_leave_the_limit_alone():
+    limiter = DeploymentLimiter("test", 0, 0, 8, {})
+    async def run():
+        with pytest.raises(RuntimeError):
+            await call(limiter, RuntimeError("boom"))
+    asyncio.run(run())
+    assert limiter.limit == 8 and limiter.get_stats()["active"] == 0
+
+
+def test_token_bucket_waits_for_quota_and_takes_usage_corrections():
+    bucket = TokenBucket(600, 1)
+    assert bucket.capacity == 10 and bucket.wait_time(10) == 0
+    bucket.take(10)
+    assert bucket.wait_time(5) == pytest.approx(0.5)
+    # the call used fewer tokens than estimated
+    bucket.adjust(4)
+    assert bucket.wait_time(5) == pytest.approx(0.1)
+    assert TokenBucket(0, 1).wait_time(10 ** 6) == 0
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"retry-after": "7"}, 7),
+    ({}, None),
+])
+def test_retry_after_headers(headers, expected):
+    error = SimpleNamespace(response=SimpleNamespace(headers=headers))
+    assert get_retry_after(error) == expected
@@ -0,0 +1,89 @@
+import logging
+import pytest
+from types import SimpleNamespace
+from src.model import response_cache
+from src.model.response_cache import ResponseCache
+
+LOG = logging.getLogger("test")
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    return clock
+
+def ask(content: str) -> list:
+    return [{"role": "user", "content": content}]
+
+QUESTION = ask("什么是 inode")
+
+
+def test_same_request_hits_and_a_different_one_misses(clock):
+    cache = ResponseCache({}, LOG)
+    key, response = cache.get("gpt-4o", QUESTION, None)
+    assert response is None
+    cache.put(key, "索引节点")
+    assert cache.get("gpt-4o", QUESTION, None) == (key, "索引节点")
+    # model, messages and tools are all part of the key
+    assert cache.get("gpt-4o-mini", QUESTION, None)[1] is None
+    assert cache.get("gpt-4o", ask("什么是 dentry"), None)[1] is None
+    assert cache.get("gpt-4o", QUESTION, [{"name": "run_script"}])[1] is None
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 4, 1)
+
+
+def test_expired_response_misses(clock):
+    cache = ResponseCache({"RESPONSE_CACHE_TTL": 10}, LOG)
+    key, _ = cache.get("gpt-4o", QUESTION, None)
+    cache.put(key, "索引节点")
+    cache.put("other", "短期", ttl=1)
+    clock.now += 5
+    assert cache.get("gpt-4o", QUESTION, None)[1] == "索引节点"
+    clock.now += 6
+    assert cache.get("gpt-4o", QUESTION, None)[1] is None
+    assert cache.get_stats()["size"] == 1
+
+
+def test_least_recently_used_response_is_evicted(clock):
+    cache = ResponseCache({"RESPONSE_CACHE_SIZE": 2}, LOG)
+    for content in ("a", "b"):
+        key, _ = cache.get("gpt-4o", ask(content), None)
+        cache.put(key, content.upper())
+    assert cache.get("gpt-4o", ask("a"), None)[1] == "A"
+    key, _ = cache.get("gpt-4o", ask("c"), None)
+    cache.put(key, "C")
+    assert cache.get("gpt-4o", ask("b"), None)[1] is None
+    assert cache.get("gpt-4o", ask("a"), None)[1] == "A"
+    assert cache.get_stats()["size"] == 2
+
+
+def test_turns_with_tool_results_bypass_the_cache(clock):
+    cache = ResponseCache({}, LOG)
+    for message in ({"role": "tool", "content": "42%"}, SimpleNamespace(role="function", content="42%")):
+        assert cache.get("gpt-4o", [*QUESTION, message], None) == (None, None)
+    cache.put(None, "ignored")
+    stats = cache.get_stats()
+    assert (stats["bypasses"], stats["misses"], stats["size"]) == (2, 0, 0)
+
+
+def test_responses_survive_a_restart_in_the_db(clock, tmp_path):
+    config = {"RESPONSE_CACHE_DB": str(tmp_path / "responses.db"), "RESPONSE_CACHE_TTL": 10}
+    cache = ResponseCache(config, LOG)
+    key, _ = cache.get("gpt-4o", QUESTION, None)
+    cache.put(key, {"content": "索引节点"})
+    restarted = ResponseCache(config, LOG)
+    assert restarted.get("gpt-4o", QUESTION, None)[1] == {"content": "索引节点"}
+    assert restarted.get_stats()["disk_hits"] == 1
+    clock.now += 11
+    assert ResponseCache(config, LOG).get("gpt-4o", QUESTION, None)[1] is None
+
+
+def test_disabled_cache_never_answers(clock):
+    cache = ResponseCache({"RESPONSE_CACHE_ENABLED": False}, LOG)
+    assert cache.get("gpt-4o", QUESTION, None) == (None, None)
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import threading
+import numpy as np
+from types import SimpleNamespace
+from chat_history import ChatHistory
+from src.assistant.MutiAssistant import MultiAssistant
+from src.assistant.MyAssistant import MyAssistant
+from src.assistant.router import QuestionRouter, ROUTE_SIMPLE
+from src.assistant.worker_pool import WorkerPool
+from src.embedding.embedder import BaseEmbedder
+from src.executor.schd_exec import SchedulerExecutor
+from src.model.base_model import STREAM_DELTA, STREAM_DONE
+
+LOG = logging.getLogger("test")
+CONFIG = {"ROUTER_ENABLED": False}
+
+class FakeModel:
+    def __init__(self):
+        self.prompts = []
+    def reply(self, messages, content):
+        self.prompts.append(messages)
+        return SimpleNamespace(finish_reason="stop", message=SimpleNamespace(content=content, tool_calls=None))
+    async def aask(self, messages, tools_definitions):
+        return SimpleNamespace(choices=[self.reply(messages, "web02 还有 3GB")])
+    async def astream(self, messages, tools_definitions):
+        yield {"type": STREAM_DELTA, "content": "web02 还有 3GB"}
+        choice = self.reply(messages, "web02 还有 3GB")
+        yield {"type": STREAM_DONE, "finish_reason": choice.finish_reason, "message": choice.message}
+
+class FakeExecutor:
+    def get_prompt(self):
+        return "worker prompt"
+    def get_context(self):
+        return ""
+    def get_tool_definition(self):
+        return []
+
+class ThreadEmbedder(BaseEmbedder):
+    """Labels every text the same, records the thread it ran on."""
+    def __init__(self):
+        super().__init__({}, LOG)
+        self.threads = []
+    def embed(self, texts):
+        self.threads.append(threading.get_ident())
+        return np.ones((len(texts), 4), dtype=np.float32) / 2
+
+def fast_path_assistant(model: FakeModel) -> MultiAssistant:
+    def create_worker():
+        worker = MyAssistant(ChatHistory(CONFIG), CONFIG, LOG)
+        worker.set_executor(FakeExecutor())
+        worker.set_model(model)
+        return worker
+    executor = SchedulerExecutor.__new__(SchedulerExecutor)
+    executor.pool = WorkerPool(CONFIG, LOG, create_worker)
+    assistant = MultiAssistant(ChatHistory(CONFIG), CONFIG, LOG)
+    assistant.set_scheduler(SimpleNamespace(executor=executor))
+    assistant.router = QuestionRouter({"ROUTER_EMBEDDINGS": False}, LOG)
+    assistant.update_chat_history("web01 的内存够用吗", "web01 还有 12GB")
+    return assistant
+
+
+def test_fast_path_worker_sees_the_session_history():
+    model = FakeModel()
+    assistant = fast_path_assistant(model)
+    async def run():
+        answer = await assistant.aask_with_scheduler("web02 内存呢")
+        streamed = [delta async for _, delta in assistant.astream_with_scheduler("web03 内存呢")]
+        return answer, streamed
+    answer, streamed = asyncio.run(run())
+    assert answer == "web02 还有 3GB" and streamed == ["web02 还有 3GB"]
+    for prompt in model.prompts:
+        assert [message["content"] for message in prompt[1:3]] == ["web01 的内存够用吗", "web01 还有 12GB"]
+    # the session records each turn once, the pooled workers come back empty
+    assert len(assistant.chat_history.history) == 6
+    assert all(not worker.chat_history.history and worker.record_history for worker, _ in assistant.scheduler.executor.pool.idle)
+
+
+def test_router_embeds_off_the_event_loop():
+    embedder = ThreadEmbedder()
+    router = QuestionRouter({}, LOG, embedder)
+    async def run():
+        return await router.aroute("web01 最近怎么样"), threading.get_ident()
+    route, loop_thread = asyncio.run(run())
+    assert route == ROUTE_SIMPLE
+    assert embedder.threads[-1] != loop_thread
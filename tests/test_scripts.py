@@ -0,0 +1,48 @@
+import asyncio
+from src.executor import executor as executor_module
+from src.executor.executor import Executor
+from src.executor.output_capture import SCRIPT_TIMEOUT_MESSAGE
+from tests.conftest import run_bounded
+
+def test_timed_out_command_still_writing_is_killed():
+    result, elapsed = run_bounded(Executor().arun_script(["bash", "-c", "yes"], timeout=1))
+    assert result.startswith(f"{SCRIPT_TIMEOUT_MESSAGE} after 1 seconds.")
+    assert elapsed < 5
+
+
+def test_cancelled_command_still_writing_is_killed():
+    async def run():
+        task = asyncio.ensure_future(Executor().arun_script(["bash", "-c", "yes >&2"], timeout=30))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return "cancelled"
+    result, elapsed = run_bounded(run())
+    assert result == "cancelled" and elapsed < 5
+
+
+def test_finished_command_keeps_its_output_and_exit_code():
+    result, _ = run_bounded(Executor().arun_script(["bash", "-c", "echo out; echo err >&2; exit 3"], timeout=5))
+    assert "out" in result and "err" in result and "3" in result
+    assert not result.startswith(SCRIPT_TIMEOUT_MESSAGE)
+
+
+def test_output_flowing_at_the_timeout_stays_bounded():
+    executor = Executor()
+    executor.max_output_bytes = 4096
+    result, elapsed = run_bounded(executor.arun_script(["bash", "-c", "seq 1 1000000000"], timeout=1))
+    assert result.startswith(SCRIPT_TIMEOUT_MESSAGE)
+    assert result.split("\n")[1:4] == ["1", "2", "3"]
+    assert "output truncated" in result
+    assert len(result) < 3 * executor.max_output_bytes
+    assert elapsed < 5
+
+
+def test_pipes_held_by_an_escaped_process_do_not_hang_the_kill(monkeypatch):
+    monkeypatch.setattr(executor_module, "KILL_DRAIN_TIMEOUT", 0.5)
+    script = "echo started; setsid sleep 5 & sleep 100"
+    result, elapsed = run_bounded(Executor().arun_script(["bash", "-c", script], timeout=1))
+    assert result.startswith(SCRIPT_TIMEOUT_MESSAGE) and "started" in result
+    assert elapsed < 4
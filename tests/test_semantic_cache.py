@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import pytest
+from chat_history import ChatHistory
+from src.assistant.MutiAssistant import MultiAssistant
+from src.const import TASK_TIMEOUT
+from src.embedding import semantic_cache
+from src.embedding.embedder import LocalEmbedder
+from src.embedding.semantic_cache import PLAN_CACHE, SemanticCache
+
+LOG = logging.getLogger("test")
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(semantic_cache.time, "time", clock)
+    return clock
+
+def make_cache(prefix: str = semantic_cache.SEMANTIC_CACHE, **config) -> SemanticCache:
+    return SemanticCache(config, LOG, LocalEmbedder({}, LOG), prefix)
+
+
+def test_similar_question_hits_and_other_question_misses(clock):
+    cache = make_cache()
+    cache.store("web01 的磁盘使用率是多少", "web01 磁盘使用率 42%")
+    assert cache.lookup("web01 的磁盘使用率是多少？") == "web01 磁盘使用率 42%"
+    assert cache.lookup("列出 kube-system 下的 pod") is None
+    assert asyncio.run(cache.alookup("web01 的磁盘使用率是多少")) == "web01 磁盘使用率 42%"
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 1, 1)
+
+
+def test_expired_answers_are_skipped_and_their_slot_reused(clock):
+    cache = make_cache(SEMANTIC_CACHE_TTL=10, SEMANTIC_CACHE_SIZE=1)
+    cache.store("磁盘使用率", "42%")
+    clock.now += 11
+    assert cache.lookup("磁盘使用率") is None
+    cache.store("内存使用率", "61%")
+    assert cache.lookup("内存使用率") == "61%"
+    assert cache.get_stats()["evictions"] == 0
+
+
+def test_least_recently_used_answer_is_evicted(clock):
+    cache = make_cache(SEMANTIC_CACHE_SIZE=2)
+    cache.store("磁盘使用率", "42%")
+    clock.now += 1
+    cache.store("内存使用率", "61%")
+    clock.now += 1
+    assert cache.lookup("磁盘使用率") == "42%"
+    clock.now += 1
+    cache.store("系统负载", "0.5")
+    assert cache.lookup("内存使用率") is None
+    assert cache.lookup("磁盘使用率") == "42%"
+    assert cache.lookup("系统负载") == "0.5"
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_empty_answers_are_not_stored(clock):
+    cache = make_cache()
+    cache.store("磁盘使用率", "")
+    assert cache.lookup("磁盘使用率") is None
+    assert cache.get_stats()["stores"] == 0
+
+
+def test_plan_cache_reads_its_own_config():
+    cache = make_cache(PLAN_CACHE, PLAN_CACHE_TTL=5, SEMANTIC_CACHE_TTL=7)
+    assert (cache.ttl, cache.threshold) == (5, semantic_cache.DEFAULT_PLAN_THRESHOLD)
+
+
+def make_planning_assistant(results: list):
+    config = {"ROUTER_ENABLED": False}
+    assistant = MultiAssistant(ChatHistory(config), config, LOG)
+    assistant.plan_cache = make_cache(PLAN_CACHE)
+    plans, executed = [], []
+    async def plan(question):
+        plans.append(question)
+        return "工作列表：\n任务1: 查询 web01 磁盘使用率"
+    async def execute(tasks_description):
+        executed.append(tasks_description)
+        return results.pop(0)
+    async def deliver(question, tasks_result, tasks_description):
+        return f"答案：{tasks_result}"
+    assistant.anlyze_requirements = plan
+    assistant.execute_tasks = execute
+    assistant.deliver_results = deliver
+    return assistant, plans, executed
+
+
+def test_plan_of_a_first_question_is_reused_in_a_new_session(clock):
+    assistant, plans, executed = make_planning_assistant(["42%", "43%", "44%"])
+    assert asyncio.run(assistant.aask_with_scheduler("web01 的磁盘使用率是多少")) == "答案：42%"
+    # a follow-up depends on the history, the manager plans it
+    asyncio.run(assistant.aask_with_scheduler("web01 的磁盘使用率是多少"))
+    assert len(plans) == 2
+    assistant.chat_history.clear_history()
+    # the cached plan is executed again, the answer reflects the new data
+    assert asyncio.run(assistant.aask_with_scheduler("web01 的磁盘使用率是多少？")) == "答案：44%"
+    assert len(plans) == 2 and executed[2] == executed[0]
+
+
+def test_plan_of_a_timed_out_execution_is_not_cached(clock):
+    assistant, plans, _ = make_planning_assistant([f"{TASK_TIMEOUT}: 1s", "42%"])
+    asyncio.run(assistant.aask_with_scheduler("web01 的磁盘使用率是多少"))
+    assistant.chat_history.clear_history()
+    asyncio.run(assistant.aask_with_scheduler("web01 的磁盘使用率是多少"))
+    assert len(plans) == 2
@@ -0,0 +1,60 @@
+import os
+import json
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# one service worker process: answers a question in a session with a fake model, prints what the manager was sent
+WORKER = r"""
+import sys, json, asyncio, logging
+from types import SimpleNamespace
+sys.path[:0] = [ROOT, ROOT + "/src"]
+from src.aiservice import AiService
+from src.assist_creator import AssistantCreator
+
+manager_prompts = []
+
+class FakeModel:
+    async def aask(self, messages, tools_definitions):
+        question = messages[-1]["content"]
+        if "当前阶段一" in question:
+            manager_prompts.append(messages)
+            content = "工作列表：\n任务1: 查看内存\n└─ 依赖关系: 无"
+        elif "当前阶段二" in question:
+            content = ANSWER
+        else:
+            content = "内存充足"
+        message = SimpleNamespace(content=content, tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(finish_reason="stop", message=message)])
+
+AssistantCreator.create_model = lambda self, model_type: FakeModel()
+config = {"SQL_CONN_STR": DB, "SERVICE_WORKERS": 2, "ROUTER_ENABLED": False, "SERVICE_COALESCE_ENABLED": False,
+          "MODEL_COALESCE_ENABLED": False, "RATE_LIMIT_ENABLED": False}
+
+async def main():
+    service = AiService(config, logging.getLogger("test"))
+    result = await service.ask(QUESTION, "shared")
+    await service.close()
+    print(json.dumps({"answer": result["answer"], "manager": manager_prompts}, ensure_ascii=False))
+
+asyncio.run(main())
+"""
+
+def run_worker(db: str, question: str, answer: str) -> dict:
+    script = f"ROOT = {ROOT!r}\nDB = {db!r}\nQUESTION = {question!r}\nANSWER = {answer!r}\n" + WORKER
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert output.returncode == 0, output.stderr
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def test_second_worker_continues_the_conversation(tmp_path):
+    db = str(tmp_path / "sessions.db")
+    first = run_worker(db, "web01 的内存够用吗", "web01 还有 12GB 可用内存")
+    assert first["answer"] == "web01 还有 12GB 可用内存"
+    # another process, only the db is shared
+    second = run_worker(db, "那 web02 呢", "web02 还有 3GB")
+    history = [message["content"] for message in second["manager"][0][1:-1]]
+    assert history == ["web01 的内存够用吗", "web01 还有 12GB 可用内存"]
+    # stage prompts stay out of the session history
+    assert all("当前阶段" not in content for content in history)
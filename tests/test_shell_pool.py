@@ -0,0 +1,62 @@
+import gc
+import os
+import asyncio
+import logging
+import pytest
+from src.executor.output_capture import OutputCapture, SCRIPT_TIMEOUT_MESSAGE
+from src.executor.shell_pool import ShellPool
+from tests.conftest import run_bounded
+
+LOG = logging.getLogger("test")
+
+def test_large_stderr_does_not_block_the_command():
+    async def run():
+        pool = ShellPool({"SHELL_POOL_SIZE": 1}, LOG)
+        stderr = OutputCapture(4096, 100)
+        result = await pool.run("seq 1 100000 >&2; echo ok", 10, OutputCapture(), stderr)
+        # the shell stays usable for the next command
+        again = await pool.run("echo again; exit 4", 10)
+        await pool.aclose()
+        return result, stderr, again
+    (stdout, stderr_text, returncode), stderr, again = run_bounded(run())[0]
+    assert (stdout, returncode) == ("ok\n", 0)
+    assert stderr.is_truncated() and stderr_text.startswith("1\n2\n")
+    assert again == ("again\n", "", 4)
+
+
+def test_timed_out_shell_still_writing_is_killed():
+    async def run():
+        pool = ShellPool({"SHELL_POOL_SIZE": 1}, LOG)
+        result = await pool.run("yes; yes >&2", 1)
+        stats = pool.get_stats()
+        after = await pool.run("echo ok", 5)
+        await pool.aclose()
+        return result, stats, after
+    (result, stats, after), elapsed = run_bounded(run())
+    assert result[1].startswith(SCRIPT_TIMEOUT_MESSAGE) and result[2] == -1
+    assert stats["recycled"] == 1 and stats["size"] == 0
+    assert after[0] == "ok\n"
+    assert elapsed < 6
+
+
+def test_shells_of_a_finished_loop_are_killed():
+    pool = ShellPool({"SHELL_POOL_SIZE": 1}, LOG)
+    async def run():
+        await pool.run("echo ok", 5)
+        return pool.idle._queue[0].process.pid
+    # the CLI runs a loop per question, each loop kills its shells when it ends
+    for _ in range(2):
+        pid = asyncio.run(run())
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+    assert pool.get_stats()["started"] == 2 and pool.get_stats()["size"] == 0
+
+
+def test_collected_garbage_does_not_close_the_pool_of_a_running_loop():
+    pool = ShellPool({"SHELL_POOL_SIZE": 1}, LOG)
+    async def run():
+        await pool.run("echo ok", 5)
+        gc.collect()
+        return await pool.run("echo again", 5)
+    assert run_bounded(run())[0][0] == "again\n"
+    assert pool.get_stats()["started"] == 1
@@ -0,0 +1,32 @@
+import logging
+import pytest
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+from src.aiservice import AiService
+from src.assist_creator import AssistantCreator
+from src.deadline import DeadlineExceeded
+from src.httpserver import HttpServer
+from src.model.openai import OpenAI
+
+LOG = logging.getLogger("test")
+CONFIG = {"SERVICE_MODE": "single", "MODEL_NAME": "gpt", "AZURE_OPENAI_ENDPOINT": "https://example.openai.azure.com",
+          "AZURE_OPENAI_KEY": "key", "OPENAI_API_VERSION": "2024-06-01", "RATE_LIMIT_ENABLED": False,
+          "SERVICE_COALESCE_ENABLED": False, "MODEL_COALESCE_ENABLED": False, "RESPONSE_CACHE_ENABLED": False}
+
+def failing_model(error: Exception):
+    async def create(**kwargs):
+        raise error
+    model = OpenAI(CONFIG, LOG)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    model.get_async_client = lambda: client
+    return model
+
+@pytest.mark.parametrize("error", [DeadlineExceeded("Deadline exceeded after 1.0 seconds"), RuntimeError("429 Too Many Requests")])
+def test_model_stream_failure_reaches_the_client(monkeypatch, error):
+    monkeypatch.setattr(AssistantCreator, "create_model", lambda self, model_type: failing_model(error))
+    app = HttpServer(AiService(CONFIG, LOG), LOG, CONFIG).app
+    with TestClient(app) as client:
+        response = client.get("/AskStream", params={"question": "cpu usage?"})
+    assert "event: error" in response.text
+    assert str(error) in response.text
+    assert "event: done" not in response.text
@@ -0,0 +1,50 @@
+import logging
+import pytest
+from chat_history import ChatHistory
+from src.assistant.MutiAssistant import MultiAssistant
+from src.executor.task_graph import TaskGraph
+
+LOG = logging.getLogger("test")
+
+def test_independent_tasks_share_a_wave():
+    graph = TaskGraph(["任务1: 查看磁盘", "任务2: 查看内存", "任务3: 汇总磁盘和内存", "任务4: 给出建议"],
+                      [[], [], ["任务1", "任务2"], ["任务3", "任务3"]])
+    assert graph.waves() == [["任务1", "任务2"], ["任务3"], ["任务4"]]
+    assert graph.get_dependencies("任务4") == ["任务3"]
+    assert graph.has_dependencies()
+
+
+def test_tasks_without_an_id_are_numbered_by_position():
+    graph = TaskGraph(["查看磁盘", "查看内存"], [[], []])
+    assert graph.waves() == [["任务1", "任务2"]]
+    assert graph.get_task("任务2") == "查看内存"
+    assert not graph.has_dependencies()
+
+
+@pytest.mark.parametrize("tasks, dependencies", [
+    (["任务1: a", "任务2: b"], [["任务2"], ["任务1"]]),
+    (["任务1: a"], [["任务1"]]),
+    (["任务1: a", "任务2: b"], [[], ["任务3"]]),
+    (["任务1: a", "任务1: b"], [[], []]),
+    (["任务1: a"], [[], []]),
+])
+def test_invalid_plans_are_rejected(tasks, dependencies):
+    with pytest.raises(ValueError):
+        TaskGraph(tasks, dependencies)
+
+
+def test_unknown_successor_is_ignored_with_a_warning(caplog):
+    plan = """工作列表：
+任务1: 查看磁盘
+  └─ 依赖关系: 无，后置 任务2、任务5
+任务2: 清理日志
+  └─ 依赖关系: 无
+"""
+    config = {"ROUTER_ENABLED": False}
+    assistant = MultiAssistant(ChatHistory(config), config, LOG)
+    with caplog.at_level(logging.WARNING, "test"):
+        tasks, dependencies = assistant._parse_task_list2(plan)
+    assert tasks == ["任务1: 查看磁盘", "任务2: 清理日志"]
+    assert dependencies == [[], ["任务1"]]
+    assert "任务5" in caplog.text
+    assert TaskGraph(tasks, dependencies).waves() == [["任务1"], ["任务2"]]
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import pytest
+from types import SimpleNamespace
+from src.assistant.worker_pool import WorkerPool
+
+LOG = logging.getLogger("test")
+
+def make_pool(max_size: int) -> WorkerPool:
+    config = {"WORKER_POOL_MIN_SIZE": 0, "WORKER_POOL_MAX_SIZE": max_size}
+    return WorkerPool(config, LOG, lambda: SimpleNamespace(reset=lambda: None))
+
+
+def test_worker_of_a_previous_loop_frees_a_slot_of_that_loop():
+    pool = make_pool(1)
+    # the CLI runs a loop per question, a worker may come back after its loop ended
+    stale = asyncio.run(pool.acquire())
+    async def run():
+        current = await pool.acquire()
+        pool.release(stale)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.acquire(), 0.1)
+        pool.release(current)
+        return await asyncio.wait_for(pool.acquire(), 0.1)
+    assert asyncio.run(run()) is not None
+    assert pool.get_stats()["in_use"] == 1
+
+
+def test_released_workers_are_reused():
+    pool = make_pool(2)
+    async def run():
+        first = await pool.acquire()
+        pool.release(first)
+        return first, await pool.acquire()
+    first, second = asyncio.run(run())
+    assert first is second
+    assert pool.get_stats()["reused"] == 1